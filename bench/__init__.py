@@ -0,0 +1 @@
+"""Benchmarks that drive the real firmware through the host simulator (sim)."""
@@ -0,0 +1,138 @@
+"""Settle time calibration on a membrane with known per-column timings.
+
+Gives each simulated column line its own settle time and adds a little
+read noise, runs calibrate.py against it with 1 to 5 held, and compares
+what it found with the real settle times. Then types the single_keys and
+shift_combos workloads with the fixed settle time from code.py and with
+the calibration applied, reporting scan time and key latency for both.
+
+    python -m bench.calibration [--trials N] [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+
+import sim
+from sim import hardware, runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.latency import git_revision, score, summarize
+from bench.workloads import WORKLOADS
+
+COL_GPIOS = range(10, 15)
+# How long each column line really takes to settle, in microseconds
+COLUMN_SETTLE_US = (90, 140, 320, 60, 480)
+# Chance of any one line read coming out wrong
+GLITCH = 0.0005
+IDLE_SCANS = 200
+PROBE_KEYS = range(5)   # 1 to 5
+RUN_WORKLOADS = ("single_keys", "shift_combos")
+
+
+def set_up_membrane():
+    hardware.membrane.configure(
+        line_settle_ns={gpio: us * 1000 for gpio, us in zip(COL_GPIOS, COLUMN_SETTLE_US)},
+        glitch=GLITCH,
+    )
+
+
+def calibrate(trials):
+    firmware = sim.load_firmware()
+    set_up_membrane()
+    import calibrate
+    sim.use_clock(calibrate)
+
+    hardware.membrane.set_pressed(PROBE_KEYS)
+    start_ns = hardware.clock.monotonic_ns()
+    calibration = calibrate.calibrate(firmware.matrix, trials)
+    took_ms = (hardware.clock.monotonic_ns() - start_ns) / 1_000_000
+    hardware.membrane.set_pressed(())
+    return calibration, took_ms
+
+
+def scan_ms(matrix):
+    """Simulated time of one idle read_mask()."""
+    start_ns = hardware.clock.monotonic_ns()
+    for _ in range(IDLE_SCANS):
+        matrix.read_mask()
+    return (hardware.clock.monotonic_ns() - start_ns) / IDLE_SCANS / 1_000_000
+
+
+def load(calibration):
+    firmware = sim.load_firmware()
+    set_up_membrane()
+    if calibration is not None:
+        firmware.matrix.apply_calibration(calibration)
+    return firmware
+
+
+def type_workloads(calibration):
+    result = {"scan_ms": scan_ms(load(calibration).matrix)}
+    press = []
+    dropped = duplicated = strokes_typed = scans = sim_ns = 0
+    for name in RUN_WORKLOADS:
+        strokes = WORKLOADS[name]()
+        timeline = Timeline()
+        for stroke in strokes:
+            stroke.apply(timeline)
+        run = runner.run(timeline, firmware=load(calibration))
+        p, _, d, dup = score(strokes, key_events(run.reports))
+        press += p
+        dropped += d
+        duplicated += dup
+        strokes_typed += len(strokes)
+        scans += run.scans
+        sim_ns += run.sim_ns
+
+    result.update({
+        "strokes": strokes_typed,
+        "press_latency_ms": summarize(press),
+        "dropped": dropped,
+        "duplicated": duplicated,
+        "scans_per_second": scans * 1_000_000_000 / sim_ns if sim_ns else 0,
+    })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=40,
+                        help="reads per setting tried (calibrate.TRIALS on the board)")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    calibration, took_ms = calibrate(args.trials)
+    results = {
+        "revision": git_revision(),
+        "true_settle_us": list(COLUMN_SETTLE_US),
+        "calibration": calibration,
+        "calibration_ms": took_ms,
+        "fixed": type_workloads(None),
+        "calibrated": type_workloads(calibration),
+    }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"calibrated in {took_ms / 1000:.1f}s (simulated)")
+    print("column  true settle  calibrated settle  samples")
+    for c_index, true_us in enumerate(COLUMN_SETTLE_US):
+        print(f"{c_index:6}  {true_us:9}us  {calibration['settle_us'][c_index]:15}us"
+              f"  {calibration['samples'][c_index]:7}")
+    print()
+    print("          scan ms  scans/s  p50 ms  p99 ms  dropped  dup")
+    for name in ("fixed", "calibrated"):
+        r = results[name]
+        lat = r["press_latency_ms"]
+        print(f"{name:10} {r['scan_ms']:6.2f}  {r['scans_per_second']:7.0f}  "
+              f"{lat['p50']:6.1f}  {lat['p99']:6.1f}  {r['dropped']:7}  {r['duplicated']:3}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
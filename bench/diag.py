@@ -0,0 +1,132 @@
+"""Key logging on a slow serial console: every line at once, or a few a scan.
+
+Types every workload from bench.workloads with each print() taking
+PRINT_MS. It runs once with no log, once printing every log record at the
+next pause between scans (much as the loop used to print them straight
+away) and once printing LOG_LINES_PER_SCAN lines a pause. For each it
+reports the interval between scans, the press latency, the lines printed
+and the records dropped. It also times, on this host, keeping a key record
+against turning it into its line.
+
+    python -m bench.diag [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import sim
+from sim import hardware, runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.latency import git_revision, percentile, score, summarize
+from bench.workloads import WORKLOADS
+
+PRINT_MS = 20
+# Key log on, and lines printed a pause (0: all of them)
+MODES = {
+    "no log": (False, 0),
+    "at once": (True, 0),
+    "per scan": (True, 1),
+}
+
+
+def run_mode(log_keys, lines):
+    press = []
+    intervals = []
+    dropped = duplicated = printed = records_dropped = 0
+    for workload in WORKLOADS.values():
+        strokes = workload()
+        timeline = Timeline()
+        for stroke in strokes:
+            stroke.apply(timeline)
+
+        firmware = sim.load_firmware()
+        firmware.LOG_LINES_PER_SCAN = lines or firmware.diag.capacity
+        # Time every scan as it starts, and count the lines printed
+        starts = []
+        queue_scan = firmware.queue_scan
+
+        def timed_scan():
+            starts.append(hardware.clock.monotonic_ns())
+            queue_scan()
+
+        firmware.queue_scan = timed_scan
+        print_record = firmware.print_record
+        lines_out = []
+
+        def counted(kind, arg, mask):
+            lines_out.append(kind)
+            print_record(kind, arg, mask)
+
+        firmware.print_record = counted
+        result = runner.run(timeline, firmware=firmware, log_keys=log_keys, print_ms=PRINT_MS)
+        p, _, d, dup = score(strokes, key_events(result.reports))
+        press += p
+        dropped += d
+        duplicated += dup
+        printed += len(lines_out)
+        records_dropped += firmware.diag.dropped
+        intervals += [b - a for a, b in zip(starts, starts[1:])]
+
+    ms = [interval / 1_000_000 for interval in intervals]
+    return {
+        "scan_interval_ms": {"p50": percentile(ms, 50), "p99": percentile(ms, 99), "max": max(ms)},
+        "press_latency_ms": summarize(press),
+        "dropped": dropped,
+        "duplicated": duplicated,
+        "lines": printed,
+        "records_dropped": records_dropped,
+    }
+
+
+def record_cost(count=2000):
+    """Host microseconds to keep a key record, and to make its line."""
+    firmware = sim.load_firmware()
+    runner.use_key_log(firmware)
+    diag = firmware.diag
+    mask = firmware.CAPS_SHIFT_BIT | 1 << 5
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        diag.log(diag.level, firmware.RECORD_COMBO, 0, mask)
+        diag.count = 0
+    keep_ns = time.perf_counter_ns() - start
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        firmware.format_record(firmware.RECORD_COMBO, 0, mask)
+    format_ns = time.perf_counter_ns() - start
+    return {"keep_us": keep_ns / count / 1000, "format_us": format_ns / count / 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {
+        "revision": git_revision(),
+        "print_ms": PRINT_MS,
+        "modes": {name: run_mode(*mode) for name, mode in MODES.items()},
+        "record_cost": record_cost(),
+    }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("mode       scan p50  p99    max  press p50  p99  drop  dup  lines  records dropped")
+    for name, r in results["modes"].items():
+        scan, lat = r["scan_interval_ms"], r["press_latency_ms"]
+        print(f"{name:10} {scan['p50']:8.1f} {scan['p99']:5.1f} {scan['max']:6.1f} "
+              f"{lat['p50']:10.1f} {lat['p99']:5.1f} {r['dropped']:5} {r['duplicated']:4} "
+              f"{r['lines']:6} {r['records_dropped']:16}")
+    cost = results["record_cost"]
+    print(f"host time per key record: keep {cost['keep_us']:.2f}us, format {cost['format_us']:.2f}us")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
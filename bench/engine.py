@@ -0,0 +1,108 @@
+"""Cost of one KeyboardEngine.step() on this host, timed with timeit.
+
+Steps keyboard_engine.KeyboardEngine, with the keymap the firmware loads,
+through a few cycles of debounced scan masks, with no hardware or
+simulator involved: an idle scan, tapping a plain key, a CAPS SHIFT
+special key (cursor left), a shifted key that swaps the shifts, and three
+keys rolled over. For each it reports the microseconds per step (best of
+REPEAT runs of NUMBER cycles) and the HID ops per step.
+
+    python -m bench.engine [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import sim
+
+from bench.latency import git_revision
+
+NUMBER = 2000
+REPEAT = 5
+
+
+def make_engine():
+    sim.install()
+    from keyboard_engine import KeyboardEngine
+    from keymap import load_keymap, keymap_from_tables
+
+    keymap = load_keymap(os.path.join(sim.ROOT, "keymap.bin")) or keymap_from_tables()
+    return KeyboardEngine(keymap)
+
+
+def swap_key(engine):
+    """A shift and a key that swaps it for the other shift, as masks, or None."""
+    from keymap import CAPS_SHIFT_BIT, SYMBOL_SHIFT_BIT, ACTION_SWAP, MOD_CAPS, MOD_SYMBOL, KEY_COUNT
+
+    for mod, shift in ((MOD_CAPS, CAPS_SHIFT_BIT), (MOD_SYMBOL, SYMBOL_SHIFT_BIT)):
+        for idx in range(KEY_COUNT):
+            if engine.combo_actions[mod * KEY_COUNT + idx] == ACTION_SWAP:
+                return shift, 1 << idx
+    return None
+
+
+def scenarios(engine):
+    """Cycles of scan masks, each ending with no key held."""
+    from keymap import CAPS_SHIFT_BIT
+
+    swap = swap_key(engine)
+    key_a, key_b, key_c = 1 << 10, 1 << 11, 1 << 12   # A, S, D
+    cycles = {
+        "idle": (0,),
+        "tap": (key_a, 0),
+        "special key": (CAPS_SHIFT_BIT, CAPS_SHIFT_BIT | 1 << 4, CAPS_SHIFT_BIT, 0),
+        "rollover": (key_a, key_a | key_b, key_a | key_b | key_c, key_b | key_c, key_c, 0),
+    }
+    if swap is not None:
+        shift, bit = swap
+        cycles["shift swap"] = (shift, shift | bit, shift, 0)
+    return cycles
+
+
+def time_cycle(engine, masks):
+    """Best microseconds per step, and HID ops per step, over a cycle of masks."""
+    step = engine.step
+
+    def run():
+        for mask in masks:
+            step(mask)
+
+    ops = 0
+    for mask in masks:
+        count = step(mask)
+        ops += count or 0
+    best = min(timeit.repeat(run, number=NUMBER, repeat=REPEAT))
+    return {
+        "us_per_step": best / (NUMBER * len(masks)) * 1_000_000,
+        "ops_per_step": ops / len(masks),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    engine = make_engine()
+    results = {
+        "revision": git_revision(),
+        "scenarios": {name: time_cycle(engine, masks)
+                      for name, masks in scenarios(engine).items()},
+    }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("scenario      us/step  ops/step")
+    for name, r in results["scenarios"].items():
+        print(f"{name:12} {r['us_per_step']:8.2f} {r['ops_per_step']:9.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Adaptive scan rate benchmark: taps after growing idle gaps.
+
+Taps a key after idle gaps long enough to reach each of code.py's
+SCAN_TIERS, and reports for each tap the contact-to-HID latency and the
+scheduler's wake latency, then the time spent in each tier and how many
+full scans were run, against a fixed rate (only the first tier).
+
+    python -m bench.idle [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+
+import sim
+from sim import runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.latency import git_revision
+
+KEY = 10          # A
+GAPS_MS = (100, 1_000, 8_000, 40_000)
+HOLD_MS = 60
+
+
+def gaps_timeline():
+    timeline = Timeline()
+    taps = []
+    at_ms = 0
+    for gap_ms in GAPS_MS:
+        at_ms += gap_ms
+        timeline.tap(at_ms, KEY, HOLD_MS)
+        taps.append((gap_ms, at_ms))
+        at_ms += HOLD_MS
+    return timeline, taps
+
+
+def run(adaptive):
+    firmware = sim.load_firmware()
+    if not adaptive:
+        firmware.scheduler = firmware.ScanScheduler(firmware.SCAN_TIERS[:1], firmware.matrix)
+    scheduler = firmware.scheduler
+    timeline, taps = gaps_timeline()
+
+    result = runner.run(timeline, firmware=firmware)
+    downs = [at for at, keycode, pressed in key_events(result.reports) if pressed]
+    taps_out = []
+    for i, (gap_ms, at_ms) in enumerate(taps):
+        latency = (downs[i] / 1_000_000 - at_ms) if i < len(downs) else None
+        taps_out.append({"idle_ms": gap_ms, "latency_ms": latency})
+    return {
+        "taps": taps_out,
+        "tier_ms": dict(zip((f"{i * 1000:g}ms" for i in scheduler.intervals),
+                            scheduler.tier_ms)),
+        "wakes": scheduler.wakes,
+        "false_wakes": scheduler.false_wakes,
+        "wake_latency_max_ms": scheduler.wake_latency_max_ms,
+        "scans": result.scans,
+        "sim_ms": result.sim_ns // 1_000_000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision(), "fixed": run(False), "adaptive": run(True)}
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    for name in ("fixed", "adaptive"):
+        r = results[name]
+        taps = "  ".join(f"{t['idle_ms'] / 1000:g}s:{t['latency_ms']:.1f}ms"
+                         if t["latency_ms"] is not None else f"{t['idle_ms'] / 1000:g}s:-"
+                         for t in r["taps"])
+        tiers = "  ".join(f"{tier} {ms / 1000:.1f}s" for tier, ms in r["tier_ms"].items())
+        print(f"{name}: {r['scans']} scans in {r['sim_ms'] / 1000:.1f}s")
+        print(f"  press latency after idle  {taps}")
+        print(f"  time per tier             {tiers}")
+        print(f"  wakes {r['wakes']} ({r['false_wakes']} false), "
+              f"max wake latency {r['wake_latency_max_ms']}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
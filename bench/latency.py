@@ -0,0 +1,195 @@
+"""Scan-to-HID latency benchmark.
+
+Replays the typing workloads from bench.workloads through the real
+SpectrumMatrix and code.py loop on the simulated membrane, and reports
+press/release latency percentiles, scan rate, dropped or duplicated
+keystrokes, HID reports per key pressed, and the event ring's high-water
+mark and overflows.
+
+    python -m bench.latency [--runs 5] [--json results.json]
+
+Each run uses a different contact bounce pattern. Times are simulated
+(see sim.clock), so results are reproducible and comparable between
+commits; --cpu-scale adds scaled host CPU time on top.
+
+--pause-ms stalls the main loop every --pause-every-ms, as a GC pause or
+a slow print() would. --background scans with keypad.KeyMatrix instead
+of from the loop; the simulated keypad needs a fast membrane, so those
+runs use a 1us settle time.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from sim import runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.workloads import WORKLOADS
+
+# How long after a stroke's last release its keycode may still come up
+WINDOW_SLACK_MS = 100
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values_ns):
+    ms = [value / 1_000_000 for value in values_ns]
+    return {
+        "count": len(ms),
+        "p50": percentile(ms, 50),
+        "p95": percentile(ms, 95),
+        "p99": percentile(ms, 99),
+        "max": max(ms) if ms else None,
+    }
+
+
+def score(strokes, events):
+    """Match HID key events to strokes. Returns latencies and error counts."""
+    press_latencies = []
+    release_latencies = []
+    dropped = 0
+    duplicated = 0
+
+    for stroke in strokes:
+        start = min(at for at, _ in stroke.press) * 1_000_000
+        end = stroke.end_ns + WINDOW_SLACK_MS * 1_000_000
+        downs = [at for at, keycode, pressed in events
+                 if keycode == stroke.expect and pressed and start <= at <= end]
+        ups = [at for at, keycode, pressed in events
+               if keycode == stroke.expect and not pressed and start <= at <= end]
+
+        if not downs:
+            dropped += 1
+            continue
+        if len(downs) > 1:
+            duplicated += len(downs) - 1
+        press_latencies.append(max(0, downs[0] - stroke.contact_ns))
+
+        ups = [at for at in ups if at >= stroke.release_ns]
+        if ups:
+            release_latencies.append(ups[-1] - stroke.release_ns)
+
+    return press_latencies, release_latencies, dropped, duplicated
+
+
+def run_workload(name, runs, cpu_scale, background=False, pause_every_ms=0,
+                 pause_ms=0):
+    strokes = WORKLOADS[name]()
+    timeline = Timeline()
+    for stroke in strokes:
+        stroke.apply(timeline)
+
+    press, release = [], []
+    dropped = duplicated = scans = reports = 0
+    ring_high_water = ring_overflows = keystrokes = 0
+    sim_ns = host_ns = 0
+    for seed in range(runs):
+        result = runner.run(timeline, seed=seed, cpu_scale=cpu_scale,
+                            settle_us=1 if background else runner.SETTLE_US,
+                            background=background, pause_every_ms=pause_every_ms,
+                            pause_ms=pause_ms)
+        p, r, d, dup = score(strokes, key_events(result.reports))
+        press += p
+        release += r
+        dropped += d
+        duplicated += dup
+        scans += result.scans
+        reports += len(result.reports)
+        keystrokes += result.firmware.engine.keystrokes
+        ring = result.firmware.event_ring
+        ring_high_water = max(ring_high_water, ring.high_water)
+        ring_overflows += ring.overflows
+        sim_ns += result.sim_ns
+        host_ns += result.host_ns
+
+    return {
+        "strokes": len(strokes) * runs,
+        "press_latency_ms": summarize(press),
+        "release_latency_ms": summarize(release),
+        "dropped": dropped,
+        "duplicated": duplicated,
+        "scans": scans,
+        "reports": reports,
+        "keystrokes": keystrokes,
+        "reports_per_keystroke": reports / keystrokes if keystrokes else 0,
+        "ring_high_water": ring_high_water,
+        "ring_overflows": ring_overflows,
+        "scans_per_second": scans * 1_000_000_000 / sim_ns if sim_ns else 0,
+        "host_scans_per_second": scans * 1_000_000_000 / host_ns if host_ns else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'workload':15} {'p50':>7} {'p95':>7} {'p99':>7} {'rel p50':>8} "
+          f"{'rel p99':>8} {'drop':>5} {'dup':>4} {'scans/s':>8} {'rep/key':>7} {'ring':>5} {'ovf':>4}")
+    for name, r in results["workloads"].items():
+        p, rl = r["press_latency_ms"], r["release_latency_ms"]
+
+        def ms(value):
+            return f"{value:7.1f}" if value is not None else "      -"
+
+        print(f"{name:15} {ms(p['p50'])} {ms(p['p95'])} {ms(p['p99'])} "
+              f"{ms(rl['p50']):>8} {ms(rl['p99']):>8} {r['dropped']:5} "
+              f"{r['duplicated']:4} {r['scans_per_second']:8.1f} "
+              f"{r['reports_per_keystroke']:7.2f} "
+              f"{r['ring_high_water']:5} {r['ring_overflows']:4}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="bounce patterns per workload")
+    parser.add_argument("--workload", action="append", choices=sorted(WORKLOADS),
+                        help="only run these workloads")
+    parser.add_argument("--cpu-scale", type=float, default=0)
+    parser.add_argument("--background", action="store_true",
+                        help="scan with keypad.KeyMatrix in the background")
+    parser.add_argument("--pause-every-ms", type=float, default=0)
+    parser.add_argument("--pause-ms", type=float, default=0,
+                        help="stall the main loop this long every --pause-every-ms")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {
+        "revision": git_revision(),
+        "runs": args.runs,
+        "cpu_scale": args.cpu_scale,
+        "background": args.background,
+        "pause_every_ms": args.pause_every_ms,
+        "pause_ms": args.pause_ms,
+        "workloads": {},
+    }
+    for name in args.workload or WORKLOADS:
+        results["workloads"][name] = run_workload(
+            name, args.runs, args.cpu_scale, background=args.background,
+            pause_every_ms=args.pause_every_ms, pause_ms=args.pause_ms)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
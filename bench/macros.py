@@ -0,0 +1,160 @@
+"""Keyword macro throughput, and physical keys typed while one plays.
+
+Holds both shifts (MACRO_CHORD) and taps a run of keyword keys, so that a
+long string is queued at once. Meanwhile the digit keys, which have no
+keyword, are tapped after the chord is let go. For each report rate it
+reports the characters per second the host sees and checks the text typed.
+It also gives the press latency of the digits and how many of them were
+dropped. Since the taps limit how fast keywords are queued, the rate of a
+single long string is measured on its own, as "string chars/s".
+
+    python -m bench.macros [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+
+import sim
+from sim import runner
+from sim.hid import MODIFIER_BASE, key_events, report_keys
+from sim.timeline import Timeline
+
+from bench.latency import git_revision, score, summarize
+from bench.workloads import tap
+
+CAPS_SHIFT = 25
+SYMBOL_SHIFT = 36
+SHIFT = MODIFIER_BASE + 1
+# P O I U Y J K L H, tapped 80ms apart with the chord held from 0ms
+KEYWORD_KEYS = (20, 21, 22, 23, 24, 33, 32, 31, 34)
+KEY_GAP_MS = 80
+CHORD_AT_MS = (0, 30)
+DIGITS = (0, 1, 2, 3, 4, 15, 16, 17, 18, 19)
+DIGIT_GAP_MS = 150
+RATES = (50, 100, 250, 1000)
+SLOWEST_SCAN_MS = 20
+STRING = "10 PRINT \"HELLO\": GO TO 10\n" * 8
+
+
+def keyword_timeline():
+    timeline = Timeline()
+    start_ms = CHORD_AT_MS[-1] + 30
+    timeline.press(CHORD_AT_MS[0], CAPS_SHIFT)
+    timeline.press(CHORD_AT_MS[1], SYMBOL_SHIFT)
+    at_ms = start_ms
+    for key in KEYWORD_KEYS:
+        timeline.tap(at_ms, key, KEY_GAP_MS - 30)
+        at_ms += KEY_GAP_MS
+    timeline.release(at_ms, CAPS_SHIFT)
+    timeline.release(at_ms, SYMBOL_SHIFT)
+
+    sim.install()
+    from adafruit_hid.keycode import Keycode
+    digit_codes = (Keycode.ONE, Keycode.TWO, Keycode.THREE, Keycode.FOUR, Keycode.FIVE,
+                   Keycode.ZERO, Keycode.NINE, Keycode.EIGHT, Keycode.SEVEN, Keycode.SIX)
+    strokes = []
+    at_ms += 100
+    for key, expect in zip(DIGITS, digit_codes):
+        strokes.append(tap(at_ms, key, expect))
+        at_ms += DIGIT_GAP_MS
+    for stroke in strokes:
+        stroke.apply(timeline)
+    return timeline, strokes
+
+
+def decoder(ascii_keycodes):
+    """Map encoded characters (see macros.encode) back to text."""
+    return {ascii_keycodes[code]: chr(code) for code in range(128) if ascii_keycodes[code]}
+
+
+def typed_text(reports, chars, shifted):
+    """The characters the host sees typed, and when, from the reports."""
+    text = []
+    times = []
+    held = set()
+    for at_ns, report in reports:
+        keys = report_keys(report)
+        for keycode in keys - held:
+            if keycode < MODIFIER_BASE:
+                encoded = keycode | (shifted if SHIFT in keys else 0)
+                text.append(chars.get(encoded, "?"))
+                times.append(at_ns)
+        held = keys
+    return "".join(text), times
+
+
+def string_rate(rate):
+    """Characters per second typing STRING, queued all at once."""
+    firmware = sim.load_firmware()
+    firmware.macro_player = firmware.MacroPlayer(firmware.keyboard, rate)
+    import macros
+
+    firmware.macro_player.play(macros.encode(STRING))
+    # Long enough for two reports a character (a repeated character needs
+    # an extra one), at the rate or the scan rate, whichever is slower
+    tail_ms = 2 * len(STRING) * max(1000 // rate, SLOWEST_SCAN_MS) + 100
+    result = runner.run(Timeline(), firmware=firmware, tail_ms=tail_ms)
+    text, times = typed_text(result.reports, decoder(macros.ASCII_KEYCODES), macros.SHIFTED)
+    if text != STRING or firmware.macro_player.pending:
+        return 0
+    return (len(times) - 1) * 1_000_000_000 / (times[-1] - times[0])
+
+
+def run(rate):
+    firmware = sim.load_firmware()
+    firmware.engine.macro_chord = firmware.CAPS_SHIFT_BIT | firmware.SYMBOL_SHIFT_BIT
+    firmware.macro_player = firmware.MacroPlayer(firmware.keyboard, rate)
+    import macros
+
+    timeline, strokes = keyword_timeline()
+    result = runner.run(timeline, firmware=firmware)
+
+    chars = decoder(macros.ASCII_KEYCODES)
+    expected = "".join(chars[byte] for key in KEYWORD_KEYS for byte in macros.KEYWORDS[key])
+    text, times = typed_text(result.reports, chars, macros.SHIFTED)
+    # The digits go out too, in among the keywords; keep just the keywords
+    digits = set("1234567890")
+    keyword_times = [at for char, at in zip(text, times) if char not in digits]
+    text = "".join(char for char in text if char not in digits)
+
+    chars = len(text)
+    span_ns = keyword_times[-1] - keyword_times[0] if chars > 1 else 0
+    press, _, dropped, duplicated = score(strokes, key_events(result.reports))
+    return {
+        "reports_per_second": rate,
+        "chars": chars,
+        "text_ok": text == expected,
+        "chars_per_second": (chars - 1) * 1_000_000_000 / span_ns if span_ns else 0,
+        "string_chars_per_second": string_rate(rate),
+        "digits": len(strokes),
+        "digit_latency_ms": summarize(press),
+        "digits_dropped": dropped,
+        "digits_duplicated": duplicated,
+        "overflows": firmware.macro_player.overflows,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision(), "rates": [run(rate) for rate in RATES]}
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("reports/s  chars  text  chars/s  string chars/s  digit p50 ms  p99 ms  dropped  dup")
+    for r in results["rates"]:
+        lat = r["digit_latency_ms"]
+        print(f"{r['reports_per_second']:9}  {r['chars']:5}  {'ok' if r['text_ok'] else 'BAD':4}  "
+              f"{r['chars_per_second']:7.1f}  {r['string_chars_per_second']:14.1f}  {lat['p50']:12.1f}  {lat['p99']:6.1f}  "
+              f"{r['digits_dropped']:7}  {r['digits_duplicated']:3}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Where the time goes: code.py's stage profiler over every workload.
+
+Types every workload from bench.workloads with PROFILE on and the key log
+printing to a console where each print() takes PRINT_MS, and sums the
+stage times (see profiler.py). With --clock board the stages are timed on
+the simulated clock, which only moves for the board's sleeps: the settle
+and recovery waits of a scan, the waits between scans and slow prints.
+With --clock host they are timed on this host's clock, which shows what
+the Python costs; there the scan's read also holds the simulated membrane.
+
+Prints a table of the stages and, with --folded, writes each stage's own
+time as folded stacks for flamegraph.pl or speedscope.
+
+    python -m bench.profile [--clock board|host] [--tasks] [--folded out.folded] [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import sim
+from sim import runner
+from sim.timeline import Timeline
+
+from bench.latency import git_revision
+from bench.workloads import WORKLOADS
+
+PRINT_MS = 20
+
+
+def run(clock, tasks):
+    """Profile every workload; returns the firmware's profiler.StageProfiler, summed."""
+    total = None
+    for workload in WORKLOADS.values():
+        timeline = Timeline()
+        for stroke in workload():
+            stroke.apply(timeline)
+
+        firmware = sim.load_firmware()
+        profiler = runner.use_profiler(firmware)
+        if clock == "host":
+            sim.use_clock(sys.modules["profiler"], time)
+        runner.run(timeline, firmware=firmware, tasks=tasks, log_keys=True, print_ms=PRINT_MS)
+        if total is None:
+            total = profiler
+            continue
+        for stage in range(len(total.names)):
+            total.counts[stage] += profiler.counts[stage]
+            total.totals_us[stage] += profiler.totals_us[stage]
+            total.mins_us[stage] = min(total.mins_us[stage], profiler.mins_us[stage])
+            total.maxes_us[stage] = max(total.maxes_us[stage], profiler.maxes_us[stage])
+        for slot in range(len(total.histograms)):
+            total.histograms[slot] += profiler.histograms[slot]
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clock", choices=("board", "host"), default="board",
+                        help="time stages on the simulated board clock or the host's")
+    parser.add_argument("--tasks", action="store_true", help="run code.py's asyncio tasks")
+    parser.add_argument("--folded", help="write folded stacks to this file")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    profiler = run(args.clock, args.tasks)
+    stages = {}
+    for stage, name in enumerate(profiler.names):
+        count = profiler.counts[stage]
+        if count:
+            stages[name] = {
+                "count": count,
+                "total_us": profiler.totals_us[stage],
+                "min_us": profiler.mins_us[stage],
+                "mean_us": profiler.totals_us[stage] / count,
+                "max_us": profiler.maxes_us[stage],
+                "histogram": profiler.histogram(stage),
+            }
+    results = {
+        "revision": git_revision(),
+        "clock": args.clock,
+        "tasks": args.tasks,
+        "print_ms": PRINT_MS,
+        "stages": stages,
+    }
+    if args.folded:
+        with open(args.folded, "w") as f:
+            profiler.folded(lambda line: print(line, file=f))
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    all_us = sum(r["total_us"] for name, r in stages.items() if ";" not in name)
+    print(f"clock {args.clock}, {'tasks' if args.tasks else 'loop'}")
+    print("stage                count      min      mean       max   share")
+    for name, r in stages.items():
+        share = r["total_us"] / all_us * 100 if all_us else 0
+        print(f"{name:16} {r['count']:9} {r['min_us']:8} {r['mean_us']:9.1f} "
+              f"{r['max_us']:9} {share:6.1f}%")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
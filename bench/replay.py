@@ -0,0 +1,95 @@
+"""Replaying raw scan captures: same keys as the live run, and how fast.
+
+Types every workload from bench.workloads on the simulator with CAPTURE
+recording its raw scans, then replays the capture through code.py with
+sim.replay. For each it reports the scans and the size of the capture,
+whether the replay sent the same key events in the same order as the live
+run, and how many scans a second the replay decodes on this host (best of
+REPEATS). --trace replays a capture from a keyboard instead.
+
+    python -m bench.replay [--trace trace.scan] [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+
+from sim import replay
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.latency import git_revision
+from bench.workloads import WORKLOADS
+
+REPEATS = 5
+
+
+def keys(reports):
+    return [(keycode, pressed) for _, keycode, pressed in key_events(reports)]
+
+
+def throughput(data):
+    """Best replay rate of a capture on this host, in scans/s, and its key events."""
+    best = 0
+    for _ in range(REPEATS):
+        result = replay.replay(data)
+        best = max(best, result.host_scans_per_second)
+    return best, keys(result.reports)
+
+
+def run_workload(workload):
+    timeline = Timeline()
+    for stroke in workload():
+        stroke.apply(timeline)
+    data, live = replay.capture(timeline)
+    rate, replayed = throughput(data)
+    return {
+        "scans": live.scans,
+        "records": len(replay.read_trace(data)),
+        "bytes": len(data),
+        "same_keys": replayed == keys(live.reports),
+        "live_scans_per_s": live.host_scans_per_second,
+        "replay_scans_per_s": rate,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="replay this capture instead of the workloads")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision()}
+    if args.trace:
+        with open(args.trace, "rb") as f:
+            data = f.read()
+        rate, replayed = throughput(data)
+        results["trace"] = {
+            "records": len(replay.read_trace(data)),
+            "bytes": len(data),
+            "key_events": len(replayed),
+            "replay_scans_per_s": rate,
+        }
+    else:
+        results["workloads"] = {name: run_workload(w) for name, w in WORKLOADS.items()}
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    if args.trace:
+        r = results["trace"]
+        print(f"{args.trace}: {r['records']} records, {r['bytes']} bytes, "
+              f"{r['key_events']} key events, {r['replay_scans_per_s']:.0f} scans/s replayed")
+    else:
+        print("workload        scans  records  bytes  same keys  live scans/s  replay scans/s")
+        for name, r in results["workloads"].items():
+            print(f"{name:14} {r['scans']:6} {r['records']:8} {r['bytes']:6} "
+                  f"{'yes' if r['same_keys'] else 'NO':>10} {r['live_scans_per_s']:13.0f} "
+                  f"{r['replay_scans_per_s']:15.0f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
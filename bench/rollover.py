@@ -0,0 +1,135 @@
+"""Rollover stress benchmark: hold down all 40 matrix positions at once.
+
+Presses every key one after another, CAPS SHIFT and SYMBOL SHIFT last,
+holds them all, then lets go in reverse order. Runs with the 6-key boot
+report and with N-key rollover (NKRO in boot.py).
+
+Every report sent is checked against the keycodes the firmware has
+pressed at that point. A keycode pressed but missing from the report is
+dropped. Note that once a shift joins the 38 other keys the whole lot is
+one Spectrum combination (CAPS SHIFT + 1 is EDIT), so the firmware itself
+lets go of the rest; what matters is that the host sees what it sends.
+
+    python -m bench.rollover [--json results.json]
+
+The simulated membrane has ghosting off for this, as if it had diodes,
+and the firmware's ghost blocking is off to match: with no diodes,
+pressing a whole row would ghost the rest of the matrix in before its
+keys are pressed, which says nothing about the HID side.
+"""
+
+import argparse
+import json
+import sys
+
+import sim
+from sim import runner
+from sim.hid import report_keys
+from sim.timeline import Timeline
+
+from bench.latency import git_revision
+
+GAP_MS = 40
+HOLD_MS = 300
+SHIFTS = (25, 36)
+MODES = {
+    "6kro": {"nkro": False},
+    "nkro": {"nkro": True},
+}
+
+
+def all_keys_timeline():
+    """Press all 40 positions in turn, hold, release in reverse."""
+    order = [idx for idx in range(40) if idx not in SHIFTS] + list(SHIFTS)
+    timeline = Timeline()
+    for step, idx in enumerate(order):
+        timeline.press(step * GAP_MS, idx)
+    release_at = len(order) * GAP_MS + HOLD_MS
+    for step, idx in enumerate(reversed(order)):
+        timeline.release(release_at + step * GAP_MS, idx)
+    return timeline
+
+
+def watch_reports(keyboard):
+    """Track the keycodes the firmware presses and check each report sent.
+
+    Returns (dropped keycodes, most keycodes in one report), filled in as
+    the firmware runs.
+    """
+    pressed = set()
+    dropped = set()
+    most = [0]
+    press, release, release_all, send = (
+        keyboard.press, keyboard.release, keyboard.release_all, keyboard.send)
+
+    def watched_press(keycode):
+        pressed.add(keycode)
+        press(keycode)
+
+    def watched_release(keycode):
+        pressed.discard(keycode)
+        release(keycode)
+
+    def watched_release_all():
+        pressed.clear()
+        release_all()
+
+    def watched_send():
+        keys = report_keys(keyboard.report)
+        most[0] = max(most[0], len(keys))
+        dropped.update(pressed - keys)
+        return send()
+
+    keyboard.press = watched_press
+    keyboard.release = watched_release
+    keyboard.release_all = watched_release_all
+    keyboard.send = watched_send
+    return dropped, most
+
+
+def run_mode(nkro):
+    firmware = sim.load_firmware(nkro=nkro)
+    firmware.matrix.ghost_filter = None
+    dropped, most = watch_reports(firmware.keyboard)
+    timeline = all_keys_timeline()
+    result = runner.run(timeline, firmware=firmware, ghosting=False)
+
+    seen = set()
+    for _, report in result.reports:
+        seen |= report_keys(report)
+    return {
+        "positions": 40,
+        "report": type(firmware.keyboard).__name__,
+        "most_held": most[0],
+        "dropped": len(dropped),
+        "keycodes_seen": len(seen),
+        "reports": len(result.reports),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision(), "modes": {}}
+    for name, options in MODES.items():
+        results["modes"][name] = run_mode(**options)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+    print(f"{'mode':10} {'report':12} {'most held':>9} {'dropped':>8} "
+          f"{'keycodes seen':>14} {'reports':>8}")
+    for name, r in results["modes"].items():
+        print(f"{name:10} {r['report']:12} {r['most_held']:9} {r['dropped']:8} "
+              f"{r['keycodes_seen']:14} {r['reports']:8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if results["modes"]["nkro"]["dropped"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
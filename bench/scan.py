@@ -0,0 +1,110 @@
+"""Full-matrix scan time for each row reader backend.
+
+Builds a SpectrumMatrix on the simulated membrane with the per-pin
+(PinRows) and single-register (RegisterRows) row readers, checks that
+they read identical bitmasks for random key sets, and reports the time
+of one read_mask() for a range of settle times: simulated time (what the
+board spends sleeping and settling) and host CPU time per scan.
+
+    python -m bench.scan [--json results.json]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import sim
+from sim import hardware
+
+ROW_GPIOS = range(2, 10)
+COL_GPIOS = range(10, 15)
+SETTLE_US = (1200, 300, 150, 80)
+SCANS = 200
+TARGET_MS = 1.0
+
+
+def make_matrix(reader_name, settle_us):
+    sim.install()
+    import board
+    import matrix_scanner
+    sim.use_clock(matrix_scanner)
+
+    row_pins = [getattr(board, f"GP{gpio}") for gpio in ROW_GPIOS]
+    col_pins = [getattr(board, f"GP{gpio}") for gpio in COL_GPIOS]
+    matrix = matrix_scanner.SpectrumMatrix(row_pins, col_pins, settle_us=settle_us)
+    if reader_name == "RegisterRows":
+        matrix.row_reader = matrix_scanner.RegisterRows(ROW_GPIOS[0], len(ROW_GPIOS))
+        matrix._read_rows = matrix.row_reader.read
+    return matrix
+
+
+def key_sets(count, seed=0):
+    rng = random.Random(seed)
+    sets = [(), (), (25,), (36, 37)]
+    while len(sets) < count:
+        sets.append(tuple(rng.sample(range(40), rng.randint(0, 3))))
+    return sets
+
+
+def time_reader(reader_name, settle_us, pressed_sets):
+    hardware.reset()
+    # An ideal membrane that settles within the configured time
+    hardware.membrane.configure(bounce_ns=0, settle_ns=settle_us * 1000 // 2)
+    matrix = make_matrix(reader_name, settle_us)
+
+    masks = []
+    sim_start = hardware.clock.monotonic_ns()
+    host_ns = 0
+    for keys in pressed_sets:
+        hardware.membrane.set_pressed(keys)
+        start = time.perf_counter_ns()
+        masks.append(matrix.read_mask())
+        host_ns += time.perf_counter_ns() - start
+    sim_ns = hardware.clock.monotonic_ns() - sim_start
+
+    scans = len(pressed_sets)
+    return masks, {
+        "sim_ms_per_scan": sim_ns / scans / 1_000_000,
+        "host_us_per_scan": host_ns / scans / 1_000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    pressed_sets = key_sets(SCANS)
+    results = {"scans": SCANS, "target_ms": TARGET_MS, "settle_us": {}}
+    mismatches = 0
+    for settle_us in SETTLE_US:
+        per_reader = {}
+        masks = {}
+        for reader_name in ("PinRows", "RegisterRows"):
+            masks[reader_name], per_reader[reader_name] = time_reader(
+                reader_name, settle_us, pressed_sets)
+        mismatches += sum(a != b for a, b in zip(masks["PinRows"], masks["RegisterRows"]))
+        results["settle_us"][settle_us] = per_reader
+    results["mismatches"] = mismatches
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"{'settle':>8} {'reader':14} {'sim ms/scan':>12} {'host us/scan':>13}")
+        for settle_us, per_reader in results["settle_us"].items():
+            for reader_name, r in per_reader.items():
+                flag = "" if r["sim_ms_per_scan"] < TARGET_MS else "  over target"
+                print(f"{settle_us:6}us {reader_name:14} {r['sim_ms_per_scan']:12.3f} "
+                      f"{r['host_us_per_scan']:13.1f}{flag}")
+        print(f"readers disagreed on {mismatches} scans")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
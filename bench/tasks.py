@@ -0,0 +1,112 @@
+"""Scan cadence with the plain loop and with the asyncio tasks.
+
+Types every workload from bench.workloads with code.py's plain loop and
+with its asyncio tasks (USE_TASKS), first on a quiet host and then with a
+host that only takes a report every HOST_POLL_MS, a serial console where
+each print() takes PRINT_MS, and both. For each it reports the interval
+between scans (p50, p99, max), the press latency, and dropped and
+duplicated keys. For the tasks it also gives how late scans started
+against SCAN_PERIOD_MS, from code.py's cadence instrumentation.
+
+    python -m bench.tasks [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+
+import sim
+from sim import hardware, runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+from bench.latency import git_revision, percentile, score, summarize
+from bench.workloads import WORKLOADS
+
+HOST_POLL_MS = 16
+PRINT_MS = 20
+SCENARIOS = {
+    "quiet": {},
+    "slow_host": {"host_poll_ms": HOST_POLL_MS},
+    "slow_console": {"log_keys": True, "print_ms": PRINT_MS},
+    "both": {"host_poll_ms": HOST_POLL_MS, "log_keys": True, "print_ms": PRINT_MS},
+}
+
+
+def run_scenario(tasks, options):
+    press = []
+    intervals = []
+    dropped = duplicated = 0
+    late = None
+    for name, workload in WORKLOADS.items():
+        strokes = workload()
+        timeline = Timeline()
+        for stroke in strokes:
+            stroke.apply(timeline)
+
+        firmware = sim.load_firmware()
+        # Time every scan as it starts, from the loop or the scan task alike
+        starts = []
+        queue_scan = firmware.queue_scan
+
+        def timed_scan():
+            starts.append(hardware.clock.monotonic_ns())
+            queue_scan()
+
+        firmware.queue_scan = timed_scan
+        result = runner.run(timeline, firmware=firmware, tasks=tasks, **options)
+        p, _, d, dup = score(strokes, key_events(result.reports))
+        press += p
+        dropped += d
+        duplicated += dup
+        intervals += [b - a for a, b in zip(starts, starts[1:])]
+        if tasks:
+            cadence = firmware.cadence
+            if late is None:
+                late = [0] * len(cadence.late_counts)
+            late = [total + count for total, count in zip(late, cadence.late_counts)]
+
+    ms = [interval / 1_000_000 for interval in intervals]
+    return {
+        "scan_interval_ms": {
+            "p50": percentile(ms, 50),
+            "p99": percentile(ms, 99),
+            "max": max(ms),
+        },
+        "press_latency_ms": summarize(press),
+        "dropped": dropped,
+        "duplicated": duplicated,
+        "late_histogram": late,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = {"revision": git_revision(), "scenarios": {}}
+    for scenario, options in SCENARIOS.items():
+        results["scenarios"][scenario] = {
+            "loop": run_scenario(False, options),
+            "tasks": run_scenario(True, options),
+        }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print("scenario      mode   scan p50  p99    max  press p50  p99   drop  dup  "
+          "late 0/1/2-3/4-7/8-15/16+ms")
+    for scenario, modes in results["scenarios"].items():
+        for mode, r in modes.items():
+            scan, lat = r["scan_interval_ms"], r["press_latency_ms"]
+            late = "/".join(map(str, r["late_histogram"])) if r["late_histogram"] else "-"
+            print(f"{scenario:13} {mode:5} {scan['p50']:8.1f} {scan['p99']:5.1f} {scan['max']:6.1f} "
+                  f"{lat['p50']:10.1f} {lat['p99']:5.1f} {r['dropped']:5} {r['duplicated']:4}  {late}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
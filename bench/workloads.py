@@ -0,0 +1,110 @@
+"""Typing workloads for the benchmarks.
+
+Each workload is a list of strokes. A stroke presses some keys and
+releases them, and names the HID keycode the host should see for it:
+
+    Stroke(at_ms, press=((at_ms, key), ...), release=((at_ms, key), ...),
+           expect=keycode)
+
+Press latency is measured from the last key of the stroke making contact
+to the expected keycode going down; release latency from the first key
+released to it going up.
+"""
+
+from sim import install
+
+install()
+
+from adafruit_hid.keycode import Keycode  # noqa: E402  (needs the stubs path)
+
+
+class Stroke:
+    def __init__(self, press, release, expect):
+        self.press = tuple(press)
+        self.release = tuple(release)
+        self.expect = expect
+
+    @property
+    def contact_ns(self):
+        return max(at for at, _ in self.press) * 1_000_000
+
+    @property
+    def release_ns(self):
+        return min(at for at, _ in self.release) * 1_000_000
+
+    @property
+    def end_ns(self):
+        return max(at for at, _ in self.release) * 1_000_000
+
+    def apply(self, timeline):
+        for at_ms, key in self.press:
+            timeline.press(at_ms, key)
+        for at_ms, key in self.release:
+            timeline.release(at_ms, key)
+
+
+def tap(at_ms, key, expect, hold_ms=60):
+    return Stroke(((at_ms, key),), ((at_ms + hold_ms, key),), expect)
+
+
+def combo(at_ms, shift, key, expect, lead_ms=30, hold_ms=60):
+    """Hold a shift, then tap a key while it is held."""
+    return Stroke(((at_ms, shift), (at_ms + lead_ms, key)),
+                  ((at_ms + lead_ms + hold_ms, key),
+                   (at_ms + lead_ms + hold_ms + 20, shift)),
+                  expect)
+
+
+def single_keys(gap_ms=150):
+    keys = (("H", Keycode.H), ("E", Keycode.E), ("L", Keycode.L), ("O", Keycode.O),
+            ("W", Keycode.W), ("R", Keycode.R), ("D", Keycode.D), ("1", Keycode.ONE),
+            ("0", Keycode.ZERO), ("ENTER", Keycode.ENTER), ("SPACE", Keycode.SPACE),
+            ("M", Keycode.M))
+    return [tap(n * gap_ms, key, expect) for n, (key, expect) in enumerate(keys)]
+
+
+def shift_combos(gap_ms=250):
+    combos = (
+        ("CAPS SHIFT", "5", Keycode.LEFT_ARROW),
+        ("CAPS SHIFT", "8", Keycode.RIGHT_ARROW),
+        ("CAPS SHIFT", "7", Keycode.UP_ARROW),
+        ("CAPS SHIFT", "6", Keycode.DOWN_ARROW),
+        ("CAPS SHIFT", "0", Keycode.BACKSPACE),
+        ("CAPS SHIFT", "SPACE", Keycode.ESCAPE),
+        ("CAPS SHIFT", "1", Keycode.INSERT),
+        ("CAPS SHIFT", "A", Keycode.A),
+        ("SYMBOL SHIFT", "P", Keycode.P),
+        ("SYMBOL SHIFT", "Z", Keycode.Z),
+        ("SYMBOL SHIFT", "2", Keycode.TWO),
+        ("CAPS SHIFT", "SYMBOL SHIFT", Keycode.TAB),
+    )
+    return [combo(n * gap_ms, shift, key, expect)
+            for n, (shift, key, expect) in enumerate(combos)]
+
+
+def fast_rollover(gap_ms=45, hold_ms=90):
+    """Each key goes down before the previous one comes up."""
+    keys = (("Q", Keycode.Q), ("W", Keycode.W), ("E", Keycode.E), ("R", Keycode.R),
+            ("T", Keycode.T), ("Y", Keycode.Y), ("U", Keycode.U), ("I", Keycode.I),
+            ("O", Keycode.O), ("P", Keycode.P))
+    return [tap(n * gap_ms, key, expect, hold_ms)
+            for n, (key, expect) in enumerate(keys)]
+
+
+def held_modifier(gap_ms=120):
+    """CAPS SHIFT held down through a run of letters."""
+    keys = (("Z", Keycode.Z), ("X", Keycode.X), ("C", Keycode.C), ("V", Keycode.V),
+            ("B", Keycode.B), ("N", Keycode.N), ("M", Keycode.M))
+    strokes = [tap(50 + n * gap_ms, key, expect) for n, (key, expect) in enumerate(keys)]
+    end_ms = 50 + len(keys) * gap_ms
+    strokes.append(Stroke(((0, "CAPS SHIFT"),), ((end_ms, "CAPS SHIFT"),),
+                          Keycode.SHIFT))
+    return strokes
+
+
+WORKLOADS = {
+    "single_keys": single_keys,
+    "shift_combos": shift_combos,
+    "fast_rollover": fast_rollover,
+    "held_modifier": held_modifier,
+}
@@ -0,0 +1,23 @@
+# Runs once at power-up, before USB starts.
+# NKRO adds a keyboard that can report every key held at once (N-key
+# rollover), next to the standard one. code.py uses it if it's there and
+# takes reports, and falls back to the standard keyboard's 6-key report
+# otherwise. Changes here only take effect after a hard reset.
+#
+# Neither keyboard is a boot device, so a BIOS won't see them. To be one
+# the keyboard would have to be USB interface 0, which means turning off
+# the serial console and CIRCUITPY; CircuitPython starts in safe mode
+# otherwise. Off until it has been tried on the board.
+
+NKRO = False
+
+if NKRO:
+    from hid_output import enable_nkro
+    enable_nkro()
+
+# Open a second USB serial port, for CAPTURE = "serial" in code.py
+CAPTURE_SERIAL = False
+
+if CAPTURE_SERIAL:
+    import usb_cdc
+    usb_cdc.enable(console=True, data=True)
@@ -0,0 +1,141 @@
+"""Measure how long each column of the membrane takes to settle.
+
+Every column is read over and over with shorter and shorter settle times
+to find the least that still reads reliably, and then the fewest reads to
+vote on at that settle time. The results are saved for SpectrumMatrix to
+load at boot (see matrix_scanner.load_calibration).
+
+Hold down 1, 2, 3, 4 and 5 (the top row, one key on every column) and
+run it from the REPL:
+
+    import calibrate
+    from code import matrix
+    calibrate.run(matrix)
+
+or set CALIBRATE = True in code.py. CircuitPython can only write the file
+when boot.py has remounted CIRCUITPY writable; otherwise the result is
+printed, ready to be saved as calibration.json by hand.
+"""
+
+import json
+import time
+
+from matrix_scanner import CALIBRATION_FILE, MAX_SAMPLES, SAMPLE_GAP_US, majority
+
+# Settle times tried, shortest first, in microseconds
+SETTLE_STEPS_US = (10, 20, 50, 100, 150, 200, 300, 400, 600, 800, 1200, 1600, 2400, 3200)
+
+# Reads of a column that must all come out right for a setting to pass
+TRIALS = 40
+
+# Headroom added to the shortest settle time that passed, for temperature
+# and ageing of the membrane
+MARGIN = 1.5
+
+# The row of the keys held down while calibrating (1 to 5)
+PROBE_ROW = 0
+
+
+def reliable(matrix, c_index, settle_us, samples, trials=TRIALS):
+    """Whether column c_index reads just the probe row, trials times in a row.
+
+    Each read must also let the rows recover within the settle time after
+    the column is released, or the next column would see this one's keys.
+    """
+    settle = settle_us / 1_000_000
+    expect = 1 << PROBE_ROW
+    reads = bytearray(MAX_SAMPLES)
+    for _ in range(trials):
+        if matrix.read_column(c_index, settle, samples) != expect:
+            return False
+        time.sleep(settle)
+        for i in range(samples):
+            reads[i] = matrix.rows_low()
+        if majority(reads, samples, matrix.row_count):
+            return False
+    return True
+
+
+def calibrate_column(matrix, c_index, trials=TRIALS):
+    """Return (settle_us, samples) for one column, or None if nothing passed."""
+    # Voting on the most reads filters out noise, so this finds the time
+    # the lines themselves take
+    for settle_us in SETTLE_STEPS_US:
+        if reliable(matrix, c_index, settle_us, MAX_SAMPLES, trials):
+            break
+    else:
+        return None
+
+    settle_us = int(settle_us * MARGIN + 0.5)
+    for samples in range(1, MAX_SAMPLES + 1):
+        if reliable(matrix, c_index, settle_us, samples, trials):
+            return settle_us, samples
+    return settle_us, MAX_SAMPLES
+
+
+def calibrate(matrix, trials=TRIALS):
+    """Calibrate every column. Returns the dict SpectrumMatrix.apply_calibration() takes.
+
+    Raises ValueError if a column never read reliably, which usually means
+    one of the keys wasn't held down.
+    """
+    settle_us = []
+    samples = []
+    for c_index in range(matrix.col_count):
+        result = calibrate_column(matrix, c_index, trials)
+        if result is None:
+            raise ValueError("column %d never read reliably" % c_index)
+        settle_us.append(result[0])
+        samples.append(result[1])
+    return {"settle_us": settle_us, "samples": samples, "sample_gap_us": SAMPLE_GAP_US}
+
+
+def save(calibration, path=CALIBRATION_FILE):
+    with open(path, "w") as f:
+        json.dump(calibration, f)
+
+
+def wait_for_probe_keys(matrix, timeout=30):
+    """Wait until every key on the probe row reads held. Returns False on timeout."""
+    expect = 1 << PROBE_ROW
+    settle = max(SETTLE_STEPS_US) / 1_000_000
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        held = 0
+        for c_index in range(matrix.col_count):
+            if matrix.read_column(c_index, settle, MAX_SAMPLES) == expect:
+                held += 1
+            time.sleep(settle)
+        if held == matrix.col_count:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def run(matrix, path=CALIBRATION_FILE, trials=TRIALS):
+    """Calibrate, apply the result to matrix and save it. Returns the calibration.
+
+    Returns None, leaving matrix as it was, if the keys weren't held or a
+    column never read reliably.
+    """
+    print("Calibrating: hold down 1, 2, 3, 4 and 5")
+    if not wait_for_probe_keys(matrix):
+        print("Calibration cancelled, keys 1 to 5 weren't held")
+        return None
+
+    try:
+        calibration = calibrate(matrix, trials)
+    except ValueError as e:
+        print("Calibration failed,", e)
+        return None
+    matrix.apply_calibration(calibration)
+    for c_index in range(matrix.col_count):
+        print("column %d: settle %d us, %d sample(s)" % (
+            c_index, calibration["settle_us"][c_index], calibration["samples"][c_index]))
+    try:
+        save(calibration, path)
+        print("Saved to", path)
+    except OSError:
+        print("CIRCUITPY is read-only; save this as", path)
+        print(json.dumps(calibration))
+    return calibration
@@ -1,22 +1,167 @@
 import time
 import board
 import usb_hid
-from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keycode import Keycode
-
-from matrix_scanner import SpectrumMatrix
-from lookup_tables import (
-    pc_mode, 
-    spectrum_mode,
-    SPECTRUM_KEY_NAMES,
-    CAPS_SHIFT_COMBOS,
-    SYMBOL_SHIFT_COMBOS,
-    SPECIAL_KEY_HID_MAP,
-    SWAP_MODIFIERS
+from micropython import const
+
+from matrix_scanner import (
+    SpectrumMatrix,
+    KeypadMatrix,
+    RegisterRows,
+    SCAN_STAGES,
+    load_calibration,
+)
+from debouncer import Debouncer
+from event_ring import EventRing
+from ghosting import GhostFilter
+from scan_scheduler import ScanScheduler, Cadence, WAKE_POLL
+from hid_output import open_keyboard, ReportQueue
+from macros import MacroPlayer, KEYWORDS
+from keymap import (
+    load_keymap,
+    keymap_from_tables,
+    CAPS_SHIFT_BIT,
+    SYMBOL_SHIFT_BIT,
+)
+from keyboard_engine import (
+    KeyboardEngine,
+    indices_of,
+    OP_PRESS,
+    OP_RELEASE,
+    OP_RELEASE_ALL,
+    OP_KEYWORD,
+    OP_COMMAND,
+    OP_KIND,
+    OP_ARG,
+    RECORD_COMBO,
+    RECORD_LAYER,
+)
+
+# The keymap compiled from lookup_tables.py by tools/compile_keymap.py.
+# Without keymap.bin the tables are built at boot instead, which takes
+# longer and more memory.
+keymap = load_keymap()
+if keymap is None:
+    keymap = keymap_from_tables()
+pc_mode = keymap.modes[0]
+spectrum_mode = keymap.modes[1]
+
+# Choose your mode switch pin (optional). A switch from this pin to ground
+# selects spectrum_mode while closed and pc_mode while open.
+mode_switch = None  # you can add a GPIO for switching modes, e.g. board.GP15
+
+# Keys that, held together, move on to the next layer (pc_mode, then
+# spectrum_mode, then back), or None. For example CAPS_SHIFT_BIT |
+# SYMBOL_SHIFT_BIT makes EXTEND MODE switch layers instead of sending TAB.
+LAYER_COMBO = None
+
+# Keys that, held together, make the next key pressed type its Spectrum
+# keyword (P: PRINT, J: LOAD "" and so on, see macros.KEYWORDS), or None.
+# CAPS_SHIFT_BIT | SYMBOL_SHIFT_BIT works like the Spectrum's extended
+# mode, but then takes the place of EXTEND MODE and can't also be
+# LAYER_COMBO. MACRO_REPORTS_PER_SECOND caps how fast keywords are typed.
+MACRO_CHORD = None
+MACRO_REPORTS_PER_SECOND = 100
+
+# Diagnostics: 0 none (the logging code is compiled out), 1 lost events
+# and keywords, 2 also layer changes, 3 also every key combination
+# pressed, which imports the key names at boot. Records are kept in binary
+# and only turned into text and printed between scans while no key is
+# down, LOG_LINES_PER_SCAN lines at a time.
+LOG_LEVEL = const(1)
+LOG_LINES_PER_SCAN = 1
+
+# Log every key combination pressed. Names are only built when this is
+# on, and then only as the log is printed; the HID path works purely on
+# indices.
+LOG_KEYS = LOG_LEVEL >= 3
+
+# Pause between scans of the main loop while typing, in seconds
+LOOP_SLEEP = 0.001
+
+# Scan less often the longer the keyboard is idle: (idle ms, pause between
+# scans in seconds). While idle, any key pressed wakes it straight back up
+# to the first tier.
+SCAN_TIERS = (
+    (0, LOOP_SLEEP),
+    (500, 0.005),
+    (5_000, 0.020),
+    (30_000, 0.050),
 )
 
-# Choose your mode switch pin (optional)
-mode_switch = None  # you can add a GPIO for switching modes
+# Print the scan rate tier instrumentation this often, in seconds (0: never)
+SCAN_STATS_EVERY = 0
+
+# Time each stage of the work (see profiler.py and PROFILE_STAGES below):
+# 0 off, and the timing code is compiled out. The times are printed while
+# no key is down, after PROFILE_COMBO or after typing "p" on the serial
+# console.
+PROFILE = const(0)
+# Keys that, held together, print the stage times, or None. For example
+# CAPS_SHIFT_BIT | SYMBOL_SHIFT_BIT | 1 << 20 (P).
+PROFILE_COMBO = None
+
+# Record every raw scan of the matrix, to replay on a PC with sim.replay:
+# None, a file name (boot.py must have made CIRCUITPY writable), or
+# "serial" for the second USB serial port (CAPTURE_SERIAL in boot.py).
+# Records are written out between scans while no key is down.
+CAPTURE = None
+
+# Scan, decode and send to the host in separate asyncio tasks, so a slow
+# host or serial console can't hold up scanning. Needs the asyncio and
+# adafruit_ticks libraries in lib/; without them the plain loop is used.
+USE_TASKS = True
+# With the tasks, scans start this often (in ms) while typing: a little
+# over a full scan at settle_us=1200. Lower it after calibrating.
+SCAN_PERIOD_MS = 7
+# Reports waiting for the host, at most. When it's full, decoding waits
+# and events build up in event_ring instead.
+HID_QUEUE_DEPTH = 8
+
+asyncio = None
+if USE_TASKS:
+    try:
+        import asyncio
+    except ImportError:
+        print("asyncio not available, running the plain loop")
+
+if LOG_LEVEL:
+    from diag_log import DiagLog, KIND_DROPPED, LEVEL_WARN
+
+# Kinds of diagnostic record, see format_record(). 0 is KIND_DROPPED, 1 to
+# 3 (RECORD_COMBO to RECORD_LAYER) are kept by the engine.
+RECORD_RESYNC = const(4)     # Events were lost; arg: how many (255: more)
+RECORD_KEYWORD_DROPPED = const(5)  # Macro queue full; arg: key index
+
+# Stages timed with PROFILE. A name holds the stages it runs within,
+# separated by ";".
+STAGE_SCAN = const(0)     # queue_scan(): a scan and queueing its events
+STAGE_READ = const(1)     # The matrix's SCAN_STAGES, within the scan
+STAGE_SEND = const(4)     # send_and_report(): one batch of events
+STAGE_KEYS = const(5)     # The engine's step: combinations and keycodes
+STAGE_REPORT = const(6)   # Passing its ops to the report, keyboard.send()
+STAGE_LOG = const(7)      # Keeping the key log records
+STAGE_MACRO = const(8)    # macro_player.service()
+STAGE_HOST = const(9)     # hid_task passing a queued report to the host
+STAGE_PRINT = const(10)   # Printing the log
+STAGE_WAIT = const(11)    # Waiting for the next scan, in the plain loop
+PROFILE_STAGES = (
+    ("scan",)
+    + tuple("scan;" + name for name in SCAN_STAGES)
+    + ("send", "send;keys", "send;report", "send;log", "macro", "host", "print", "wait")
+)
+
+def load_key_names():
+    """Import the names the key log prints."""
+    global keycode_name, SPECTRUM_KEY_NAMES, CAPS_SHIFT_COMBOS, SYMBOL_SHIFT_COMBOS
+    from keycode_names import keycode_name
+    from lookup_tables import (
+        SPECTRUM_KEY_NAMES,
+        CAPS_SHIFT_COMBOS,
+        SYMBOL_SHIFT_COMBOS,
+    )
+
+if LOG_KEYS:
+    load_key_names()
 
 def get_spectrum_key_name(pressed_indices):
     """Get the Spectrum key name for a combination of pressed keys."""
@@ -64,362 +209,483 @@ def get_spectrum_key_name(pressed_indices):
             names.append(f"KEY_{idx}")
     return " + ".join(names)
 
-def get_keycode_name(keycode, matrix_idx=None, pressed_indices=None):
-    """Get a readable name for a keycode, optionally with Spectrum key name."""
-    # Get PC keycode name
-    pc_name = None
-    
-    # Try to get the name attribute
-    if hasattr(keycode, 'name'):
-        pc_name = keycode.name
-    
-    # If no name attribute, try to find it by value in Keycode class
-    if not pc_name:
-        keycode_value = int(keycode) if hasattr(keycode, '__int__') else keycode
-        for attr_name in dir(Keycode):
-            if not attr_name.startswith('_'):
-                attr_value = getattr(Keycode, attr_name)
-                if isinstance(attr_value, int) and attr_value == keycode_value:
-                    pc_name = attr_name
-                    break
-        
-        # Fallback to showing the numeric value
-        if not pc_name:
-            pc_name = f"KEYCODE_{keycode_value}"
-    
-    # If we have pressed indices, try to get the Spectrum combination name
-    if pressed_indices is not None and len(pressed_indices) > 0:
-        spectrum_name = get_spectrum_key_name(pressed_indices)
-        if spectrum_name:
-            return f"{spectrum_name} ({pc_name})"
-    
-    # If we have a matrix index, also show the Spectrum key name
-    if matrix_idx is not None and matrix_idx < len(SPECTRUM_KEY_NAMES):
-        spectrum_name = SPECTRUM_KEY_NAMES[matrix_idx]
-        if spectrum_name != pc_name:  # Only show both if they're different
-            return f"{spectrum_name} ({pc_name})"
-    
-    return pc_name
-
-keyboard = Keyboard(usb_hid.devices)
-
-# Set up the matrix
-matrix = SpectrumMatrix(
-    row_pins=(
-        board.GP2,
-        board.GP3,
-        board.GP4,
-        board.GP5,
-        board.GP6,
-        board.GP7,
-        board.GP8,
-        board.GP9,
-    ),
-    col_pins=(
-        board.GP10,
-        board.GP11,
-        board.GP12,
-        board.GP13,
-        board.GP14,
-    ),
-    settle_us=1200  # Settle time - increased for more reliable sampling
+# Key changes are collected in the report and sent once per scan. N-key
+# rollover if boot.py enabled it, else the 6-key boot report.
+keyboard = open_keyboard(usb_hid.devices)
+
+# Types keywords in the background, a report per scan at most
+macro_player = MacroPlayer(keyboard, MACRO_REPORTS_PER_SECOND)
+
+# Debounce thresholds, in scans. A key must read pressed in this many
+# consecutive scans before it counts as pressed, and released likewise.
+DEBOUNCE_PRESS_SCANS = 2
+DEBOUNCE_RELEASE_SCANS = 3
+
+# Block keys that could be phantoms: with no diodes in the membrane, three
+# corners of a rectangle pressed make the fourth read pressed as well
+GHOST_BLOCKING = True
+
+# Scan in the background with keypad.KeyMatrix, so a slow loop can't miss
+# keys. Off by default: keypad only waits about a microsecond after driving
+# a line, much less than settle_us below, so try it on your membrane first.
+BACKGROUND_SCAN = False
+BACKGROUND_SCAN_INTERVAL = 0.005  # Seconds between background scans
+
+# Measure each column's settle time at start-up and save it to
+# calibration.json, which is loaded at every boot after (see calibrate.py).
+# Hold down 1 to 5 while it runs.
+CALIBRATE = False
+
+ROW_PINS = (
+    board.GP2,
+    board.GP3,
+    board.GP4,
+    board.GP5,
+    board.GP6,
+    board.GP7,
+    board.GP8,
+    board.GP9,
 )
 
-prev = [0] * matrix.key_count
-last_reported_key = None
-modifier_press_time = {}  # Track when modifiers were pressed to allow combo detection
-sent_keycodes = {}  # Track which keycodes we've sent (by matrix index) to allow releasing if needed
+COL_PINS = (
+    board.GP10,
+    board.GP11,
+    board.GP12,
+    board.GP13,
+    board.GP14,
+)
 
-# Buffer to track key states over multiple iterations for more reliable detection
-key_state_buffer = []  # List of recent scan results
-BUFFER_SIZE = 4  # Number of iterations to buffer (increased for more reliable detection)
+matrix = None
+if BACKGROUND_SCAN:
+    try:
+        matrix = KeypadMatrix(
+            ROW_PINS,
+            COL_PINS,
+            interval=BACKGROUND_SCAN_INTERVAL,
+            debounce_scans=DEBOUNCE_PRESS_SCANS,
+        )
+    except ImportError:
+        print("keypad not available, scanning from the main loop")
 
-current_mode = pc_mode   # default
-print("Starting")
-while True:
-    # Scan the matrix
-    pressed = matrix.scan()
-    
-    # Add current scan to buffer
-    key_state_buffer.append(pressed[:])
-    if len(key_state_buffer) > BUFFER_SIZE:
-        key_state_buffer.pop(0)
-    
-    # Use merged state from buffer - if a key is pressed in ANY of the recent scans, consider it pressed
-    # This helps catch keys that might be missed in a single scan
-    merged_pressed = [0] * matrix.key_count
-    for buffered_state in key_state_buffer:
-        for idx in range(matrix.key_count):
-            if buffered_state[idx]:
-                merged_pressed[idx] = 1
-    
-    # Use merged state for processing
-    pressed = merged_pressed
-
-    # Track currently pressed keys
-    currently_pressed = []
-    for idx in range(matrix.key_count):
-        if pressed[idx]:
-            currently_pressed.append(idx)
-
-    # Detect key press events (transitions from not pressed to pressed)
-    # First, collect all newly pressed keys
-    newly_pressed = []
-    for idx in range(matrix.key_count):
-        if pressed[idx] and not prev[idx]:
-            newly_pressed.append(idx)
-    
-    # Check if the newly pressed keys form a special key combination
-    # Do this BEFORE sending individual keys to avoid sending modifiers
-    if newly_pressed:
-        combo_indices = currently_pressed[:]
-        spectrum_name = get_spectrum_key_name(combo_indices)
-        
-        # Check if this is a special key that has a direct HID mapping
-        if spectrum_name and spectrum_name in SPECIAL_KEY_HID_MAP:
-            special_keycode = SPECIAL_KEY_HID_MAP[spectrum_name]
-            if special_keycode is not None:
-                # Release any modifiers that were already sent (they're part of this special key)
-                caps_shift_idx = 25
-                symbol_shift_idx = 36
-                if caps_shift_idx in sent_keycodes:
-                    keyboard.release(sent_keycodes[caps_shift_idx])
-                    del sent_keycodes[caps_shift_idx]
-                if symbol_shift_idx in sent_keycodes:
-                    keyboard.release(sent_keycodes[symbol_shift_idx])
-                    del sent_keycodes[symbol_shift_idx]
-                # Also release the other key if it was already sent
-                for idx in combo_indices:
-                    if idx != caps_shift_idx and idx != symbol_shift_idx and idx in sent_keycodes:
-                        keyboard.release(sent_keycodes[idx])
-                        del sent_keycodes[idx]
-                
-                # Send the special HID keycode directly - don't send modifiers
-                keyboard.press(special_keycode)
-                # Skip sending individual keys for this iteration
-                newly_pressed = []
-    
-    # Now send individual keys (if not part of a special key combo)
-    for idx in newly_pressed:
-        # Normal keycode handling with modifier swapping
-        keycode = current_mode[idx]
-        caps_shift_idx = 25
-        symbol_shift_idx = 36
-        
-        # Check if we have a modifier combination that needs swapping
-        if idx == caps_shift_idx:
-            # CAPS SHIFT pressed - check if combo needs swap
-            for other_idx in currently_pressed:
-                if other_idx != idx:
-                    combo_key = (idx, other_idx)
-                    if combo_key in SWAP_MODIFIERS:
-                        # Swap: send SYMBOL SHIFT keycode instead
-                        keycode = current_mode[symbol_shift_idx]
-                        break
-        elif idx == symbol_shift_idx:
-            # SYMBOL SHIFT pressed - check if combo needs swap
-            for other_idx in currently_pressed:
-                if other_idx != idx:
-                    combo_key = (idx, other_idx)
-                    if combo_key in SWAP_MODIFIERS:
-                        # Swap: send CAPS SHIFT keycode instead
-                        keycode = current_mode[caps_shift_idx]
-                        break
-        else:
-            # Regular key pressed - check if modifier combo needs swap
-            if caps_shift_idx in currently_pressed:
-                combo_key = (caps_shift_idx, idx)
-                if combo_key in SWAP_MODIFIERS:
-                    # Send SYMBOL SHIFT keycode instead of CAPS SHIFT
-                    keyboard.press(current_mode[symbol_shift_idx])
-                    keycode = current_mode[idx]
-            elif symbol_shift_idx in currently_pressed:
-                combo_key = (symbol_shift_idx, idx)
-                if combo_key in SWAP_MODIFIERS:
-                    # Send CAPS SHIFT keycode instead of SYMBOL SHIFT
-                    keyboard.press(current_mode[caps_shift_idx])
-                    keycode = current_mode[idx]
-        
-        keyboard.press(keycode)
-        # Track that we sent this keycode
-        sent_keycodes[idx] = keycode
-    
-    # Handle key releases - need to check for special keys and swapped modifiers
-    for idx in range(matrix.key_count):
-        if prev[idx] and not pressed[idx]:
-            # Check if this was a special key combination
-            prev_pressed = []
-            for i in range(matrix.key_count):
-                if prev[i]:
-                    prev_pressed.append(i)
-            
-            prev_spectrum_name = get_spectrum_key_name(prev_pressed)
-            if prev_spectrum_name and prev_spectrum_name in SPECIAL_KEY_HID_MAP:
-                special_keycode = SPECIAL_KEY_HID_MAP[prev_spectrum_name]
-                if special_keycode is not None:
-                    # Release the special HID keycode
-                    keyboard.release(special_keycode)
-                    continue  # Skip normal keycode handling
-            
-            # Normal keycode release handling with modifier swapping
-            keycode = current_mode[idx]
-            caps_shift_idx = 25
-            symbol_shift_idx = 36
-            
-            # Check if this was part of a swapped modifier combination
-            if idx == caps_shift_idx:
-                # Check if we need to release swapped modifier
-                for other_idx in range(matrix.key_count):
-                    if prev[other_idx] and other_idx != idx:
-                        combo_key = (idx, other_idx)
-                        if combo_key in SWAP_MODIFIERS:
-                            keyboard.release(current_mode[symbol_shift_idx])
-                            keycode = None  # Don't release the original
-                            break
-            elif idx == symbol_shift_idx:
-                # Check if we need to release swapped modifier
-                for other_idx in range(matrix.key_count):
-                    if prev[other_idx] and other_idx != idx:
-                        combo_key = (idx, other_idx)
-                        if combo_key in SWAP_MODIFIERS:
-                            keyboard.release(current_mode[caps_shift_idx])
-                            keycode = None  # Don't release the original
-                            break
-            
-            if keycode is not None:
-                keyboard.release(keycode)
-                # Remove from tracking
-                if idx in sent_keycodes:
-                    del sent_keycodes[idx]
-            # Reset reported key when all keys are released
-            if len([i for i in range(matrix.key_count) if pressed[i]]) == 0:
-                last_reported_key = None
-                sent_keycodes.clear()
-    
-    # Now process all newly pressed keys together to detect combinations
-    if newly_pressed:
-        # Get all currently pressed keys (including ones that were already pressed)
-        combo_indices = currently_pressed[:]
-        
-        # Track modifier presses for delayed reporting
-        caps_shift_idx = 25
-        symbol_shift_idx = 36
-        for idx in newly_pressed:
-            if idx == caps_shift_idx or idx == symbol_shift_idx:
-                modifier_press_time[idx] = time.monotonic()
-        
-        # Get the Spectrum key name for this combination
-        spectrum_name = get_spectrum_key_name(combo_indices)
-        
-        # Only report if this is a new combination (avoid duplicate reports)
-        current_combo = tuple(sorted(combo_indices))
-        if current_combo != last_reported_key:
-            # Determine what to report
-            if spectrum_name and len(combo_indices) > 1:
-                # This is a combination - show the Spectrum key name
-                # Clear any pending modifier reports since we have a combo
-                modifier_press_time.clear()
-                # Get PC keycode names for reporting
-                pc_names = []
-                for idx in combo_indices:
-                    keycode = current_mode[idx]
-                    pc_name = None
-                    if hasattr(keycode, 'name'):
-                        pc_name = keycode.name
-                    if not pc_name:
-                        keycode_value = int(keycode) if hasattr(keycode, '__int__') else keycode
-                        for attr_name in dir(Keycode):
-                            if not attr_name.startswith('_'):
-                                attr_value = getattr(Keycode, attr_name)
-                                if isinstance(attr_value, int) and attr_value == keycode_value:
-                                    pc_name = attr_name
-                                    break
-                        if not pc_name:
-                            pc_name = f"KEYCODE_{keycode_value}"
-                    pc_names.append(pc_name)
-                pc_name_str = " + ".join(pc_names) if pc_names else "UNKNOWN"
-                print(f"Key pressed: {spectrum_name} ({pc_name_str})")
-                last_reported_key = current_combo
-            elif len(combo_indices) == 1:
-                # Single key pressed - check if it's a modifier
-                idx = combo_indices[0]
-                if idx == caps_shift_idx or idx == symbol_shift_idx:
-                    # Don't report modifier alone immediately - wait to see if combo arrives
-                    # It will be reported in the else block if no combo comes
-                    pass
-                else:
-                    # Non-modifier key - report it immediately
-                    keycode = current_mode[idx]
-                    pc_name = None
-                    if hasattr(keycode, 'name'):
-                        pc_name = keycode.name
-                    if not pc_name:
-                        keycode_value = int(keycode) if hasattr(keycode, '__int__') else keycode
-                        for attr_name in dir(Keycode):
-                            if not attr_name.startswith('_'):
-                                attr_value = getattr(Keycode, attr_name)
-                                if isinstance(attr_value, int) and attr_value == keycode_value:
-                                    pc_name = attr_name
-                                    break
-                        if not pc_name:
-                            pc_name = f"KEYCODE_{keycode_value}"
-                    
-                    if idx < len(SPECTRUM_KEY_NAMES):
-                        print(f"Key pressed: {SPECTRUM_KEY_NAMES[idx]} ({pc_name})")
-                    else:
-                        print(f"Key pressed: {pc_name}")
-                    last_reported_key = current_combo
-            else:
-                # Multiple keys but no special combination name
-                names = []
-                for idx in sorted(combo_indices):
-                    if idx < len(SPECTRUM_KEY_NAMES):
-                        names.append(SPECTRUM_KEY_NAMES[idx])
-                    else:
-                        names.append(f"KEY_{idx}")
-                print(f"Key pressed: {' + '.join(names)}")
-                last_reported_key = current_combo
+if matrix is None:
+    # Read all 8 rows (GP2-GP9) in one GPIO register read where the board
+    # supports it, otherwise fall back to reading them pin by pin
+    ROW_FIRST_GPIO = 2
+    try:
+        row_reader = RegisterRows(ROW_FIRST_GPIO, 8)
+    except (ImportError, ValueError):
+        row_reader = None
+
+    # Set up the matrix
+    matrix = SpectrumMatrix(
+        row_pins=ROW_PINS,
+        col_pins=COL_PINS,
+        settle_us=1200,  # Settle time - increased for more reliable sampling
+        debouncer=Debouncer(
+            40,
+            press_scans=DEBOUNCE_PRESS_SCANS,
+            release_scans=DEBOUNCE_RELEASE_SCANS,
+        ),
+        row_reader=row_reader,
+        # Hold back phantom keys from the diode-less membrane (False: only
+        # flag them in matrix.ghost_filter.ghosts). The shifts always pass.
+        ghost_filter=GhostFilter(
+            8, 5,
+            exempt=CAPS_SHIFT_BIT | SYMBOL_SHIFT_BIT,
+            block=GHOST_BLOCKING,
+        ),
+        # Per column settle times from calibrate.py, if it has been run
+        calibration=load_calibration(),
+    )
+
+    if CALIBRATE:
+        import calibrate
+        calibrate.run(matrix)
+
+# Key events waiting to be sent, in batches of one scan
+EVENT_RING_SIZE = 64
+event_ring = EventRing(EVENT_RING_SIZE)
+ring_overflows = 0   # event_ring.overflows when the HID side last caught up
+
+# Waits between scans. keypad scans on its own, so there's nothing to
+# watch while idle then.
+scheduler = ScanScheduler(
+    SCAN_TIERS,
+    matrix if isinstance(matrix, SpectrumMatrix) else None,
+)
+# The scan task's period while typing, and how late each scan started
+cadence = Cadence(SCAN_PERIOD_MS)
+
+# Reports on their way to the host, in place of the keyboard's device
+# while the tasks run (see main())
+hid_reports = None
+
+# Diagnostic records waiting to be printed
+diag = DiagLog(LOG_LEVEL) if LOG_LEVEL else None
+
+# Stage times with PROFILE, see start_profiler()
+profiler = None
+profile_dump_due = False   # PROFILE_COMBO was pressed
+
+# Raw scans with CAPTURE, see start_capture()
+recorder = None
+
+# The mode switch, if fitted: the last two readings (True: closed)
+mode_pin = None
+switch_position = False
+if mode_switch is not None:
+    import digitalio
+    mode_pin = digitalio.DigitalInOut(mode_switch)
+    mode_pin.direction = digitalio.Direction.INPUT
+    mode_pin.pull = digitalio.Pull.UP
+    switch_reading = switch_position = not mode_pin.value
+
+# Turns the keys held into what to send: combinations, special keys,
+# shift swaps, layers and the macro chord (see keyboard_engine.py). Its
+# state (held_mask, sent_keycodes, layer...) is the HID side's.
+engine = KeyboardEngine(
+    keymap,
+    layer=1 if switch_position else 0,
+    diag=diag,
+    layer_combo=LAYER_COMBO,
+    macro_chord=MACRO_CHORD,
+    command_combo=PROFILE_COMBO if PROFILE else None,
+)
+
+def format_record(kind, arg, mask):
+    """The line to print for a diagnostic record (see report_changes)."""
+    if kind == KIND_DROPPED:
+        return f"({mask} log records dropped)"
+    if kind == RECORD_LAYER:
+        return f"Layer {arg}"
+    if kind == RECORD_RESYNC:
+        return f"Events lost ({arg}{'+' if arg == 255 else ''}), keys brought back in line"
+    if kind == RECORD_KEYWORD_DROPPED:
+        return f"Keyword for key {arg} dropped, the macro queue is full"
+
+    indices = indices_of(mask)
+    mode = keymap.modes[arg]
+    if kind == RECORD_COMBO:
+        pc_names = [keycode_name(mode[idx]) for idx in indices]
+        pc_name_str = " + ".join(pc_names) if pc_names else "UNKNOWN"
+        return f"Key pressed: {get_spectrum_key_name(indices)} ({pc_name_str})"
+    idx = indices[0]
+    pc_name = keycode_name(mode[idx])
+    if idx < len(SPECTRUM_KEY_NAMES):
+        return f"Key pressed: {SPECTRUM_KEY_NAMES[idx]} ({pc_name})"
+    return f"Key pressed: {pc_name}"
+
+def print_record(kind, arg, mask):
+    print(format_record(kind, arg, mask))
+
+def start_profiler():
+    """Time the stages in PROFILE_STAGES from now on."""
+    global profiler
+    from profiler import StageProfiler
+    profiler = StageProfiler(PROFILE_STAGES)
+    if isinstance(matrix, SpectrumMatrix):
+        matrix.profile(profiler, STAGE_READ)
+
+if PROFILE:
+    start_profiler()
+
+def start_capture(stream):
+    """Record the matrix's raw scans to stream from now on."""
+    global recorder
+    from scan_capture import ScanRecorder
+    recorder = ScanRecorder(stream)
+    matrix.capture(recorder)
+
+def open_capture():
+    """Start recording to where CAPTURE says, if it can be opened."""
+    stream = None
+    if CAPTURE == "serial":
+        import usb_cdc
+        stream = usb_cdc.data
     else:
-        # No new keys pressed, but check if we have keys held that we haven't reported yet
-        # This handles the case where CAPS SHIFT was pressed first, then number key arrives later
-        if len(currently_pressed) > 0:
-            current_combo = tuple(sorted(currently_pressed))
-            if current_combo != last_reported_key:
-                spectrum_name = get_spectrum_key_name(currently_pressed)
-                if spectrum_name and len(currently_pressed) > 1:
-                    # We have a combination that we haven't reported yet
-                    # Clear any pending modifier reports
-                    modifier_press_time.clear()
-                    pc_names = []
-                    for idx in currently_pressed:
-                        keycode = current_mode[idx]
-                        pc_name = None
-                        if hasattr(keycode, 'name'):
-                            pc_name = keycode.name
-                        if not pc_name:
-                            keycode_value = int(keycode) if hasattr(keycode, '__int__') else keycode
-                            for attr_name in dir(Keycode):
-                                if not attr_name.startswith('_'):
-                                    attr_value = getattr(Keycode, attr_name)
-                                    if isinstance(attr_value, int) and attr_value == keycode_value:
-                                        pc_name = attr_name
-                                        break
-                            if not pc_name:
-                                pc_name = f"KEYCODE_{keycode_value}"
-                        pc_names.append(pc_name)
-                    pc_name_str = " + ".join(pc_names) if pc_names else "UNKNOWN"
-                    print(f"Key pressed: {spectrum_name} ({pc_name_str})")
-                    last_reported_key = current_combo
-                elif len(currently_pressed) == 1:
-                    # Single modifier held - don't report modifiers alone
-                    # They should only be reported as part of combinations
-                    pass
-    
-    # Clean up modifier tracking for released keys
-    for idx in list(modifier_press_time.keys()):
-        if idx not in currently_pressed:
-            del modifier_press_time[idx]
-
-    prev = pressed[:]
-    # Reduced sleep since we're already doing delays in the scan loop
-    time.sleep(0.001)
+        try:
+            stream = open(CAPTURE, "wb")
+        except OSError:
+            pass
+    if stream is None:
+        print("Can't open", CAPTURE, "to capture scans")
+        return
+    start_capture(stream)
+
+if CAPTURE and isinstance(matrix, SpectrumMatrix):
+    open_capture()
+
+def print_profile():
+    """Print the stage times, if they were asked for."""
+    global profile_dump_due
+    if profile_dump_due or profiler.dump_requested():
+        profile_dump_due = False
+        profiler.dump(print)
+
+def write_idle():
+    """Print a little of the log and the profile, write out captured scans.
+
+    Only while no key is down.
+    """
+    if LOG_LEVEL:
+        if PROFILE:
+            started = profiler.start()
+        diag.flush(print_record, LOG_LINES_PER_SCAN)
+        if PROFILE:
+            profiler.stop(STAGE_PRINT, started)
+    if PROFILE:
+        print_profile()
+    if recorder is not None:
+        recorder.flush()
+
+def queue_scan():
+    """Scan the matrix and queue whatever changed on event_ring."""
+    if PROFILE:
+        started = profiler.start()
+    event_count = matrix.scan_events()
+    while event_count:
+        event_ring.push(matrix.events, event_count, matrix.time_ns)
+        if not matrix.pending:
+            break
+        event_count = matrix.scan_events()
+    if PROFILE:
+        profiler.stop(STAGE_SCAN, started)
+
+def read_mode_switch():
+    """Follow the mode switch, once it has read the same twice in a row."""
+    global switch_reading, switch_position
+    reading = not mode_pin.value
+    if reading != switch_reading:
+        switch_reading = reading
+        return
+    if reading != switch_position:
+        switch_position = reading
+        apply_ops(engine.select_layer(1 if reading else 0))
+        keyboard.send()
+
+def apply_ops(count):
+    """Carry out the first count ops of the engine's last step."""
+    global profile_dump_due
+    ops = engine.ops
+    for i in range(count):
+        op = ops[i]
+        kind = op & OP_KIND
+        if kind == OP_PRESS:
+            keyboard.press(op)
+        elif kind == OP_RELEASE:
+            keyboard.release(op & OP_ARG)
+        elif kind == OP_RELEASE_ALL:
+            keyboard.release_all()
+        elif kind == OP_KEYWORD:
+            idx = op & OP_ARG
+            if not macro_player.play(KEYWORDS[idx]) and LOG_LEVEL:
+                diag.log(LEVEL_WARN, RECORD_KEYWORD_DROPPED, idx)
+        elif kind == OP_COMMAND:
+            # Printed by print_profile() once the keys are let go
+            profile_dump_due = True
+
+def send_step(count):
+    """Send the engine's step in one HID report, and log its keys if LOG_KEYS.
+
+    count is what the step returned; None sends nothing.
+    """
+    if count is None:
+        return
+    if PROFILE:
+        started = profiler.start()
+    apply_ops(count)
+    keyboard.send()
+    if PROFILE:
+        started = profiler.lap(STAGE_REPORT, started)
+    if LOG_KEYS and engine.sent_presses is not None:
+        engine.log_changes()
+        if PROFILE:
+            profiler.stop(STAGE_LOG, started)
+
+def send_and_report(event_count):
+    """Send the events in engine.events, and log them if LOG_KEYS."""
+    if PROFILE:
+        started = profiler.start()
+    count = engine.step_events(event_count)
+    if PROFILE:
+        profiler.stop(STAGE_KEYS, started)
+    send_step(count)
+    if PROFILE:
+        profiler.stop(STAGE_SEND, started)
+
+def resync():
+    """After dropped events, send whatever it takes to match the matrix."""
+    global ring_overflows
+    if LOG_LEVEL:
+        diag.log(LEVEL_WARN, RECORD_RESYNC, min(event_ring.overflows - ring_overflows, 255))
+    ring_overflows = event_ring.overflows
+    # Against the whole matrix: silent keys let go meanwhile need no release
+    send_step(engine.step(matrix.mask))
+
+def send_queued():
+    """Send/report the queued events, a scan's batch at a time."""
+    event_count = event_ring.pop(engine.events)
+    while event_count:
+        send_and_report(event_count)
+        event_count = event_ring.pop(engine.events)
+    if event_ring.overflows != ring_overflows:
+        resync()
+
+def service_macro():
+    """Send the next report of the keyword being typed."""
+    if PROFILE:
+        started = profiler.start()
+    macro_player.service()
+    if PROFILE:
+        profiler.stop(STAGE_MACRO, started)
+
+def scan_once():
+    """Scan the matrix and send/report whatever changed."""
+    reports_sent = keyboard.reports_sent
+    queue_scan()
+    if macro_player.down and event_ring.count:
+        # Keys from the matrix must not pick up a keyword's SHIFT
+        macro_player.lift()
+    send_queued()
+    if mode_pin is not None:
+        read_mode_switch()
+    # Keywords go out on scans that sent nothing else, still one report
+    # per scan at most
+    if macro_player.pending and keyboard.reports_sent == reports_sent:
+        service_macro()
+
+def wait_for_next_scan():
+    """Print a little of the log, then sleep until the next scan.
+
+    The sleep is longer the longer the keyboard has been idle.
+    """
+    if (LOG_LEVEL or PROFILE or recorder is not None) and not (engine.held_mask or matrix.mask):
+        # Only while no key is down, so that printing can't hold one up
+        write_idle()
+    if PROFILE:
+        started = profiler.start()
+    scheduler.wait(engine.held_mask or matrix.mask or macro_player.pending)
+    if PROFILE:
+        profiler.stop(STAGE_WAIT, started)
+
+async def until_room(room):
+    """Wait until hid_reports can take another report."""
+    while hid_reports.full():
+        room.clear()
+        await room.wait()
+
+async def scan_task(scanned):
+    """Scan every SCAN_PERIOD_MS, or as SCAN_TIERS says when idle."""
+    cadence.restart()
+    while True:
+        cadence.tick()
+        queue_scan()
+        scanned.set()
+        # Give decode_task its turn now, so that hid_task gets one too
+        # before the next scan even when that's due straight away
+        await asyncio.sleep(0)
+        tier = scheduler.plan(engine.held_mask or matrix.mask or macro_player.pending)
+        if not tier:
+            await asyncio.sleep(cadence.delay_ms() / 1000)
+            continue
+        if scheduler.matrix is None:
+            await asyncio.sleep(scheduler.intervals[tier])
+        else:
+            # Idle: wait for a key to pull its row low, as scheduler.wait() does
+            matrix.start_watch()
+            for _ in range(scheduler.polls[tier]):
+                if scheduler.poll():
+                    break
+                await asyncio.sleep(WAKE_POLL)
+            matrix.stop_watch()
+        cadence.restart()
+
+async def decode_task(scanned, queued, room):
+    """After each scan, turn its events into reports for hid_task.
+
+    The same work as send_queued() and the rest of scan_once(), giving way
+    after each batch.
+    """
+    while True:
+        await scanned.wait()
+        scanned.clear()
+        reports_sent = keyboard.reports_sent
+        if macro_player.down and event_ring.count:
+            macro_player.lift()
+        event_count = event_ring.pop(engine.events)
+        while event_count:
+            await until_room(room)
+            send_and_report(event_count)
+            queued.set()
+            await asyncio.sleep(0)
+            event_count = event_ring.pop(engine.events)
+        if event_ring.overflows != ring_overflows:
+            await until_room(room)
+            resync()
+        if mode_pin is not None:
+            await until_room(room)
+            read_mode_switch()
+        if macro_player.pending and keyboard.reports_sent == reports_sent:
+            await until_room(room)
+            service_macro()
+        queued.set()
+
+async def hid_task(queued, room):
+    """Pass the queued reports to the host, giving way after each one."""
+    while True:
+        if not hid_reports.count:
+            queued.clear()
+            await queued.wait()
+            continue
+        if PROFILE:
+            started = profiler.start()
+        hid_reports.send_next()
+        if PROFILE:
+            profiler.stop(STAGE_HOST, started)
+        room.set()
+        await asyncio.sleep(0)
+
+async def log_task():
+    """Every scan period while no key is down, do write_idle()."""
+    while True:
+        await asyncio.sleep(SCAN_PERIOD_MS / 1000)
+        if not (engine.held_mask or matrix.mask):
+            write_idle()
+
+async def stats_task():
+    """Print the scan instrumentation every SCAN_STATS_EVERY seconds."""
+    while True:
+        await asyncio.sleep(SCAN_STATS_EVERY)
+        print(scheduler.stats())
+        print(cadence.stats())
+
+async def main():
+    """Run the keyboard as tasks, joined by event_ring and hid_reports."""
+    global hid_reports
+    hid_reports = ReportQueue(keyboard.device, len(keyboard.report), HID_QUEUE_DEPTH)
+    keyboard.device = hid_reports
+    scanned = asyncio.Event()   # A scan has been queued
+    queued = asyncio.Event()    # Reports are waiting in hid_reports
+    room = asyncio.Event()      # hid_reports has sent one
+    tasks = [
+        asyncio.create_task(scan_task(scanned)),
+        asyncio.create_task(decode_task(scanned, queued, room)),
+        asyncio.create_task(hid_task(queued, room)),
+    ]
+    if LOG_LEVEL or PROFILE or recorder is not None:
+        tasks.append(asyncio.create_task(log_task()))
+    if SCAN_STATS_EVERY:
+        tasks.append(asyncio.create_task(stats_task()))
+    await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+    print("Starting")
+    if asyncio is not None:
+        asyncio.run(main())
+    stats_at = time.monotonic()
+    while True:
+        scan_once()
+        wait_for_next_scan()
+        if SCAN_STATS_EVERY and time.monotonic() - stats_at >= SCAN_STATS_EVERY:
+            print(scheduler.stats())
+            stats_at = time.monotonic()
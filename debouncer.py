@@ -0,0 +1,69 @@
+class Debouncer:
+    """Per-key debounce state machine working on scan bitmasks.
+
+    Each key has its own press and release threshold, counted in scans.
+    A key changes state once the raw scan has disagreed with it for that
+    many scans in a row; any agreeing scan resets its counter. Some
+    useful settings:
+
+    * press_scans=1, release_scans=N - eager press, deferred release
+    * press_scans=N, release_scans=N - symmetric integrator
+
+    All state lives in bytearrays and integers allocated up front.
+    """
+
+    def __init__(self, key_count, press_scans=2, release_scans=2):
+        self.key_count = key_count
+        self.press_scans = bytearray([press_scans] * key_count)
+        self.release_scans = bytearray([release_scans] * key_count)
+        self.counts = bytearray(key_count)
+        self.state = 0      # Debounced bitmask
+        self.pending = 0    # Keys with a non-zero counter
+
+    def set_thresholds(self, idx, press_scans, release_scans):
+        """Override the thresholds for a single key."""
+        self.press_scans[idx] = press_scans
+        self.release_scans[idx] = release_scans
+
+    def reset(self, state=0):
+        """Forget all counters and force the debounced state."""
+        for idx in range(self.key_count):
+            self.counts[idx] = 0
+        self.state = state
+        self.pending = 0
+
+    def update(self, raw):
+        """Feed one raw scan bitmask and return the debounced bitmask."""
+        diff = raw ^ self.state
+        work = diff | self.pending
+        # Nothing changing and nothing in flight: no per-key work at all
+        if not work:
+            return self.state
+
+        counts = self.counts
+        idx = 0
+        bit = 1
+        while work:
+            if work & 1:
+                if diff & bit:
+                    count = counts[idx] + 1
+                    if raw & bit:
+                        limit = self.press_scans[idx]
+                    else:
+                        limit = self.release_scans[idx]
+                    if count >= limit:
+                        self.state ^= bit
+                        counts[idx] = 0
+                        self.pending &= ~bit
+                    else:
+                        counts[idx] = count
+                        self.pending |= bit
+                else:
+                    # Bounced back to the debounced state
+                    counts[idx] = 0
+                    self.pending &= ~bit
+            work >>= 1
+            bit <<= 1
+            idx += 1
+
+        return self.state
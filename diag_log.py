@@ -0,0 +1,75 @@
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    # Imported by keyboard_engine, which has to load on a plain host too
+    def const(value):
+        return value
+
+# Verbosity levels: a record is kept if its level is at or below the log's
+LEVEL_OFF = const(0)
+LEVEL_WARN = const(1)    # Something was lost: events, macro text, log records
+LEVEL_INFO = const(2)    # Changes of state, such as the layer
+LEVEL_KEYS = const(3)    # Every key combination pressed
+
+# Kind of the record flush() passes on when records were dropped: arg 0,
+# mask the number dropped since
+KIND_DROPPED = const(0)
+
+
+class DiagLog:
+    """Diagnostic records, kept in binary now and formatted later.
+
+    Each record is a kind, a one-byte argument and a key mask, which costs a
+    few stores to keep, however long the line it becomes. flush() passes at
+    most a few of them on to be turned into text and printed, so the caller
+    can spread printing over the pauses between scans, away from the HID
+    path.
+
+    Records that don't fit are dropped and counted in dropped; the next
+    flush() passes on a KIND_DROPPED record first. Storage is allocated up
+    front: logging allocates nothing beyond what the mask itself takes.
+    """
+
+    def __init__(self, level, capacity=32):
+        self.level = level
+        self.capacity = capacity
+        self.kinds = bytearray(capacity)
+        self.args = bytearray(capacity)
+        self.masks = array("Q", [0] * capacity)
+        self.head = 0       # Next slot to write
+        self.count = 0
+        self.dropped = 0
+        self.reported_drops = 0
+
+    def log(self, level, kind, arg=0, mask=0):
+        """Keep a record, if level is verbose enough and there's room."""
+        if level > self.level:
+            return
+        if self.count == self.capacity:
+            self.dropped += 1
+            return
+        slot = (self.head + self.count) % self.capacity
+        self.kinds[slot] = kind
+        self.args[slot] = arg
+        self.masks[slot] = mask
+        self.count += 1
+
+    def flush(self, emit, limit=1):
+        """Pass up to limit records, oldest first, to emit(kind, arg, mask).
+
+        Returns the number passed on.
+        """
+        if self.dropped != self.reported_drops:
+            emit(KIND_DROPPED, 0, self.dropped - self.reported_drops)
+            self.reported_drops = self.dropped
+        done = 0
+        while self.count and done < limit:
+            head = self.head
+            kind, arg, mask = self.kinds[head], self.args[head], self.masks[head]
+            self.head = (head + 1) % self.capacity
+            self.count -= 1
+            emit(kind, arg, mask)
+            done += 1
+        return done
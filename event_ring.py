@@ -0,0 +1,107 @@
+from array import array
+
+# Event encoding used by matrix_scanner's scan_events() and everything
+# after it: key index in the low 7 bits, top bit set for a press, clear
+# for a release
+EVENT_PRESSED = 0x80
+EVENT_KEY_MASK = 0x7F
+
+
+class EventRing:
+    """Fixed-size queue of key events between the scanner and the HID side.
+
+    Each record is a key event byte (key index, EVENT_PRESSED set for a
+    press) and the time.monotonic_ns() of the scan it came from. Events
+    are pushed and popped a scan at a time, so the consumer always gets
+    the changes of one scan together, however far behind it is.
+
+    A scan that doesn't fit is dropped whole and counted in overflows.
+    high_water is the most events ever queued at once. If it stays around
+    one scan's worth the HID side keeps up; if it climbs towards capacity
+    the output is the bottleneck, not the scan rate.
+
+    Storage is allocated up front; pushing and popping allocate nothing.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.events = bytearray(capacity)
+        self.times = array("q", [0] * capacity)
+        # 1 where a record starts a new scan's worth of events
+        self.starts = bytearray(capacity)
+        self.head = 0       # Next slot to write
+        self.tail = 0       # Next slot to read
+        self.count = 0
+        self.high_water = 0
+        self.overflows = 0  # Events dropped because the ring was full
+        self.time_ns = 0    # Timestamp of the batch last popped
+
+    def __len__(self):
+        return self.count
+
+    def reset(self):
+        """Drop everything queued and clear the statistics."""
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+        self.high_water = 0
+        self.overflows = 0
+
+    def push(self, events, count, time_ns):
+        """Queue the first count bytes of events as one scan's batch.
+
+        Returns False, and counts the events as overflowed, if they don't
+        all fit.
+        """
+        if self.count + count > self.capacity:
+            self.overflows += count
+            return False
+        head = self.head
+        for i in range(count):
+            self.events[head] = events[i]
+            self.times[head] = time_ns
+            self.starts[head] = 0
+            head += 1
+            if head == self.capacity:
+                head = 0
+        if count:
+            self.starts[self.head] = 1
+        self.head = head
+        self.count += count
+        if self.count > self.high_water:
+            self.high_water = self.count
+        return True
+
+    def pop(self, out):
+        """Move the oldest batch into out and return its length (0 if empty).
+
+        The batch's timestamp is left in self.time_ns.
+        """
+        if not self.count:
+            return 0
+        tail = self.tail
+        self.time_ns = self.times[tail]
+        n = 0
+        while True:
+            out[n] = self.events[tail]
+            n += 1
+            tail += 1
+            if tail == self.capacity:
+                tail = 0
+            if n == self.count or self.starts[tail]:
+                break
+        self.tail = tail
+        self.count -= n
+        return n
+
+
+def add_events(events, bits, flag, count):
+    """Write an event for each set bit, from events[count]. Returns the new count."""
+    idx = 0
+    while bits:
+        if bits & 1:
+            events[count] = idx | flag
+            count += 1
+        bits >>= 1
+        idx += 1
+    return count
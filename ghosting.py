@@ -0,0 +1,70 @@
+# For any 8-bit set of rows: 1 if two or more are set. Two columns that
+# share two rows make a rectangle.
+TWO_OR_MORE = bytes(1 if bin(rows).count("1") >= 2 else 0 for rows in range(256))
+
+
+class GhostFilter:
+    """Find and block phantom keys from the diode-less membrane.
+
+    With three corners of a rectangle pressed the fourth reads pressed too,
+    so every key of a rectangle seen in a scan is ambiguous: any one of
+    them could be the phantom. Rectangles are found from the rows read for
+    each column: two columns that share two or more rows. That is ten ANDs
+    and table lookups per scan over small ints, and fewer when at most one
+    column has two keys down, which is nearly always.
+
+    Ambiguous keys keep the state they had before the rectangle appeared,
+    so keys already held stay held and new ones wait until it clears. Keys
+    in exempt (CAPS SHIFT and SYMBOL SHIFT) always pass through, so a shift
+    held for a combination is never dropped. With block=False nothing is
+    changed and the ambiguous keys are only flagged in self.ghosts.
+    """
+
+    def __init__(self, row_count, col_count, exempt=0, block=True):
+        self.row_count = row_count
+        self.col_count = col_count
+        self.exempt = exempt
+        self.block = block
+        # Every pair of columns, as two parallel byte tables
+        self.pair_a = bytes(a for a in range(col_count) for b in range(a + 1, col_count))
+        self.pair_b = bytes(b for a in range(col_count) for b in range(a + 1, col_count))
+        self.key_bits = tuple(1 << idx for idx in range(row_count * col_count))
+        self.state = 0         # Last filtered mask
+        self.ghosts = 0        # Ambiguous keys in the last scan
+        self.ghost_scans = 0   # Scans that had any
+
+    def update(self, raw, col_rows):
+        """Filter one scan. col_rows[c] has bit r set if row r read low on column c."""
+        busy = 0
+        for c in range(self.col_count):
+            busy += TWO_OR_MORE[col_rows[c]]
+        if busy < 2:
+            self.ghosts = 0
+            self.state = raw
+            return raw
+
+        ghosts = 0
+        for p in range(len(self.pair_a)):
+            a = self.pair_a[p]
+            b = self.pair_b[p]
+            common = col_rows[a] & col_rows[b]
+            if TWO_OR_MORE[common]:
+                ghosts |= self._keys(a, common) | self._keys(b, common)
+        ghosts &= ~self.exempt
+        self.ghosts = ghosts
+        if ghosts:
+            self.ghost_scans += 1
+            if self.block:
+                raw = (raw & ~ghosts) | (self.state & ghosts)
+        self.state = raw
+        return raw
+
+    def _keys(self, col, rows):
+        keys = 0
+        idx = col
+        while rows:
+            if rows & 1:
+                keys |= self.key_bits[idx]
+            rows >>= 1
+            idx += self.col_count
+        return keys
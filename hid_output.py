@@ -0,0 +1,277 @@
+import time
+
+import usb_hid
+from adafruit_hid import find_device
+
+# Keycodes from LEFT_CONTROL up are modifiers, sent as bits of report byte 0
+MODIFIER_BASE = 0xE0
+
+# Non-modifier key slots in the boot keyboard report
+BOOT_KEY_SLOTS = 6
+BOOT_REPORT_LENGTH = 8
+
+# The N-key rollover report: the 8-byte boot report, then one bit for
+# each keycode below NKRO_KEYCODES
+NKRO_KEYCODES = 128
+NKRO_REPORT_LENGTH = BOOT_REPORT_LENGTH + NKRO_KEYCODES // 8
+
+# The devices enabled together share one HID descriptor, so every one of
+# them needs a report ID of its own. CircuitPython's keyboard, mouse and
+# consumer control have 1 to 3. send_report() adds the ID byte itself.
+NKRO_REPORT_ID = 4
+
+NKRO_REPORT_DESCRIPTOR = bytes((
+    0x05, 0x01,        # Usage Page (Generic Desktop)
+    0x09, 0x06,        # Usage (Keyboard)
+    0xA1, 0x01,        # Collection (Application)
+    0x85, NKRO_REPORT_ID,  #   Report ID (4)
+    # Byte 0: modifier bits
+    0x05, 0x07,        #   Usage Page (Keyboard/Keypad)
+    0x19, 0xE0,        #   Usage Minimum (Left Control)
+    0x29, 0xE7,        #   Usage Maximum (Right GUI)
+    0x15, 0x00,        #   Logical Minimum (0)
+    0x25, 0x01,        #   Logical Maximum (1)
+    0x75, 0x01,        #   Report Size (1)
+    0x95, 0x08,        #   Report Count (8)
+    0x81, 0x02,        #   Input (Data, Variable, Absolute)
+    # Byte 1: reserved
+    0x75, 0x08,        #   Report Size (8)
+    0x95, 0x01,        #   Report Count (1)
+    0x81, 0x01,        #   Input (Constant)
+    # LED output report
+    0x05, 0x08,        #   Usage Page (LEDs)
+    0x19, 0x01,        #   Usage Minimum (Num Lock)
+    0x29, 0x05,        #   Usage Maximum (Kana)
+    0x75, 0x01,        #   Report Size (1)
+    0x95, 0x05,        #   Report Count (5)
+    0x91, 0x02,        #   Output (Data, Variable, Absolute)
+    0x75, 0x03,        #   Report Size (3)
+    0x95, 0x01,        #   Report Count (1)
+    0x91, 0x01,        #   Output (Constant)
+    # Bytes 2-7: six key slots, as in the boot report
+    0x05, 0x07,        #   Usage Page (Keyboard/Keypad)
+    0x19, 0x00,        #   Usage Minimum (0)
+    0x2A, 0xFF, 0x00,  #   Usage Maximum (255)
+    0x15, 0x00,        #   Logical Minimum (0)
+    0x26, 0xFF, 0x00,  #   Logical Maximum (255)
+    0x75, 0x08,        #   Report Size (8)
+    0x95, 0x06,        #   Report Count (6)
+    0x81, 0x00,        #   Input (Data, Array, Absolute)
+    # Bytes 8-23: one bit per keycode 0-127
+    0x19, 0x00,        #   Usage Minimum (0)
+    0x29, 0x7F,        #   Usage Maximum (127)
+    0x15, 0x00,        #   Logical Minimum (0)
+    0x25, 0x01,        #   Logical Maximum (1)
+    0x75, 0x01,        #   Report Size (1)
+    0x95, 0x80,        #   Report Count (128)
+    0x81, 0x02,        #   Input (Data, Variable, Absolute)
+    0xC0,              # End Collection
+))
+
+
+def nkro_device():
+    """The N-key rollover keyboard, for usb_hid.enable() in boot.py."""
+    return usb_hid.Device(
+        report_descriptor=NKRO_REPORT_DESCRIPTOR,
+        usage_page=0x01,
+        usage=0x06,
+        report_ids=(NKRO_REPORT_ID,),
+        in_report_lengths=(NKRO_REPORT_LENGTH,),
+        out_report_lengths=(1,),
+    )
+
+
+def enable_nkro():
+    """Add the NKRO keyboard to CircuitPython's devices. Only works in boot.py.
+
+    CircuitPython's own keyboard stays, for open_keyboard() to fall back
+    on. Neither is the boot device: that has to be USB interface 0, and
+    the serial console and CIRCUITPY come first.
+    """
+    usb_hid.enable((
+        usb_hid.Device.KEYBOARD,
+        nkro_device(),
+        usb_hid.Device.MOUSE,
+        usb_hid.Device.CONSUMER_CONTROL,
+    ))
+
+
+def open_keyboard(devices):
+    """Pick the best keyboard report the host will take.
+
+    NKRO if boot.py enabled the NKRO keyboard and it takes reports,
+    otherwise the usual 6-key boot report on the standard keyboard.
+    """
+    for device in devices:
+        # Only the NKRO keyboard takes a report this long
+        if (device.usage_page == 0x01 and device.usage == 0x06
+                and _takes_report(device, NKRO_REPORT_LENGTH)):
+            return NkroReport(device)
+    return BootReport(find_device(devices, usage_page=0x1, usage=0x06))
+
+
+def _takes_report(device, length):
+    """Whether device accepts reports of length bytes. Sends an empty one."""
+    report = bytearray(length)
+    try:
+        try:
+            device.send_report(report)
+        except OSError:
+            # Host not ready yet: give it a second, like Keyboard does
+            time.sleep(1)
+            device.send_report(report)
+    except ValueError:
+        return False
+    return True
+
+
+class BootReport:
+    """6-key boot keyboard report, changed freely and sent once per scan.
+
+    Keyboard.press()/release() from adafruit_hid send a USB report every
+    call, so one combination with a modifier swap could take three or four
+    reports. press() and release() here only change the report; send()
+    puts it on the bus, and only if it changed. Call send() once after
+    each scan's events.
+
+    Like Keyboard, pressing a seventh key drops the oldest one. The report
+    is the same 8 bytes, so the host sees the same key states, just
+    without the steps in between.
+    """
+
+    def __init__(self, device, length=BOOT_REPORT_LENGTH):
+        self.device = device
+        self.report = bytearray(length)
+        self.reports_sent = 0
+        # Start with all keys up. If the host isn't ready yet, give it a
+        # second and try once more, like Keyboard does.
+        self.changed = True
+        try:
+            self.send()
+        except OSError:
+            time.sleep(1)
+            self.send()
+
+    def press(self, keycode):
+        """Add a keycode to the report."""
+        report = self.report
+        if keycode >= MODIFIER_BASE:
+            bit = 1 << (keycode - MODIFIER_BASE)
+            if not report[0] & bit:
+                report[0] |= bit
+                self.changed = True
+            return
+        for i in range(2, 2 + BOOT_KEY_SLOTS):
+            if report[i] == keycode:
+                return
+            if not report[i]:
+                report[i] = keycode
+                self.changed = True
+                return
+        # All slots are filled: shuffle down and reuse the last slot
+        for i in range(2, 1 + BOOT_KEY_SLOTS):
+            report[i] = report[i + 1]
+        report[1 + BOOT_KEY_SLOTS] = keycode
+        self.changed = True
+
+    def release(self, keycode):
+        """Take a keycode out of the report."""
+        report = self.report
+        if keycode >= MODIFIER_BASE:
+            bit = 1 << (keycode - MODIFIER_BASE)
+            if report[0] & bit:
+                report[0] &= ~bit
+                self.changed = True
+            return
+        for i in range(2, 2 + BOOT_KEY_SLOTS):
+            if report[i] == keycode:
+                report[i] = 0
+                self.changed = True
+
+    def release_all(self):
+        """Empty the report."""
+        for i in range(len(self.report)):
+            if self.report[i]:
+                self.report[i] = 0
+                self.changed = True
+
+    def send(self):
+        """Send the report if it changed since the last send. Returns True if sent."""
+        if not self.changed:
+            return False
+        self.device.send_report(self.report)
+        self.changed = False
+        self.reports_sent += 1
+        return True
+
+
+class NkroReport(BootReport):
+    """N-key rollover report: every key held is sent, however many.
+
+    Keycodes go in the bitmap after the boot report, modifiers in byte 0 as
+    usual. Keycodes past the bitmap use the six boot key slots.
+    """
+
+    def __init__(self, device):
+        super().__init__(device, NKRO_REPORT_LENGTH)
+
+    def press(self, keycode):
+        """Add a keycode to the report."""
+        if keycode >= NKRO_KEYCODES:
+            super().press(keycode)
+            return
+        i = BOOT_REPORT_LENGTH + (keycode >> 3)
+        bit = 1 << (keycode & 7)
+        if not self.report[i] & bit:
+            self.report[i] |= bit
+            self.changed = True
+
+    def release(self, keycode):
+        """Take a keycode out of the report."""
+        if keycode >= NKRO_KEYCODES:
+            super().release(keycode)
+            return
+        i = BOOT_REPORT_LENGTH + (keycode >> 3)
+        bit = 1 << (keycode & 7)
+        if self.report[i] & bit:
+            self.report[i] &= ~bit
+            self.changed = True
+
+
+class ReportQueue:
+    """A bounded queue of reports in front of a HID device.
+
+    Put it in place of a report's device and send() queues a copy instead
+    of waiting for the host to take it; send_next() passes the oldest on to
+    the device. The reports themselves are preallocated, so queueing
+    allocates nothing. Check full() before sending: a report sent to a full
+    queue would be lost, so it raises instead.
+
+    high_water is the most reports ever queued at once.
+    """
+
+    def __init__(self, device, length, depth=8):
+        self.device = device
+        self.reports = [bytearray(length) for _ in range(depth)]
+        self.depth = depth
+        self.head = 0
+        self.count = 0
+        self.high_water = 0
+
+    def full(self):
+        return self.count == self.depth
+
+    def send_report(self, report, report_id=None):
+        """Queue a copy of report."""
+        if self.count == self.depth:
+            raise RuntimeError("report queue full")
+        self.reports[(self.head + self.count) % self.depth][:] = report
+        self.count += 1
+        if self.count > self.high_water:
+            self.high_water = self.count
+
+    def send_next(self):
+        """Send the oldest report queued to the device (waits for the host)."""
+        self.device.send_report(self.reports[self.head])
+        self.head = (self.head + 1) % self.depth
+        self.count -= 1
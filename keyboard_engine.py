@@ -0,0 +1,439 @@
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    # Plain CPython: the engine needs no board, nor the simulator
+    def const(value):
+        return value
+
+from diag_log import LEVEL_INFO, LEVEL_KEYS
+from event_ring import EVENT_PRESSED, EVENT_KEY_MASK, add_events
+from keymap import (
+    KEY_COUNT,
+    CAPS_SHIFT_IDX,
+    SYMBOL_SHIFT_IDX,
+    CAPS_SHIFT_BIT,
+    SYMBOL_SHIFT_BIT,
+    MOD_NONE,
+    MOD_CAPS,
+    MOD_SYMBOL,
+    ACTION_PASS,
+    ACTION_SWAP,
+    BIT_INDEX,
+)
+
+# What a step asks of the keyboard, one entry of KeyboardEngine.ops each:
+# the kind of op in the top bits, its argument in OP_ARG
+OP_PRESS = const(0x000)        # Press the keycode
+OP_RELEASE = const(0x100)      # Release the keycode
+OP_RELEASE_ALL = const(0x200)  # Release every key sent
+OP_KEYWORD = const(0x300)      # Type the keyword of the key index (macros.KEYWORDS)
+OP_COMMAND = const(0x400)      # command_combo was pressed
+OP_KIND = const(0x700)
+OP_ARG = const(0xFF)
+
+# The most ops a step can take: two for each key pressed (with a modifier
+# swap), one for each released, and the special key paths stay under that
+OPS_SIZE = const(3 * KEY_COUNT)
+
+# Kinds of diagnostic record kept by the engine; code.py's format_record()
+# turns them into text
+RECORD_COMBO = const(1)      # Keys that make a Spectrum key; arg: layer
+RECORD_KEY = const(2)        # A single key; arg: layer
+RECORD_LAYER = const(3)      # arg: the new layer
+
+
+def indices_of(mask):
+    """List the matrix indices set in a key bitmask, in ascending order."""
+    indices = []
+    idx = 0
+    while mask:
+        if mask & 1:
+            indices.append(idx)
+        mask >>= 1
+        idx += 1
+    return indices
+
+
+def modifier_state(mask):
+    """Which shift governs a combination (CAPS SHIFT wins if both are held)."""
+    if mask & CAPS_SHIFT_BIT:
+        return MOD_CAPS
+    if mask & SYMBOL_SHIFT_BIT:
+        return MOD_SYMBOL
+    return MOD_NONE
+
+
+class KeyboardEngine:
+    """Turns the keys held on the matrix into HID key presses and releases.
+
+    Everything between the debounced scan and the USB report: combinations,
+    special keys, the shift swaps, layers and the macro chord. It touches
+    no hardware. Each step writes what the keyboard should do to ops (see
+    OP_PRESS and the rest) and returns how many, for the caller to pass on
+    to the report and send; None means there is nothing to send.
+
+    step() takes the whole debounced mask of a scan. step_events() takes a
+    scan's events, already in events, as event_ring hands them over, and
+    copes with events lost in between the way the firmware always has.
+
+    State is kept in slots: sent_keycodes holds the keycode sent for each
+    matrix index (0 if none), and held_mask, prev_held_mask and silent_mask
+    the keys held now, before the last step, and ignored until released.
+    keystrokes counts the key presses seen. With a diag_log.DiagLog in
+    diag, layer changes are logged, and log_changes() logs the keys of
+    the last step. Storage is allocated up front.
+    """
+
+    def __init__(self, keymap, layer=0, diag=None, layer_combo=None,
+                 macro_chord=None, command_combo=None):
+        self.keymap = keymap
+        self.combo_actions = keymap.combo_actions
+        self.caps_swap_mask = keymap.caps_swap_mask
+        self.symbol_swap_mask = keymap.symbol_swap_mask
+        # Layers are the keymap's modes. Switching only points current_mode
+        # at another slice of keymap.keycodes, nothing is copied.
+        self.layer = layer
+        self.current_mode = keymap.modes[layer]
+        self.layer_switches = 0
+        # Key masks that, once all held, move to the next layer, type
+        # keywords, or give OP_COMMAND; or None
+        self.layer_combo = layer_combo
+        self.macro_chord = macro_chord
+        self.command_combo = command_combo
+        self.diag = diag
+
+        self.key_bits = tuple(1 << idx for idx in range(KEY_COUNT))
+        self.held_mask = 0
+        self.prev_held_mask = 0
+        self.silent_mask = 0
+        self.sent_keycodes = bytearray(KEY_COUNT)
+        self.keystrokes = 0
+
+        # The events of the step
+        self.events = bytearray(KEY_COUNT)
+        self.ops = array("H", [0] * OPS_SIZE)
+        self.op_count = 0
+        # Whether the step sent individual key presses, for log_changes(),
+        # or None when there's nothing to log
+        self.sent_presses = None
+
+        # For the key log: held_mask when keys were last logged
+        self.last_reported_key = None
+
+    def step(self, scan_mask):
+        """Bring the keys sent in line with the debounced mask of a scan.
+
+        Returns the number of ops, or None if nothing changed.
+        """
+        self.silent_mask &= scan_mask
+        mask = scan_mask & ~self.silent_mask
+        held = self.held_mask
+        changed = held ^ mask
+        if not changed:
+            self.op_count = 0
+            self.sent_presses = None
+            return None
+        count = add_events(self.events, changed & mask, EVENT_PRESSED, 0)
+        return self.step_events(add_events(self.events, changed & held, 0, count))
+
+    def step_events(self, event_count):
+        """Act on the first event_count events in self.events, one scan's.
+
+        A press of a silent key means its release went missing, and counts
+        as new. Returns the number of ops, or None if there is nothing to
+        send.
+        """
+        self.op_count = 0
+        self.sent_presses = None
+        if self.silent_mask:
+            event_count = self._drop_silent(event_count)
+            if not event_count:
+                return None
+        self._apply_events(event_count)
+        held = self.held_mask
+        prev = self.prev_held_mask
+        chord = self.macro_chord
+        if chord:
+            chord_was_held = prev & chord == chord
+            if held & chord == chord:
+                self._play_keywords(event_count, chord_was_held)
+                return self.op_count
+            if chord_was_held:
+                # Chord let go: keys still held wait to be released
+                self._silence_held()
+                return self.op_count
+        combo = self.layer_combo
+        if combo and held & combo == combo and prev & combo != combo:
+            self._switch_layer((self.layer + 1) % len(self.keymap.modes))
+            return self.op_count
+        combo = self.command_combo
+        if combo and held & combo == combo and prev & combo != combo:
+            self._add(OP_COMMAND)
+            self._silence_held()
+            return self.op_count
+        self.sent_presses = self._send_changes(event_count)
+        return self.op_count
+
+    def select_layer(self, layer):
+        """Switch to another layer of the keymap. Returns the number of ops.
+
+        Everything sent so far is released, so no key can stay down on the
+        host with a keycode from the old layer. Keys still held are ignored
+        until they are released.
+        """
+        self.op_count = 0
+        self.sent_presses = None
+        self._switch_layer(layer)
+        return self.op_count
+
+    def _add(self, op):
+        self.ops[self.op_count] = op
+        self.op_count += 1
+
+    def combo_action(self, mask):
+        """Resolve a whole key combination to an entry of the combo actions.
+
+        As on the Spectrum, a shift plus the lowest-numbered other key held
+        decides the combination.
+        """
+        if mask & CAPS_SHIFT_BIT:
+            others = mask & ~CAPS_SHIFT_BIT
+            row = MOD_CAPS * KEY_COUNT
+        elif mask & SYMBOL_SHIFT_BIT:
+            others = mask & ~SYMBOL_SHIFT_BIT
+            row = MOD_SYMBOL * KEY_COUNT
+        else:
+            return ACTION_PASS
+        if not others:
+            return ACTION_PASS
+        return self.combo_actions[row + BIT_INDEX[others & -others]]
+
+    def _release_sent(self, idx):
+        # Release whatever keycode was sent for a matrix index, if any
+        keycode = self.sent_keycodes[idx]
+        if keycode:
+            self._add(OP_RELEASE | keycode)
+            self.sent_keycodes[idx] = 0
+
+    def _drop_silent(self, event_count):
+        # Drop the releases of silent keys; returns the events left
+        events = self.events
+        key_bits = self.key_bits
+        kept = 0
+        for i in range(event_count):
+            event = events[i]
+            bit = key_bits[event & EVENT_KEY_MASK]
+            if self.silent_mask & bit:
+                self.silent_mask &= ~bit
+                # A press means the release went missing; treat it as new
+                if not event & EVENT_PRESSED:
+                    continue
+            events[kept] = event
+            kept += 1
+        return kept
+
+    def _apply_events(self, event_count):
+        # Update held_mask and prev_held_mask for the events
+        self.prev_held_mask = held = self.held_mask
+        events = self.events
+        key_bits = self.key_bits
+        for i in range(event_count):
+            event = events[i]
+            bit = key_bits[event & EVENT_KEY_MASK]
+            if event & EVENT_PRESSED:
+                held |= bit
+                self.keystrokes += 1
+            else:
+                held &= ~bit
+        self.held_mask = held
+
+    def _release_to_host(self):
+        self._add(OP_RELEASE_ALL)
+        sent_keycodes = self.sent_keycodes
+        for slot in range(KEY_COUNT):
+            sent_keycodes[slot] = 0
+
+    def _silence_held(self):
+        # Release everything, and ignore the keys held now until they are let go
+        self._release_to_host()
+        self.silent_mask |= self.held_mask
+        self.held_mask = 0
+        self.prev_held_mask = 0
+        self.last_reported_key = None
+
+    def _switch_layer(self, layer):
+        self._silence_held()
+        self.layer = layer
+        self.current_mode = self.keymap.modes[layer]
+        self.layer_switches += 1
+        if self.diag is not None:
+            self.diag.log(LEVEL_INFO, RECORD_LAYER, layer)
+
+    def _play_keywords(self, event_count, chord_was_held):
+        # The keyword of every key pressed with the macro chord held
+        if not chord_was_held:
+            # The chord just came together: let go of its first keys on the host
+            self._release_to_host()
+        events = self.events
+        key_bits = self.key_bits
+        for i in range(event_count):
+            event = events[i]
+            if event & EVENT_PRESSED:
+                idx = event & EVENT_KEY_MASK
+                if not key_bits[idx] & self.macro_chord:
+                    self._add(OP_KEYWORD | idx)
+
+    def _send_changes(self, event_count):
+        # The key presses and releases for the events. Returns True if
+        # individual key presses were sent, False if there were none or
+        # they made up a special key.
+        events = self.events
+        pressed_mask = self.held_mask
+        prev_mask = self.prev_held_mask
+        current_mode = self.current_mode
+        sent_keycodes = self.sent_keycodes
+        combo_actions = self.combo_actions
+
+        # Presses come first in the event buffer
+        press_count = 0
+        while press_count < event_count and events[press_count] & EVENT_PRESSED:
+            press_count += 1
+
+        # Check if the newly pressed keys form a special key combination
+        # Do this BEFORE sending individual keys to avoid sending modifiers
+        sent_presses = press_count > 0
+        if sent_presses:
+            action = self.combo_action(pressed_mask)
+            if action > ACTION_SWAP:
+                # Release any modifiers that were already sent (they're part of this special key)
+                self._release_sent(CAPS_SHIFT_IDX)
+                self._release_sent(SYMBOL_SHIFT_IDX)
+                # Also release the other keys if they were already sent
+                others = pressed_mask & ~(CAPS_SHIFT_BIT | SYMBOL_SHIFT_BIT)
+                idx = 0
+                while others:
+                    if others & 1:
+                        self._release_sent(idx)
+                    others >>= 1
+                    idx += 1
+
+                # Send the special HID keycode directly - don't send modifiers
+                self._add(action)
+                # Skip sending individual keys for this scan
+                sent_presses = False
+
+        # Now send individual keys (if not part of a special key combo)
+        if sent_presses:
+            for i in range(press_count):
+                idx = events[i] & EVENT_KEY_MASK
+                # Normal keycode handling with modifier swapping
+                keycode = current_mode[idx]
+
+                if idx == CAPS_SHIFT_IDX:
+                    # CAPS SHIFT pressed with a swapping key - send SYMBOL SHIFT instead
+                    if pressed_mask & self.caps_swap_mask:
+                        keycode = current_mode[SYMBOL_SHIFT_IDX]
+                elif idx == SYMBOL_SHIFT_IDX:
+                    # SYMBOL SHIFT pressed with a swapping key - send CAPS SHIFT instead
+                    if pressed_mask & self.symbol_swap_mask:
+                        keycode = current_mode[CAPS_SHIFT_IDX]
+                else:
+                    # Regular key pressed - check if modifier combo needs swap
+                    mod_state = modifier_state(pressed_mask)
+                    if combo_actions[mod_state * KEY_COUNT + idx] == ACTION_SWAP:
+                        # Also send the other shift's keycode
+                        if mod_state == MOD_CAPS:
+                            self._add(current_mode[SYMBOL_SHIFT_IDX])
+                        else:
+                            self._add(current_mode[CAPS_SHIFT_IDX])
+
+                self._add(keycode)
+                # Track that we sent this keycode
+                sent_keycodes[idx] = keycode
+
+        # Handle key releases - need to check for special keys and swapped modifiers
+        if press_count < event_count:
+            # Every release in this scan shares the same previous combination
+            prev_action = self.combo_action(prev_mask)
+
+            for i in range(press_count, event_count):
+                idx = events[i]
+                # Check if this was a special key combination
+                if prev_action > ACTION_SWAP:
+                    # Release the special HID keycode
+                    self._add(OP_RELEASE | prev_action)
+                    continue  # Skip normal keycode handling
+
+                # Normal keycode release handling with modifier swapping
+                keycode = current_mode[idx]
+
+                # Check if this was part of a swapped modifier combination
+                if idx == CAPS_SHIFT_IDX:
+                    if prev_mask & self.caps_swap_mask:
+                        self._add(OP_RELEASE | current_mode[SYMBOL_SHIFT_IDX])
+                        keycode = 0  # Don't release the original
+                elif idx == SYMBOL_SHIFT_IDX:
+                    if prev_mask & self.symbol_swap_mask:
+                        self._add(OP_RELEASE | current_mode[CAPS_SHIFT_IDX])
+                        keycode = 0  # Don't release the original
+
+                if keycode:
+                    self._add(OP_RELEASE | keycode)
+                    # Remove from tracking
+                    sent_keycodes[idx] = 0
+                # Reset reported key when all keys are released
+                if not pressed_mask:
+                    self.last_reported_key = None
+                    for slot in range(KEY_COUNT):
+                        sent_keycodes[slot] = 0
+
+        return sent_presses
+
+    def log_changes(self):
+        """Log the keys pressed in the last step, for the log to name later."""
+        diag = self.diag
+        layer = self.layer
+        pressed_mask = self.held_mask
+        currently_pressed = indices_of(pressed_mask)
+
+        # Now process all newly pressed keys together to detect combinations
+        if self.sent_presses:
+            # Get all currently pressed keys (including ones that were already pressed)
+            combo_indices = currently_pressed
+
+            # Only report if this is a new combination (avoid duplicate reports)
+            current_combo = pressed_mask
+            if current_combo != self.last_reported_key:
+                # Determine what to report. Every combination of two or more
+                # keys has a Spectrum name (see code.py's get_spectrum_key_name)
+                if len(combo_indices) > 1:
+                    # This is a combination - show the Spectrum key name
+                    diag.log(LEVEL_KEYS, RECORD_COMBO, layer, pressed_mask)
+                    self.last_reported_key = current_combo
+                else:
+                    # Single key pressed - check if it's a modifier
+                    idx = combo_indices[0]
+                    if idx == CAPS_SHIFT_IDX or idx == SYMBOL_SHIFT_IDX:
+                        # Don't report a modifier alone - it is reported
+                        # with the key that follows, as a combination
+                        pass
+                    else:
+                        # Non-modifier key - report it immediately
+                        diag.log(LEVEL_KEYS, RECORD_KEY, layer, pressed_mask)
+                        self.last_reported_key = current_combo
+        else:
+            # No new keys pressed, but check if we have keys held that we haven't reported yet
+            # This handles the case where CAPS SHIFT was pressed first, then number key arrives later
+            if len(currently_pressed) > 0:
+                current_combo = pressed_mask
+                if current_combo != self.last_reported_key:
+                    if len(currently_pressed) > 1:
+                        # We have a combination that we haven't reported yet
+                        diag.log(LEVEL_KEYS, RECORD_COMBO, layer, pressed_mask)
+                        self.last_reported_key = current_combo
+                    elif len(currently_pressed) == 1:
+                        # Single modifier held - don't report modifiers alone
+                        # They should only be reported as part of combinations
+                        pass
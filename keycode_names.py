@@ -0,0 +1,31 @@
+from adafruit_hid.keycode import Keycode
+
+# keycode value -> Keycode attribute name, built on first use.
+# Only imported when key logging is on, so a build without logging
+# never pays for it.
+_names = None
+
+
+def keycode_name(keycode):
+    """Get the Keycode attribute name for a keycode value."""
+    global _names
+    if _names is None:
+        _names = {}
+        for attr_name in dir(Keycode):
+            if not attr_name.startswith('_'):
+                attr_value = getattr(Keycode, attr_name)
+                # Keep the first name (dir() is sorted) for aliased values
+                if isinstance(attr_value, int) and attr_value not in _names:
+                    _names[attr_value] = attr_name
+
+    name = _names.get(keycode)
+    if name is None:
+        # Fallback to showing the numeric value
+        return f"KEYCODE_{keycode}"
+    return name
+
+
+def clear():
+    """Drop the cached index to give its RAM back."""
+    global _names
+    _names = None
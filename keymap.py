@@ -0,0 +1,115 @@
+"""The compiled keymap: matrix index -> HID keycode, as flat byte tables.
+
+lookup_tables.py is the source, kept readable with names and tuples.
+tools/compile_keymap.py turns it into keymap.bin on a PC, and this loads
+that file on the board without importing the tables at all:
+
+    offset           size                contents
+    0                4                   b"ZXKM"
+    4                1                   format version
+    5                1                   key count (40)
+    6                1                   mode count
+    7                1                   CAPS SHIFT index
+    8                1                   SYMBOL SHIFT index
+    9                modes * keys        keycode of each key, for each mode
+    ...              3 * keys            combo actions, by state * keys + key
+    ...              2 * (keys + 7)//8   CAPS, then SYMBOL SHIFT swap masks,
+                                         little-endian
+
+Everything is indexed straight out of the file's bytes.
+"""
+
+KEYMAP_FILE = "keymap.bin"
+MAGIC = b"ZXKM"
+FORMAT_VERSION = 1
+HEADER_SIZE = 9
+
+KEY_COUNT = 40
+CAPS_SHIFT_IDX = 25
+SYMBOL_SHIFT_IDX = 36
+CAPS_SHIFT_BIT = 1 << CAPS_SHIFT_IDX
+SYMBOL_SHIFT_BIT = 1 << SYMBOL_SHIFT_IDX
+
+# Modifier states (rows of the combo actions)
+MOD_NONE = 0
+MOD_CAPS = 1
+MOD_SYMBOL = 2
+MOD_STATES = 3
+
+# Combo actions. Any other value is the HID keycode to send instead of the
+# combination (from SPECIAL_KEY_HID_MAP).
+ACTION_PASS = 0  # Send the key's own keycode
+ACTION_SWAP = 1  # Send the other shift's keycode (HID usage 1 is never a real key)
+
+# Map a single-bit mask to its key index, for finding the lowest pressed key
+BIT_INDEX = {1 << idx: idx for idx in range(KEY_COUNT)}
+
+
+class Keymap:
+    """Keycodes per mode, combo actions and shift swap masks.
+
+    keycodes holds every mode (layer) back to back, mode * KEY_COUNT + key,
+    and modes[m] is a view of mode m's slice of it (0: PC, 1: Spectrum), so
+    changing layer is just picking another view. combo_actions[state *
+    KEY_COUNT + idx] is the action for key idx held with the shift of that
+    modifier state.
+    """
+
+    def __init__(self, keycodes, combo_actions, caps_swap_mask, symbol_swap_mask):
+        keycodes = memoryview(keycodes)
+        self.keycodes = keycodes
+        self.modes = tuple(keycodes[pos:pos + KEY_COUNT]
+                           for pos in range(0, len(keycodes), KEY_COUNT))
+        self.combo_actions = combo_actions
+        self.caps_swap_mask = caps_swap_mask
+        self.symbol_swap_mask = symbol_swap_mask
+
+
+def mask_size(key_count):
+    return (key_count + 7) // 8
+
+
+def parse_keymap(data):
+    """Return the Keymap in data, the contents of a keymap file.
+
+    Raises ValueError if it isn't one, or was compiled for another matrix.
+    """
+    if data[:4] != MAGIC or data[4] != FORMAT_VERSION:
+        raise ValueError("not a keymap file, or an old format")
+    key_count, mode_count, caps_idx, symbol_idx = data[5], data[6], data[7], data[8]
+    if (key_count, caps_idx, symbol_idx) != (KEY_COUNT, CAPS_SHIFT_IDX, SYMBOL_SHIFT_IDX):
+        raise ValueError("keymap compiled for a different matrix")
+    size = mask_size(key_count)
+    end = HEADER_SIZE + (mode_count + MOD_STATES) * key_count + 2 * size
+    if len(data) != end:
+        raise ValueError("keymap file is the wrong size")
+
+    view = memoryview(data)
+    pos = HEADER_SIZE + mode_count * key_count
+    keycodes = view[HEADER_SIZE:pos]
+    combo_actions = view[pos:pos + MOD_STATES * key_count]
+    pos += MOD_STATES * key_count
+    caps_swap_mask = int.from_bytes(data[pos:pos + size], "little")
+    symbol_swap_mask = int.from_bytes(data[pos + size:end], "little")
+    return Keymap(keycodes, combo_actions, caps_swap_mask, symbol_swap_mask)
+
+
+def load_keymap(path=KEYMAP_FILE):
+    """Return the compiled keymap from path, or None if there is no such file."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return parse_keymap(data)
+
+
+def keymap_from_tables():
+    """Build the keymap from lookup_tables.py, for when keymap.bin is missing."""
+    import lookup_tables
+    return Keymap(
+        bytes(lookup_tables.pc_mode) + bytes(lookup_tables.spectrum_mode),
+        lookup_tables.COMBO_ACTIONS,
+        lookup_tables.CAPS_SWAP_MASK,
+        lookup_tables.SYMBOL_SWAP_MASK,
+    )
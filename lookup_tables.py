@@ -1,5 +1,17 @@
 from adafruit_hid.keycode import Keycode
 
+# Matrix constants, modifier states and actions for the compiled table at
+# the end, shared with the compiled keymap loader
+from keymap import (
+    KEY_COUNT,
+    CAPS_SHIFT_IDX,
+    SYMBOL_SHIFT_IDX,
+    MOD_CAPS,
+    MOD_SYMBOL,
+    MOD_STATES,
+    ACTION_SWAP,
+)
+
 # Your confirmed electrical matrix layout
 
 pc_mode = [
@@ -157,3 +169,45 @@ SWAP_MODIFIERS = {
     (36, 1): True,   # SYMBOL SHIFT + 2 (") should send CAPS SHIFT keycode
     # Add more mappings here as needed
 }
+
+# ---------------------------------------------------------------------------
+# Compiled combo resolution table
+#
+# Everything above is keyed by names and tuples, which is nice to edit but
+# slow to look up on every key change. At import time it is flattened into
+# COMBO_ACTIONS, indexed by (modifier state * KEY_COUNT + key index).
+# tools/compile_keymap.py saves the same tables to keymap.bin, which code.py
+# loads instead of importing this module.
+# ---------------------------------------------------------------------------
+
+
+def _swap_mask(modifier_idx):
+    mask = 0
+    for (mod_idx, other_idx), swap in SWAP_MODIFIERS.items():
+        if swap and mod_idx == modifier_idx:
+            mask |= 1 << other_idx
+    return mask
+
+
+# Keys which, held together with the shift, make the shift itself swap
+CAPS_SWAP_MASK = _swap_mask(CAPS_SHIFT_IDX)
+SYMBOL_SWAP_MASK = _swap_mask(SYMBOL_SHIFT_IDX)
+
+
+def _compile_combo_actions():
+    actions = bytearray(MOD_STATES * KEY_COUNT)
+    for mod_state, mod_idx, combos in (
+        (MOD_CAPS, CAPS_SHIFT_IDX, CAPS_SHIFT_COMBOS),
+        (MOD_SYMBOL, SYMBOL_SHIFT_IDX, SYMBOL_SHIFT_COMBOS),
+    ):
+        for idx in range(KEY_COUNT):
+            combo_key = (mod_idx, idx)
+            special_keycode = SPECIAL_KEY_HID_MAP.get(combos.get(combo_key))
+            if special_keycode is not None:
+                actions[mod_state * KEY_COUNT + idx] = special_keycode
+            elif SWAP_MODIFIERS.get(combo_key):
+                actions[mod_state * KEY_COUNT + idx] = ACTION_SWAP
+    return actions
+
+
+COMBO_ACTIONS = _compile_combo_actions()
@@ -0,0 +1,196 @@
+"""Type whole strings, such as Spectrum BASIC keywords, from one chord.
+
+On the Spectrum most keys type a keyword in K mode (P is PRINT, J is
+LOAD...). A PC has no such mode, so code.py can instead queue the keyword
+as text when the key is pressed with MACRO_CHORD held, and MacroPlayer
+types it out a report at a time while scanning carries on.
+
+Text is queued already encoded: one byte per character, the HID keycode
+with SHIFTED set when it needs SHIFT (US layout).
+"""
+
+import supervisor
+from adafruit_hid.keycode import Keycode
+
+from hid_output import MODIFIER_BASE
+from ticks import ticks_add, ticks_diff
+
+# Top bit of an encoded character: type it with SHIFT held
+SHIFTED = 0x80
+KEYCODE_MASK = 0x7F
+
+# SHIFT's bit in the modifier byte of the report
+SHIFT_BIT = 1 << (Keycode.SHIFT - MODIFIER_BASE)
+
+
+def _ascii_table():
+    # Encoded character for each ASCII code, 0 where it can't be typed
+    table = bytearray(128)
+    for i in range(26):
+        table[ord("a") + i] = Keycode.A + i
+        table[ord("A") + i] = (Keycode.A + i) | SHIFTED
+    for i, (digit, symbol) in enumerate(zip("1234567890", "!@#$%^&*()")):
+        table[ord(digit)] = Keycode.ONE + i
+        table[ord(symbol)] = (Keycode.ONE + i) | SHIFTED
+    for chars, keycode in (
+        ("-_", Keycode.MINUS),
+        ("=+", Keycode.EQUALS),
+        ("[{", Keycode.LEFT_BRACKET),
+        ("]}", Keycode.RIGHT_BRACKET),
+        ("\\|", Keycode.BACKSLASH),
+        (";:", Keycode.SEMICOLON),
+        ("'\"", Keycode.QUOTE),
+        ("`~", Keycode.GRAVE_ACCENT),
+        (",<", Keycode.COMMA),
+        (".>", Keycode.PERIOD),
+        ("/?", Keycode.FORWARD_SLASH),
+    ):
+        table[ord(chars[0])] = keycode
+        table[ord(chars[1])] = keycode | SHIFTED
+    table[ord(" ")] = Keycode.SPACE
+    table[ord("\n")] = Keycode.ENTER
+    return table
+
+
+ASCII_KEYCODES = _ascii_table()
+
+
+def encode(text):
+    """Encode text for MacroPlayer.play(). Raises ValueError if it can't be typed."""
+    data = bytearray(len(text))
+    for i, char in enumerate(text):
+        code = ord(char)
+        encoded = ASCII_KEYCODES[code] if code < 128 else 0
+        if not encoded:
+            raise ValueError("can't type %r" % char)
+        data[i] = encoded
+    return bytes(data)
+
+
+# The Spectrum 48K's K mode keyword on each key, by matrix index
+KEYWORDS = tuple(encode(text) for text in (
+    "", "", "", "", "",                                       # 1 2 3 4 5
+    "PLOT ", "DRAW ", "REM ", "RUN ", "RANDOMIZE ",           # Q W E R T
+    "NEW ", "SAVE ", "DIM ", "FOR ", "GO TO ",                # A S D F G
+    "", "", "", "", "",                                       # 0 9 8 7 6
+    "PRINT ", "POKE ", "INPUT ", "IF ", "RETURN ",            # P O I U Y
+    "", "COPY ", "CLEAR ", "CONTINUE ", "CLS ",               # CAPS Z X C V
+    "", "LET ", "LIST ", 'LOAD ""', "GO SUB ",                # ENTER L K J H
+    "", "", "PAUSE ", "NEXT ", "BORDER ",                     # SPACE SYM M N B
+))
+
+
+class MacroPlayer:
+    """Type queued text through the keyboard report, at a limited rate.
+
+    service() is called once per scan and sends at most one report, and
+    only once interval_ms has passed since the last, so playing never
+    holds up scanning and never sends faster than the host polls. A
+    character normally goes out in a single report that also lets go of
+    the one before it; a repeated character (the "" of LOAD "") needs an
+    extra report in between to release the key. SHIFT is only let go if
+    the player pressed it, so a shift held on the keyboard stays down.
+
+    pending is non-zero while anything is queued or still pressed; keep
+    scanning at full rate until it clears. Text that doesn't fit in the
+    queue is dropped whole and counted in overflows.
+    """
+
+    def __init__(self, keyboard, reports_per_second=100, capacity=256):
+        self.keyboard = keyboard
+        self.interval_ms = max(1, 1000 // reports_per_second)
+        self.ticks_ms = supervisor.ticks_ms
+        self.queue = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self.down = 0      # Encoded character pressed on the host, or 0
+        self.own_shift = False
+        self.pending = 0
+        self.next_at = 0
+        self.typed = 0
+        self.overflows = 0
+
+    def play(self, text):
+        """Queue encoded text. Returns False if it didn't fit."""
+        length = len(text)
+        if not length:
+            return True
+        if length > self.capacity - self.count:
+            self.overflows += 1
+            return False
+        if not self.pending:
+            # Start straight away
+            self.next_at = self.ticks_ms()
+        queue = self.queue
+        capacity = self.capacity
+        tail = (self.head + self.count) % capacity
+        for i in range(length):
+            queue[tail] = text[i]
+            tail += 1
+            if tail == capacity:
+                tail = 0
+        self.count += length
+        self.pending = 1
+        return True
+
+    def service(self):
+        """Send the next report if one is due. Returns True if it sent one."""
+        if not self.pending:
+            return False
+        now = self.ticks_ms()
+        if ticks_diff(now, self.next_at) < 0:
+            return False   # Not due yet
+
+        keyboard = self.keyboard
+        down = self.down
+        if self.count:
+            code = self.queue[self.head]
+            if down and (code ^ down) & KEYCODE_MASK == 0:
+                # Same key again: let go of it first
+                self._release(down)
+            else:
+                if down:
+                    self._release(down)
+                self.head += 1
+                if self.head == self.capacity:
+                    self.head = 0
+                self.count -= 1
+                if code & SHIFTED:
+                    self.own_shift = not keyboard.report[0] & SHIFT_BIT
+                    keyboard.press(Keycode.SHIFT)
+                keyboard.press(code & KEYCODE_MASK)
+                self.down = code
+                self.typed += 1
+        else:
+            if down:
+                self._release(down)
+            self.pending = 0
+        keyboard.send()
+        self.next_at = ticks_add(now, self.interval_ms)
+        return True
+
+    def _release(self, code):
+        keyboard = self.keyboard
+        keyboard.release(code & KEYCODE_MASK)
+        if self.own_shift:
+            keyboard.release(Keycode.SHIFT)
+            self.own_shift = False
+        self.down = 0
+
+    def lift(self):
+        """Let go of the key pressed, if any, without sending.
+
+        For when keys from the matrix are about to go out in the same
+        report, so they aren't typed with the player's SHIFT. The next
+        character follows as usual.
+        """
+        if self.down:
+            self._release(self.down)
+
+    def cancel(self):
+        """Drop whatever is queued and let go of the key pressed, if any."""
+        self.count = 0
+        if self.down:
+            self._release(self.down)
+        self.pending = 0
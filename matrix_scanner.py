@@ -1,15 +1,154 @@
 import time
 import digitalio
 
+from debouncer import Debouncer
+from event_ring import EVENT_PRESSED, add_events
+from ticks import ticks_diff
+
+# How many times to check the rows have recovered after releasing a column
+RECOVERY_POLLS = 4
+
+# Per column settle times and sample counts measured by calibrate.py, loaded
+# at boot when the file is there
+CALIBRATION_FILE = "calibration.json"
+
+# Most reads read_mask() votes on for one column, and the pause between them
+MAX_SAMPLES = 5
+SAMPLE_GAP_US = 20
+
+# Stages of scan_mask() timed by a profiler given to SpectrumMatrix.profile(),
+# numbered on from its first_stage
+SCAN_STAGES = ("read", "ghost", "debounce")
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """Return the calibration saved by calibrate.py, or None if there is none."""
+    import json
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def majority(samples, count, row_count):
+    """Rows low in more than half of the first count reads in samples."""
+    rows = 0
+    bit = 1
+    for _ in range(row_count):
+        votes = 0
+        for i in range(count):
+            if samples[i] & bit:
+                votes += 1
+        if votes * 2 > count:
+            rows |= bit
+        bit <<= 1
+    return rows
+
+
+class PinRows:
+    """Read the row lines one digitalio pin at a time. Works on any board."""
+
+    def __init__(self, row_pins):
+        self.pins = row_pins
+
+    def read(self):
+        """Return a byte with bit n set when row n reads low."""
+        rows = 0
+        bit = 1
+        for pin in self.pins:
+            if not pin.value:
+                rows |= bit
+            bit <<= 1
+        return rows
+
+
+class RegisterRows:
+    """Read every row line at once from the RP2040 GPIO input register.
+
+    The rows must be on consecutive GPIOs starting at first_gpio (GP2-GP9
+    on this board). Needs the memorymap module; raises ImportError or
+    ValueError where it isn't available, so callers can fall back to
+    PinRows. The row pins still have to be set up (pull-ups) through
+    digitalio, which SpectrumMatrix does.
+
+    Only the bytes of the register holding the rows are read, one at a
+    time by index: a slice of the register would make a new bytes object
+    on every read.
+    """
+
+    GPIO_IN = 0xD0000004  # SIO_BASE + GPIO_IN
+
+    def __init__(self, first_gpio, row_count):
+        import memorymap
+        self.gpio_in = memorymap.AddressRange(start=self.GPIO_IN, length=4)
+        self.first_byte = first_gpio // 8
+        self.two_bytes = (first_gpio + row_count - 1) // 8 > self.first_byte
+        self.shift = first_gpio % 8
+        self.mask = (1 << row_count) - 1
+
+    def read(self):
+        """Return a byte with bit n set when row n reads low."""
+        gpio_in = self.gpio_in
+        value = gpio_in[self.first_byte]
+        if self.two_bytes:
+            value |= gpio_in[self.first_byte + 1] << 8
+        return ~(value >> self.shift) & self.mask
+
+
 class SpectrumMatrix:
-    def __init__(self, row_pins, col_pins, settle_us=300):
+    # Every scan_events() call scans afresh, nothing is ever left over
+    pending = False
+
+    def __init__(self, row_pins, col_pins, settle_us=300, fast_settle_us=None,
+                 debouncer=None, row_reader=None, ghost_filter=None,
+                 calibration=None):
         self.rows = []
         self.cols = []
         self.settle = settle_us / 1_000_000
+        # Settle time used by scan_mask(); defaults to the same as scan()
+        if fast_settle_us is None:
+            fast_settle_us = settle_us
+        self.fast_settle = fast_settle_us / 1_000_000
+        self.recovery_slice = self.fast_settle / RECOVERY_POLLS
         self.row_count = len(row_pins)
         self.col_count = len(col_pins)
         self.key_count = self.row_count * self.col_count
 
+        # Last raw snapshot and the debounced state reported by scan_mask()
+        self.raw_mask = 0
+        self.mask = 0
+        self.prev_mask = 0
+
+        # Events from the last scan_events() call, at most one per key,
+        # and the time.monotonic_ns() of the scan they came from
+        self.events = bytearray(self.key_count)
+        self.time_ns = 0
+
+        # Bit for each key, built once so scans don't shift large ints
+        self.key_bits = tuple(1 << idx for idx in range(self.key_count))
+
+        # Rows read low on each column in the last read_mask()
+        self.col_rows = bytearray(self.col_count)
+        # Optional phantom key blocking, see ghosting.GhostFilter
+        self.ghost_filter = ghost_filter
+
+        # Settle time, recovery poll and number of reads to vote on for each
+        # column in read_mask(). The same for every column unless a
+        # calibration says otherwise.
+        self.col_settle = [self.fast_settle] * self.col_count
+        self.col_recovery = [self.recovery_slice] * self.col_count
+        self.col_samples = bytearray([1] * self.col_count)
+        self.sample_gap = SAMPLE_GAP_US / 1_000_000
+        self.samples = bytearray(MAX_SAMPLES)
+        if calibration is not None:
+            self.apply_calibration(calibration)
+
+        # Two agreeing snapshots in a row are needed to change a key
+        if debouncer is None:
+            debouncer = Debouncer(self.key_count, press_scans=2, release_scans=2)
+        self.debouncer = debouncer
+
         for pin in row_pins:
             p = digitalio.DigitalInOut(pin)
             p.direction = digitalio.Direction.INPUT
@@ -22,6 +161,51 @@ class SpectrumMatrix:
             p.pull = digitalio.Pull.UP
             self.cols.append(p)
 
+        # How scan_mask() reads the rows for a driven column
+        if row_reader is None:
+            row_reader = PinRows(self.rows)
+        self.row_reader = row_reader
+        self._read_rows = row_reader.read
+
+        # Times the stages of scan_mask() when set, see profile()
+        self.profiler = None
+        self.profile_stage = 0
+        # Records every raw mask scan_mask() reads when set, see capture()
+        self.recorder = None
+
+    def profile(self, profiler, first_stage):
+        """Time SCAN_STAGES with a profiler.StageProfiler (None: stop timing).
+
+        The stages are recorded as first_stage and the ones after it.
+        """
+        self.profiler = profiler
+        self.profile_stage = first_stage
+
+    def capture(self, recorder):
+        """Pass every raw scan to a scan_capture.ScanRecorder (None: stop)."""
+        self.recorder = recorder
+
+    def apply_calibration(self, calibration):
+        """Use per column settle times and sample counts, as saved by calibrate.py.
+
+        calibration is a dict with "settle_us" and "samples" lists, one
+        entry per column, and optionally "sample_gap_us".
+        """
+        settle_us = calibration["settle_us"]
+        samples = calibration["samples"]
+        if len(settle_us) != self.col_count or len(samples) != self.col_count:
+            raise ValueError("calibration is for a different number of columns")
+        for c_index in range(self.col_count):
+            settle = settle_us[c_index] / 1_000_000
+            self.col_settle[c_index] = settle
+            self.col_recovery[c_index] = settle / RECOVERY_POLLS
+            self.col_samples[c_index] = min(max(samples[c_index], 1), MAX_SAMPLES)
+        self.sample_gap = calibration.get("sample_gap_us", SAMPLE_GAP_US) / 1_000_000
+        # Watching for a wake-up drives every column at once, so wait for
+        # the slowest
+        self.fast_settle = max(self.col_settle)
+        self.recovery_slice = self.fast_settle / RECOVERY_POLLS
+
     def scan(self):
         result = [0] * self.key_count
 
@@ -49,3 +233,253 @@ class SpectrumMatrix:
             time.sleep(self.settle)
 
         return result
+
+    def read_mask(self):
+        """Read the whole matrix once, returning a bitmask (bit n = key n pressed)."""
+        mask = 0
+        key_bits = self.key_bits
+        col_count = self.col_count
+        read_rows = self._read_rows
+        col_settle = self.col_settle
+        col_samples = self.col_samples
+
+        for c_index in range(col_count):
+            c_pin = self.cols[c_index]
+            c_pin.direction = digitalio.Direction.OUTPUT
+            c_pin.value = False
+            time.sleep(col_settle[c_index])
+
+            # All rows for this column in one read, no sleeping in between,
+            # unless calibration found the column needs a few reads voted on
+            rows = read_rows()
+            if col_samples[c_index] > 1:
+                rows = self._vote(read_rows, rows, col_samples[c_index])
+            self.col_rows[c_index] = rows
+            idx = c_index
+            while rows:
+                if rows & 1:
+                    mask |= key_bits[idx]
+                rows >>= 1
+                idx += col_count
+
+            c_pin.direction = digitalio.Direction.INPUT
+            c_pin.pull = digitalio.Pull.UP
+            self._wait_recovered(read_rows, self.col_recovery[c_index])
+
+        return mask
+
+    def read_column(self, c_index, settle, samples=1):
+        """Drive one column for settle seconds and return the rows reading low.
+
+        With samples > 1 that many reads are voted on, as read_mask() does.
+        The column is released again, without waiting for the rows to
+        recover; used by calibrate.py.
+        """
+        c_pin = self.cols[c_index]
+        c_pin.direction = digitalio.Direction.OUTPUT
+        c_pin.value = False
+        time.sleep(settle)
+        rows = self._read_rows()
+        if samples > 1:
+            rows = self._vote(self._read_rows, rows, samples)
+        c_pin.direction = digitalio.Direction.INPUT
+        c_pin.pull = digitalio.Pull.UP
+        return rows
+
+    def _vote(self, read_rows, rows, count):
+        # Take count reads in all (rows is the first) and keep the rows low
+        # in most of them. Only counted row by row when the reads disagree.
+        samples = self.samples
+        samples[0] = rows
+        agree = True
+        for i in range(1, count):
+            time.sleep(self.sample_gap)
+            sample = read_rows()
+            samples[i] = sample
+            if sample != rows:
+                agree = False
+        if agree:
+            return rows
+        return majority(samples, count, self.row_count)
+
+    def _wait_recovered(self, read_rows, poll):
+        # With no column driven every row should read high. Rows are only
+        # still low while the released column's keys drain, so stop waiting
+        # as soon as they have all recovered (straight away when idle).
+        for _ in range(RECOVERY_POLLS):
+            if not read_rows():
+                return
+            time.sleep(poll)
+
+    def start_watch(self):
+        """Drive every column low, so that any key pressed pulls its row low."""
+        for c_pin in self.cols:
+            c_pin.direction = digitalio.Direction.OUTPUT
+            c_pin.value = False
+        time.sleep(self.fast_settle)
+
+    def rows_low(self):
+        """The rows reading low, bit n for row n. Any set while watching means a key is down."""
+        return self._read_rows()
+
+    def stop_watch(self):
+        """Let the columns go again, ready for the next scan."""
+        for c_pin in self.cols:
+            c_pin.direction = digitalio.Direction.INPUT
+            c_pin.pull = digitalio.Pull.UP
+        self._wait_recovered(self._read_rows, self.recovery_slice)
+
+    def scan_mask(self):
+        """Fast scan mode: read the matrix once and return the debounced bitmask.
+
+        Instead of sampling every pin several times, whole-matrix snapshots
+        are fed to the debouncer, which only changes a key once enough
+        successive snapshots agree on its new value.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            started = profiler.start()
+        raw = self.raw_mask = self.read_mask()
+        if self.recorder is not None:
+            self.recorder.add(raw)
+        if profiler is not None:
+            started = profiler.lap(self.profile_stage, started)
+        if self.ghost_filter is not None:
+            raw = self.ghost_filter.update(raw, self.col_rows)
+            if profiler is not None:
+                started = profiler.lap(self.profile_stage + 1, started)
+        self.mask = self.debouncer.update(raw)
+        if profiler is not None:
+            profiler.stop(self.profile_stage + 2, started)
+        return self.mask
+
+    def scan_events(self):
+        """Scan once and record which keys changed since the previous scan.
+
+        The changed keys come from XORing the previous and current bitmasks,
+        so an idle scan does no per-key work. Events are written to
+        self.events (presses first, then releases, each in key order) and
+        the number of events is returned.
+        """
+        prev = self.mask
+        now = self.scan_mask()
+        self.prev_mask = prev
+        changed = prev ^ now
+        if not changed:
+            return 0
+
+        self.time_ns = time.monotonic_ns()
+        count = add_events(self.events, changed & now, EVENT_PRESSED, 0)
+        return add_events(self.events, changed & prev, 0, count)
+
+
+class KeypadMatrix:
+    """Background scanning with the CircuitPython keypad module.
+
+    keypad.KeyMatrix drives the matrix lines and reads them back from a
+    background tick, independently of the Python loop, and queues the
+    changes with timestamps. A slow print() or a GC pause in the loop then
+    only delays keys instead of losing them. scan_events() drains the queue
+    and fills self.events, self.mask and self.prev_mask the same way
+    SpectrumMatrix does, so code.py decodes both alike.
+
+    keypad waits only about a microsecond after driving a line, so this
+    needs a membrane that settles that fast. Needs the keypad module;
+    raises ImportError where it isn't available.
+
+    self.pending is True while events already taken from the queue are
+    waiting for the next scan_events() call.
+    """
+
+    def __init__(self, row_pins, col_pins, interval=0.005, debounce_scans=2,
+                 max_events=64):
+        import keypad
+        import supervisor
+        self.ticks_ms = supervisor.ticks_ms
+        self.row_count = len(row_pins)
+        self.col_count = len(col_pins)
+        self.key_count = self.row_count * self.col_count
+        # Lines driven low against pull-ups, as in SpectrumMatrix. Key
+        # numbers come out as row * col_count + col, like our indices.
+        self.keys = keypad.KeyMatrix(
+            row_pins, col_pins,
+            columns_to_anodes=True,
+            interval=interval,
+            max_events=max_events,
+            debounce_threshold=debounce_scans,
+        )
+        self.queue = self.keys.events
+        self.mask = 0
+        self.prev_mask = 0
+        self.events = bytearray(self.key_count)
+        self.key_bits = tuple(1 << idx for idx in range(self.key_count))
+
+        # keypad.Event reused for every get_into(), and whether it holds an
+        # event taken from the queue but not yet applied
+        self.event = keypad.Event()
+        self.pending = False
+
+        # The background scan the last events came from, in ticks_ms and
+        # converted to time.monotonic_ns()
+        self.timestamp = 0
+        self.time_ns = 0
+        # Times the queue filled up and the key state had to be rebuilt
+        self.overflows = 0
+
+    def scan_events(self):
+        """Apply the queued events of one background scan.
+
+        Events stamped with the same time came from the same scan. One call
+        takes them all, but stops early if a key changes twice, so that the
+        batch still reads as one change per key. Call again to get the rest.
+        Returns the number of events written to self.events.
+        """
+        prev = self.mask
+        self.prev_mask = prev
+        if self.queue.overflowed:
+            return self._recover()
+
+        event = self.event
+        if not self.pending and not self.queue.get_into(event):
+            return 0
+
+        mask = prev
+        changed = 0
+        timestamp = event.timestamp
+        key_bits = self.key_bits
+        while True:
+            bit = key_bits[event.key_number]
+            if changed & bit:
+                self.pending = True
+                break
+            changed |= bit
+            if event.pressed:
+                mask |= bit
+            else:
+                mask &= ~bit
+            self.pending = self.queue.get_into(event)
+            if not self.pending or event.timestamp != timestamp:
+                break
+
+        self.mask = mask
+        self.timestamp = timestamp
+        age_ms = ticks_diff(self.ticks_ms(), timestamp)
+        self.time_ns = time.monotonic_ns() - age_ms * 1_000_000
+        # A key pressed and released again in one batch can't happen, so
+        # the XOR gives exactly the keys that changed
+        changed = prev ^ mask
+        count = add_events(self.events, changed & mask, EVENT_PRESSED, 0)
+        return add_events(self.events, changed & prev, 0, count)
+
+    def _recover(self):
+        # Events were lost, so the key state can't be trusted. Release
+        # everything and let keypad report the keys still held afresh.
+        self.overflows += 1
+        self.queue.clear()
+        self.keys.reset()
+        self.pending = False
+        prev = self.mask
+        self.mask = 0
+        self.time_ns = time.monotonic_ns()
+        return add_events(self.events, prev, 0, 0)
+
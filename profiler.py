@@ -0,0 +1,139 @@
+import sys
+import time
+from array import array
+
+import supervisor
+from micropython import const
+
+# Typed on the serial console, asks for a dump (see dump_requested())
+DUMP_KEY = "p"
+
+# Histogram of stage times: bucket 0 is under 16us, each bucket after
+# doubles, and the last takes everything from 16ms up
+HIST_BUCKETS = const(12)
+FIRST_BUCKET_US = const(16)
+
+# Times are clamped to this, and a stage's count and total are halved
+# before the total passes it, so that every value stays a small int
+LIMIT_US = const(0x3FFFFFFF)
+
+
+class StageProfiler:
+    """Time spent in each stage of a scan, from time.monotonic_ns().
+
+    Stages are numbered by their position in names. Time one with:
+
+        started = profiler.start()
+        ...
+        profiler.stop(STAGE, started)
+
+    or time stages that follow each other with lap(), which returns the
+    start of the next one. A name may hold the stages it is nested in,
+    separated by ";" ("scan;read" runs within "scan"), which is how
+    folded() builds the stacks of a flame graph.
+
+    Each stage keeps counts, totals_us, mins_us and maxes_us, and a
+    histogram of HIST_BUCKETS counts in histograms, all in arrays
+    allocated up front. After about nine minutes in one stage its count
+    and total are halved, so the mean leans towards recent scans. On the
+    board monotonic_ns() returns a long integer, so each reading leaves a
+    few bytes of garbage; the counters themselves allocate nothing.
+    """
+
+    def __init__(self, names):
+        count = len(names)
+        self.names = names
+        self.counts = array("L", [0] * count)
+        self.totals_us = array("L", [0] * count)
+        self.mins_us = array("L", [LIMIT_US] * count)
+        self.maxes_us = array("L", [0] * count)
+        self.histograms = array("L", [0] * (count * HIST_BUCKETS))
+
+    def start(self):
+        """The time now, to pass to stop() or lap() at the end of the stage."""
+        return time.monotonic_ns()
+
+    def stop(self, stage, started):
+        """Record a stage that began at started."""
+        self.record(stage, (time.monotonic_ns() - started) // 1000)
+
+    def lap(self, stage, started):
+        """Record a stage that began at started, and return when it ended."""
+        now = time.monotonic_ns()
+        self.record(stage, (now - started) // 1000)
+        return now
+
+    def record(self, stage, us):
+        """Add one run of a stage that took us microseconds."""
+        if us > LIMIT_US:
+            us = LIMIT_US
+        total = self.totals_us[stage]
+        if total > LIMIT_US - us:
+            total >>= 1
+            self.counts[stage] >>= 1
+        self.totals_us[stage] = total + us
+        self.counts[stage] += 1
+        if us < self.mins_us[stage]:
+            self.mins_us[stage] = us
+        if us > self.maxes_us[stage]:
+            self.maxes_us[stage] = us
+        bucket = 0
+        rest = us // FIRST_BUCKET_US
+        while rest and bucket < HIST_BUCKETS - 1:
+            rest >>= 1
+            bucket += 1
+        self.histograms[stage * HIST_BUCKETS + bucket] += 1
+
+    def reset(self):
+        """Start every stage afresh."""
+        for stage in range(len(self.names)):
+            self.counts[stage] = 0
+            self.totals_us[stage] = 0
+            self.mins_us[stage] = LIMIT_US
+            self.maxes_us[stage] = 0
+        for slot in range(len(self.histograms)):
+            self.histograms[slot] = 0
+
+    def histogram(self, stage):
+        """A stage's histogram counts, as a list."""
+        first = stage * HIST_BUCKETS
+        return list(self.histograms[first:first + HIST_BUCKETS])
+
+    def dump(self, emit=print):
+        """Pass a line per stage that has run, and its histogram, to emit()."""
+        emit(f"stage profile, us; histogram from <{FIRST_BUCKET_US}us doubling")
+        for stage, name in enumerate(self.names):
+            count = self.counts[stage]
+            if not count:
+                continue
+            mean = self.totals_us[stage] / count
+            emit(f"{name:16} n {count:7} min {self.mins_us[stage]:6} "
+                 f"mean {mean:9.1f} max {self.maxes_us[stage]:6}")
+            emit(f"{'':16} {self.histogram(stage)}")
+
+    def dump_requested(self):
+        """Whether DUMP_KEY was typed on the serial console since the last call.
+
+        Anything else typed is thrown away.
+        """
+        requested = False
+        while supervisor.runtime.serial_bytes_available:
+            if sys.stdin.read(1) == DUMP_KEY:
+                requested = True
+        return requested
+
+    def folded(self, emit=print):
+        """Pass each stage's own time to emit() as "stack microseconds".
+
+        The own time is the stage's total less that of the stages nested
+        directly in it. The lines are in the folded format flame graph
+        tools (flamegraph.pl, speedscope) read.
+        """
+        for stage, name in enumerate(self.names):
+            own = self.totals_us[stage]
+            prefix = name + ";"
+            for child, child_name in enumerate(self.names):
+                if child_name.startswith(prefix) and ";" not in child_name[len(prefix):]:
+                    own -= self.totals_us[child]
+            if own > 0:
+                emit(f"{name} {own}")
@@ -0,0 +1,60 @@
+# Measure scans per second for each scan mode.
+# Copy to the board and run from the REPL with: import scan_benchmark
+
+import time
+import board
+
+from matrix_scanner import SpectrumMatrix, RegisterRows
+
+ROW_PINS = (
+    board.GP2,
+    board.GP3,
+    board.GP4,
+    board.GP5,
+    board.GP6,
+    board.GP7,
+    board.GP8,
+    board.GP9,
+)
+
+COL_PINS = (
+    board.GP10,
+    board.GP11,
+    board.GP12,
+    board.GP13,
+    board.GP14,
+)
+
+SETTLE_US = 1200  # Same as code.py
+SCANS = 50
+
+
+def scans_per_second(scan, count=SCANS):
+    """Call scan() count times and return the achieved rate."""
+    start = time.monotonic_ns()
+    for _ in range(count):
+        scan()
+    elapsed = time.monotonic_ns() - start
+    return count * 1_000_000_000 / elapsed
+
+
+matrix = SpectrumMatrix(ROW_PINS, COL_PINS, settle_us=SETTLE_US)
+
+legacy = scans_per_second(matrix.scan)
+fast = scans_per_second(matrix.scan_mask)
+
+print(f"scan()      {legacy:8.1f} scans/s  {1000 / legacy:6.2f} ms/scan")
+print(f"scan_mask() {fast:8.1f} scans/s  {1000 / fast:6.2f} ms/scan")
+
+# Same scan with all rows read from one GPIO register load per column. The
+# pins are already the matrix's, so swap its row reader rather than make
+# a second matrix
+try:
+    register_rows = RegisterRows(2, len(ROW_PINS))
+except ImportError:
+    print("RegisterRows unavailable (no memorymap)")
+else:
+    matrix.row_reader = register_rows
+    matrix._read_rows = register_rows.read
+    fast = scans_per_second(matrix.scan_mask)
+    print(f"registers   {fast:8.1f} scans/s  {1000 / fast:6.2f} ms/scan")
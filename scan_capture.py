@@ -0,0 +1,84 @@
+import supervisor
+from micropython import const
+
+# A capture starts with MAGIC, then holds RECORD_SIZE byte records, each a
+# run of scans that read the same raw mask: the supervisor.ticks_ms() of
+# the run's first scan (4 bytes), the mask (5 bytes) and the number of
+# scans in the run (1 byte, up to MAX_RUN), all little-endian
+MAGIC = b"ZXSCAN1\n"
+RECORD_SIZE = const(10)
+MAX_RUN = const(255)
+
+
+class ScanRecorder:
+    """Raw matrix scans, recorded for replaying on a PC (python -m sim.replay).
+
+    SpectrumMatrix passes every raw mask it reads to add(), before the
+    ghost filter and the debouncer, so a replay goes through those as well.
+    Scans reading the same mask make one record, so an idle keyboard
+    records next to nothing. Records are kept in a buffer of capacity
+    allocated up front, and only written to stream by flush(), which the
+    caller does between scans. If the buffer fills first it is written
+    there and then, which holds up the scan; stalls counts those times.
+    records counts the records written. close() writes the run still going.
+    """
+
+    def __init__(self, stream, capacity=64):
+        self.stream = stream
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.view = memoryview(self.buffer)
+        self.count = 0
+        self.ticks_ms = supervisor.ticks_ms
+        # The run of scans going on
+        self.run_mask = 0
+        self.run_ticks = 0
+        self.run_scans = 0
+        self.records = 0
+        self.stalls = 0
+        stream.write(MAGIC)
+
+    def add(self, mask):
+        """Record one scan's raw mask."""
+        if self.run_scans and mask == self.run_mask and self.run_scans < MAX_RUN:
+            self.run_scans += 1
+            return
+        if self.run_scans:
+            self._keep()
+        self.run_mask = mask
+        self.run_ticks = self.ticks_ms()
+        self.run_scans = 1
+
+    def _keep(self):
+        # Store the run going on as a record
+        if self.count == self.capacity:
+            self.stalls += 1
+            self.flush()
+        buffer = self.buffer
+        offset = self.count * RECORD_SIZE
+        ticks = self.run_ticks
+        for i in range(4):
+            buffer[offset + i] = ticks & 0xFF
+            ticks >>= 8
+        mask = self.run_mask
+        for i in range(4, 9):
+            buffer[offset + i] = mask & 0xFF
+            mask >>= 8
+        buffer[offset + 9] = self.run_scans
+        self.count += 1
+
+    def flush(self):
+        """Write out the records kept so far."""
+        if not self.count:
+            return
+        self.stream.write(self.view[:self.count * RECORD_SIZE])
+        self.stream.flush()
+        self.records += self.count
+        self.count = 0
+
+    def close(self):
+        """Write out everything, the run still going on too."""
+        if self.run_scans:
+            self._keep()
+            self.run_scans = 0
+        self.flush()
@@ -0,0 +1,192 @@
+import time
+
+import supervisor
+
+from ticks import ticks_add, ticks_diff
+
+# How often to look at the rows while waiting in an idle tier, in seconds
+WAKE_POLL = 0.001
+
+
+class ScanScheduler:
+    """Decide how long to wait between scans, from how long it's been idle.
+
+    tiers is a sequence of (idle_ms, interval) pairs in increasing idle_ms
+    order, the first with idle_ms 0: once no key has been held for idle_ms,
+    scans are interval seconds apart. The first tier is the fast one used
+    while typing.
+
+    In the slower tiers the wait holds every column low through matrix
+    (a SpectrumMatrix) and checks the rows every WAKE_POLL seconds, so a key
+    pressed while idle is picked up straight away and the scheduler drops
+    back to the fast tier. Pass matrix=None when the matrix is scanned some
+    other way (keypad); the wait is then just a sleep.
+
+    Instrumentation, all in ticks_ms:
+
+    * tier_ms[i] - time spent in tier i
+    * wakes - times a key woke an idle wait, false_wakes - those where
+      no key was registered after all
+    * wake_latency_ms - from the last wake to the key being registered,
+      with wake_latency_max_ms and wake_latency_total_ms over all wakes
+    """
+
+    def __init__(self, tiers, matrix=None):
+        self.idle_ms = tuple(idle_ms for idle_ms, _ in tiers)
+        self.intervals = tuple(interval for _, interval in tiers)
+        # Polls per idle wait, worked out once
+        self.polls = tuple(max(1, int(interval / WAKE_POLL)) for interval in self.intervals)
+        self.matrix = matrix
+        self.ticks_ms = supervisor.ticks_ms
+
+        now = self.ticks_ms()
+        self.active_at = now
+        self.last_at = now
+        self.tier = 0
+        self.tier_ms = [0] * len(tiers)
+        self.wakes = 0
+        self.false_wakes = 0
+        self.woke_at = -1
+        self.wake_latency_ms = 0
+        self.wake_latency_max_ms = 0
+        self.wake_latency_total_ms = 0
+
+    def wait(self, busy):
+        """Wait until the next scan is due. busy: a key is held or changing."""
+        tier = self.plan(busy)
+        if not tier or self.matrix is None:
+            time.sleep(self.intervals[tier])
+            return
+
+        # Idle: any key pressed now pulls its row low
+        matrix = self.matrix
+        matrix.start_watch()
+        for _ in range(self.polls[tier]):
+            if self.poll():
+                break
+            time.sleep(WAKE_POLL)
+        matrix.stop_watch()
+
+    def plan(self, busy):
+        """Account for the time since the last call and pick the tier to wait in.
+
+        The first half of wait(), for a caller that does the waiting itself
+        (the asyncio scan task): sleep intervals[tier], or for an idle tier
+        with a matrix, call poll() every WAKE_POLL seconds up to polls[tier]
+        times between matrix.start_watch() and matrix.stop_watch().
+        """
+        now = self.ticks_ms()
+        self.tier_ms[self.tier] += ticks_diff(now, self.last_at)
+        self.last_at = now
+
+        if busy:
+            self.active_at = now
+            if self.woke_at >= 0:
+                self._woken(ticks_diff(now, self.woke_at))
+        idle = ticks_diff(now, self.active_at)
+        if idle > self.idle_ms[-1]:
+            # Idle in the slowest tier for good: keep active_at close
+            # enough for ticks_diff() however long that lasts
+            self.active_at = ticks_add(now, -self.idle_ms[-1])
+
+        tier = 0
+        while tier + 1 < len(self.idle_ms) and idle >= self.idle_ms[tier + 1]:
+            tier += 1
+        self.tier = tier
+
+        if tier and self.matrix is not None and self.woke_at >= 0:
+            # Woken, but no key came of it (a bounce or a glitch)
+            self.woke_at = -1
+            self.false_wakes += 1
+        return tier
+
+    def poll(self):
+        """While watching, check the rows. Returns True if a key woke it."""
+        if not self.matrix.rows_low():
+            return False
+        self.wakes += 1
+        self.woke_at = self.ticks_ms()
+        # Straight back to fast scanning
+        self.active_at = self.woke_at
+        return True
+
+    def _woken(self, latency_ms):
+        self.woke_at = -1
+        self.wake_latency_ms = latency_ms
+        self.wake_latency_total_ms += latency_ms
+        if latency_ms > self.wake_latency_max_ms:
+            self.wake_latency_max_ms = latency_ms
+
+    def stats(self):
+        """One line of the instrumentation, for printing."""
+        tiers = " ".join(f"{interval * 1000:g}ms:{ms}" for interval, ms
+                         in zip(self.intervals, self.tier_ms))
+        woken = self.wakes - self.false_wakes
+        mean = self.wake_latency_total_ms // woken if woken else 0
+        return (f"tiers {tiers} wakes {self.wakes} ({self.false_wakes} false) "
+                f"wake latency mean {mean}ms max {self.wake_latency_max_ms}ms")
+
+
+# Cadence.late_counts buckets: on time, 1ms late, 2-3ms, 4-7ms, 8-15ms, more
+LATE_BUCKETS = 6
+
+
+class Cadence:
+    """A steady period on ticks_ms, and how late each tick actually ran.
+
+    Ticks are due every period_ms from the last one due, not from when the
+    last one ran, so a late tick doesn't push back the ones after it. A tick
+    a whole period or more late counts as an overrun, and the ticks missed
+    are skipped rather than run back to back.
+
+    Instrumentation, all in ticks_ms: ticks, late_total_ms, late_max_ms,
+    overruns, and late_counts, a histogram of lateness by LATE_BUCKETS.
+    """
+
+    def __init__(self, period_ms):
+        self.period_ms = period_ms
+        self.ticks_ms = supervisor.ticks_ms
+        self.due_at = self.ticks_ms()
+        self.ticks = 0
+        self.late_total_ms = 0
+        self.late_max_ms = 0
+        self.overruns = 0
+        self.late_counts = [0] * LATE_BUCKETS
+
+    def delay_ms(self):
+        """Milliseconds until the next tick is due, 0 if it already is."""
+        return max(0, ticks_diff(self.due_at, self.ticks_ms()))
+
+    def tick(self):
+        """Call as a tick runs: records how late it is, schedules the next."""
+        now = self.ticks_ms()
+        late = ticks_diff(now, self.due_at)
+        if late < 0:
+            late = 0   # Early
+        self.ticks += 1
+        self.late_total_ms += late
+        if late > self.late_max_ms:
+            self.late_max_ms = late
+        bucket = 0
+        rest = late
+        while rest and bucket < LATE_BUCKETS - 1:
+            rest >>= 1
+            bucket += 1
+        self.late_counts[bucket] += 1
+
+        if late >= self.period_ms:
+            self.overruns += 1
+            self.due_at = ticks_add(now, self.period_ms)
+        else:
+            self.due_at = ticks_add(self.due_at, self.period_ms)
+
+    def restart(self):
+        """Make the next tick due now, after a pause that wasn't a tick."""
+        self.due_at = self.ticks_ms()
+
+    def stats(self):
+        """One line of the instrumentation, for printing."""
+        mean = self.late_total_ms / self.ticks if self.ticks else 0
+        return (f"cadence {self.period_ms}ms ticks {self.ticks} late mean {mean:.2f}ms "
+                f"max {self.late_max_ms}ms overruns {self.overruns} "
+                f"histogram {self.late_counts}")
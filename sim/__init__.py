@@ -0,0 +1,94 @@
+"""Run the keyboard firmware on a host with CPython.
+
+The stubs directory holds stand-ins for the CircuitPython modules the
+firmware imports (board, digitalio, keypad, memorymap, usb_hid,
+adafruit_hid). They are wired to sim.hardware, which simulates the
+membrane and records HID reports against a virtual clock.
+
+    import sim
+    firmware = sim.load_firmware()   # code.py, without its main loop
+    sim.hardware.membrane.press(0)
+    firmware.scan_once()
+"""
+
+import importlib.util
+import os
+import sys
+
+from sim import hardware
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+
+# Modules that live on CIRCUITPY, reloaded from scratch by load_firmware()
+FIRMWARE_MODULES = (
+    "matrix_scanner",
+    "debouncer",
+    "event_ring",
+    "ghosting",
+    "hid_output",
+    "scan_scheduler",
+    "ticks",
+    "calibrate",
+    "macros",
+    "diag_log",
+    "profiler",
+    "scan_capture",
+    "keyboard_engine",
+    "keymap",
+    "lookup_tables",
+    "keycode_names",
+)
+
+
+def install():
+    """Make the stub modules and the firmware modules importable."""
+    for path in (ROOT, STUBS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def use_clock(module, clock=None):
+    """Point a firmware module's `time` at the simulated clock."""
+    if hasattr(module, "time"):
+        module.time = clock or hardware.clock
+
+
+def load_firmware(path=None, name="firmware", boot=False, nkro=False):
+    """Import code.py as a module with fresh hardware and firmware state.
+
+    code.py only enters its main loop when run as __main__, so this gives
+    back the configured module for the caller to drive with scan_once().
+    boot=True runs boot.py first, as at power-up; nkro=True enables the
+    N-key rollover keyboard, as boot.py does with NKRO on.
+    """
+    install()
+    hardware.reset()
+    for module_name in FIRMWARE_MODULES + (name,):
+        sys.modules.pop(module_name, None)
+    import usb_hid
+    usb_hid.reset()
+    if boot:
+        _exec_file(os.path.join(ROOT, "boot.py"), "boot")
+    if nkro:
+        from hid_output import enable_nkro
+        enable_nkro()
+    if boot or nkro:
+        # code.py starts in a fresh VM
+        for module_name in FIRMWARE_MODULES + ("boot",):
+            sys.modules.pop(module_name, None)
+
+    module = _exec_file(path or os.path.join(ROOT, "code.py"), name)
+
+    for module_name in FIRMWARE_MODULES + (name,):
+        if module_name in sys.modules:
+            use_clock(sys.modules[module_name])
+    return module
+
+
+def _exec_file(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,51 @@
+"""Run code.py's asyncio tasks on the simulated clock.
+
+VirtualTimeLoop is an asyncio event loop whose time() is the simulated
+clock. When every task is waiting, it moves the clock on to the next timer
+instead of blocking, so the tasks run at full host speed while seeing the
+timing they would on the board, and time spent inside a task (a scan's
+settle delays, a slow send_report()) shows up as lateness for the others.
+"""
+
+import asyncio
+import math
+import selectors
+
+from sim import hardware
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("every task is waiting on an event: nothing would ever run again")
+        if timeout > 0:
+            # Round up, or the clock could stop a nanosecond short of the timer
+            hardware.clock.advance_ns(math.ceil(timeout * 1_000_000_000))
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(_VirtualSelector())
+
+    def time(self):
+        return hardware.clock.monotonic()
+
+
+def run_tasks(firmware, end_ns):
+    """Run firmware.main() until the simulated clock reaches end_ns."""
+    loop = VirtualTimeLoop()
+    try:
+        main = loop.create_task(firmware.main())
+
+        async def stop_at():
+            await asyncio.sleep((end_ns - hardware.clock.monotonic_ns()) / 1_000_000_000)
+            main.cancel()
+
+        loop.run_until_complete(stop_at())
+        try:
+            loop.run_until_complete(main)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        loop.close()
@@ -0,0 +1,208 @@
+"""Check that the firmware main loop stops allocating once it is warm.
+
+Drives code.py's scan_once() against the simulated membrane with key
+logging off, and uses tracemalloc to check that neither idle scanning nor
+steady typing grows the heap, and that warm scans allocate nothing, not
+even objects freed again before the scan ends. --profile checks the same
+with code.py's stage profiler timing every stage (PROFILE). Exits non-zero
+on failure, listing the firmware lines that allocated.
+
+    python -m sim.alloc_check [--profile]
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+from collections import Counter
+
+import sim
+from sim import hardware, runner
+
+# A short typing pattern touching plain keys, both shifts, a modifier
+# swap (CAPS SHIFT + 2) and a special key (CAPS SHIFT + 5 = cursor left)
+PATTERN = (
+    (),
+    (10,),
+    (),
+    (25,),
+    (25, 4),
+    (25,),
+    (),
+    (25, 1),
+    (),
+    (36, 37),
+    (36,),
+    (),
+    (6, 7),
+    (6,),
+    (),
+)
+SCANS_PER_STEP = 8
+
+# CPython allocates every int over 256; MicroPython only those over 2**30,
+# which the 40-bit key masks need on both. One int of up to 60 bits takes
+# 32 bytes here, so an opcode allocating no more than that counts as an int.
+# Anything bigger is an allocation the board would make too: a list, a
+# dict, a bytes slice, a bound method kept, a closure.
+INT_BYTES = 32
+
+# CPython keeps ints up to 256 preallocated, so the first time one of the
+# firmware's counters (keystrokes, time per scan tier...) goes past that it
+# allocates an int once. MicroPython's small ints never allocate. Allow a
+# couple of those; a real leak grows with every scan and goes far past it.
+GROWTH_LIMIT = 64
+
+
+def run(firmware, scans, pattern):
+    membrane = hardware.membrane
+    step = 0
+    for scan in range(scans):
+        if scan % SCANS_PER_STEP == 0:
+            membrane.set_pressed(pattern[step % len(pattern)])
+            step += 1
+        firmware.scan_once()
+        firmware.wait_for_next_scan()
+
+
+def firmware_growth(before, after):
+    """Bytes still held after a run that were allocated by firmware code."""
+    filters = [
+        tracemalloc.Filter(True, os.path.join(sim.ROOT, "*.py")),
+        tracemalloc.Filter(False, os.path.join(sim.ROOT, "sim", "*")),
+    ]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    return sum(stat.size_diff for stat in after.compare_to(before, "lineno"))
+
+
+def is_firmware(filename):
+    return os.path.dirname(filename) == sim.ROOT
+
+
+class LineAllocations:
+    """Firmware lines that allocate, found by tracing every opcode run.
+
+    Between one traced event and the next, the tracemalloc peak shows what
+    the code in between allocated, even if it was freed again. In firmware
+    code every opcode is an event, and what it allocated is put down to
+    its line when that is more than one int. A call is an event too, but
+    only for CPython's frame object made for the tracer, which the board
+    doesn't have; that is let go. The simulator's own code (the membrane,
+    the stubs) is traced by call and return only, so that what it
+    allocates doesn't land on the firmware line calling it. allocations
+    counts them by (file, line).
+    """
+
+    def __init__(self):
+        self.allocations = Counter()
+        self.code = None
+        self.line = 0
+        self.base = 0
+        self.overhead = 0
+        # Held, so returning it from trace() doesn't make a new bound method
+        self.tracer = self.trace
+
+    def checkpoint(self, code, line, count=True):
+        current, peak = tracemalloc.get_traced_memory()
+        if count and peak - self.base - self.overhead > INT_BYTES and self.code is not None \
+                and is_firmware(self.code.co_filename):
+            self.allocations[os.path.basename(self.code.co_filename), self.line] += 1
+        self.code = code
+        self.line = line
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+
+    def trace(self, frame, event, arg):
+        if event == "opcode":
+            self.checkpoint(frame.f_code, frame.f_lineno)
+        elif event == "call":
+            frame.f_trace_lines = False
+            frame.f_trace_opcodes = is_firmware(frame.f_code.co_filename)
+            self.checkpoint(frame.f_code, frame.f_lineno, count=False)
+        elif event == "return":
+            caller = frame.f_back
+            if caller is None:
+                self.checkpoint(None, 0)
+            else:
+                self.checkpoint(caller.f_code, caller.f_lineno)
+        return self.tracer
+
+    def __enter__(self):
+        # What checkpoint() itself leaves in the peak, reading the memory
+        for _ in range(10):
+            self.checkpoint(None, 0)
+            self.overhead = max(self.overhead, tracemalloc.get_traced_memory()[1] - self.base)
+        self.checkpoint(None, 0)
+        sys.settrace(self.tracer)
+        return self
+
+    def __exit__(self, *exc):
+        sys.settrace(None)
+
+
+def measure(firmware, scans, pattern):
+    """Return the firmware growth in bytes over a run of scans."""
+    before = tracemalloc.take_snapshot()
+    run(firmware, scans, pattern)
+    after = tracemalloc.take_snapshot()
+    return firmware_growth(before, after)
+
+
+def count_allocations(firmware, scans, pattern):
+    """Return a Counter of the allocations by (file, line) over a run of scans."""
+    with LineAllocations() as lines:
+        run(firmware, scans, pattern)
+    return lines.allocations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", action="store_true", help="with the stage profiler on")
+    args = parser.parse_args(argv)
+
+    firmware = sim.load_firmware()
+    firmware.LOG_KEYS = False
+    if args.profile:
+        runner.use_profiler(firmware)
+    # Keep the stub from storing every report it is sent
+    firmware.keyboard.device.recording = False
+
+    # Same scan rate tiers, reached after much less idle time, so that the
+    # warm-up and the idle runs go through all of them
+    scheduler = firmware.scheduler = firmware.ScanScheduler(
+        [(idle_ms // 100, interval) for idle_ms, interval in firmware.SCAN_TIERS],
+        firmware.matrix,
+    )
+
+    # Warm up: one pass through every path so caches and dicts settle, and
+    # idle until the scheduler has been through every tier. Traced too, so
+    # that values the loop keeps and later replaces (the last event time,
+    # say) count as freed when they go.
+    tracemalloc.start()
+    run(firmware, len(PATTERN) * SCANS_PER_STEP * 2, PATTERN)
+    while scheduler.tier < len(scheduler.intervals) - 1:
+        run(firmware, SCANS_PER_STEP, ((),))
+    run(firmware, len(PATTERN) * SCANS_PER_STEP, PATTERN)
+
+    failed = False
+    scans = len(PATTERN) * SCANS_PER_STEP
+    for label, pattern in (("idle", ((),)), ("typing", PATTERN)):
+        for run_scans in (scans, scans * 10):
+            growth = measure(firmware, run_scans, pattern)
+            ok = growth <= GROWTH_LIMIT
+            failed |= not ok
+            print(f"{label:7} {run_scans:5} scans: growth {growth:5} B  {'ok' if ok else 'FAIL'}")
+        # Tracing every opcode is slow, so only over the shorter run
+        allocations = count_allocations(firmware, scans, pattern)
+        failed |= bool(allocations)
+        print(f"{label:7} {scans:5} scans: {sum(allocations.values()) / scans:.2f} "
+              f"allocations per scan  {'ok' if not allocations else 'FAIL'}")
+        for (filename, line), count in allocations.most_common(10):
+            print(f"    {filename}:{line}  {count}")
+    tracemalloc.stop()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import time
+
+
+class VirtualClock:
+    """Stands in for the `time` module inside firmware modules.
+
+    sleep() advances virtual time instantly, so scans that would sleep for
+    milliseconds on the board run at full host speed while the simulated
+    hardware still sees the correct timing.
+
+    With cpu_scale set, host CPU time spent between clock reads is added
+    too, multiplied by cpu_scale, so that Python execution cost shows up in
+    the simulated timings (e.g. cpu_scale=50 for a host roughly 50x faster
+    than the board). The default of 0 keeps runs fully deterministic.
+    """
+
+    def __init__(self, cpu_scale=0):
+        self.cpu_scale = cpu_scale
+        self.reset()
+
+    def reset(self):
+        self.now_ns = 0
+        self._host_ns = time.perf_counter_ns()
+
+    def _catch_up(self):
+        if self.cpu_scale:
+            host_ns = time.perf_counter_ns()
+            self.now_ns += int((host_ns - self._host_ns) * self.cpu_scale)
+            self._host_ns = host_ns
+
+    def sleep(self, seconds):
+        self._catch_up()
+        self.now_ns += int(seconds * 1_000_000_000)
+
+    def advance_ns(self, ns):
+        self._catch_up()
+        self.now_ns += ns
+
+    def monotonic(self):
+        self._catch_up()
+        return self.now_ns / 1_000_000_000
+
+    def monotonic_ns(self):
+        self._catch_up()
+        return self.now_ns
@@ -0,0 +1,335 @@
+"""Check a candidate decoder against a frozen reference on random key timelines.
+
+Generates random timelines of key presses and releases over the 40 matrix
+indices, with CAPS SHIFT (25) and SYMBOL SHIFT (36) picked far more often
+than the rest, since the shifts are behind the special keys and the
+modifier swaps. Each timeline is a list of steps, the keys held and for
+how many scans, some too short for the debouncer to take.
+
+Every timeline is fed as raw scans through code.py, the way sim.replay
+does it: ghost filter, debouncer, event ring, the engine and the report.
+The debounced mask of each scan then goes to the oracle,
+sim/reference_decoder.py, which is the original code.py's decoding, kept
+unchanged: names and dicts from lookup_tables.py, none of the compiled
+keymap. The same masks go to the candidate's
+step(), whose ops go to its own report. Each has a separate stand-in
+usb_hid device. The reports code.py and the candidate sent on each scan
+must match the oracle's, byte for byte. A failing timeline is shrunk, by
+dropping steps and keys and shortening holds, to a smallest one that
+still fails. It is printed with the first scan that differs.
+
+The candidate is keyboard_engine.KeyboardEngine unless --candidate names
+another class (module:Class) with the same constructor, step() and ops.
+The original had no layers, keywords or profiler, so everything runs with
+LAYER_COMBO, MACRO_CHORD and PROFILE_COMBO off. Also prints the
+host time the oracle and the candidate took to decode, from debounced
+mask to report.
+
+    python -m sim.equivalence [--count 200] [--steps 30] [--seed 1]
+                              [--candidate module:Class] [--nkro] [--json results.json]
+"""
+
+import argparse
+import importlib
+import json
+import random
+import sys
+import time
+
+import sim
+from sim import replay
+from sim.hid import report_keys
+from sim.timeline import SPECTRUM_KEY_NAMES
+
+KEY_COUNT = 40
+CAPS_SHIFT_IDX = 25
+SYMBOL_SHIFT_IDX = 36
+# How often a key pressed is one of the shifts
+SHIFT_BIAS = 0.4
+MAX_HELD = 5
+MAX_HOLD_SCANS = 8
+# Scans at the end of every timeline with nothing held, for the last
+# releases to get through the debouncer
+IDLE_SCANS = 6
+
+
+def random_timeline(rng, steps):
+    """A random list of (keys held, scans) steps, ending with no key held."""
+    timeline = []
+    held = set()
+    for _ in range(steps):
+        if held and (len(held) >= MAX_HELD or rng.random() < 0.45):
+            held.discard(rng.choice(sorted(held)))
+        elif rng.random() < SHIFT_BIAS:
+            held.add(rng.choice((CAPS_SHIFT_IDX, SYMBOL_SHIFT_IDX)))
+        else:
+            held.add(rng.randrange(KEY_COUNT))
+        timeline.append((frozenset(held), rng.randint(1, MAX_HOLD_SCANS)))
+    timeline.append((frozenset(), IDLE_SCANS))
+    return timeline
+
+
+def scans_of(timeline, period_ns):
+    """The raw scans of a timeline, as (time_ns, mask) for sim.replay.feed()."""
+    scans = []
+    for keys, count in timeline:
+        mask = 0
+        for idx in keys:
+            mask |= 1 << idx
+        for _ in range(count):
+            scans.append((len(scans) * period_ns, mask))
+    return scans
+
+
+def load_candidate(name):
+    """The class named by module:Class."""
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class Run:
+    """The reports each scan of a timeline sent, and the host time decoding took."""
+
+    def __init__(self, reports, decode_ns=0):
+        self.reports = reports      # a tuple of report bytes per scan
+        self.decode_ns = decode_ns
+
+
+def run_firmware(timeline, nkro=False):
+    """Run a timeline through code.py.
+
+    Returns the Run, the firmware, and the mask the debouncer gave each
+    scan.
+    """
+    firmware = sim.load_firmware(nkro=nkro)
+    firmware.LOG_KEYS = False
+    firmware.engine.layer_combo = None
+    firmware.engine.macro_chord = None
+    firmware.engine.command_combo = None
+    matrix = firmware.matrix
+    device = firmware.keyboard.device
+    device.clear()
+
+    reports = []
+    masks = []
+
+    def after_scan():
+        masks.append(matrix.mask)
+        reports.append(tuple(report for _, report in device.reports))
+        device.reports.clear()
+
+    replay.feed(firmware, scans_of(timeline, firmware.SCAN_PERIOD_MS * 1_000_000), after_scan)
+    return Run(reports), firmware, masks
+
+
+def open_report(firmware):
+    """A report like code.py's, on a stand-in keyboard device of its own."""
+    import usb_hid
+    from hid_output import open_keyboard
+
+    lengths = firmware.keyboard.device.in_report_lengths
+    device = usb_hid.Device(usage_page=0x01, usage=0x06, report_ids=(1,),
+                            in_report_lengths=lengths, out_report_lengths=(1,))
+    keyboard = open_keyboard([device])
+    device.clear()
+    return keyboard
+
+
+def run_reference(firmware, masks):
+    """Send the debounced masks code.py saw through the reference decoder."""
+    from sim.reference_decoder import ReferenceDecoder
+
+    keyboard = open_report(firmware)
+    device = keyboard.device
+    decoder = ReferenceDecoder(keyboard, layer=firmware.engine.layer)
+    scan = decoder.scan
+    perf_counter_ns = time.perf_counter_ns
+
+    reports = []
+    decode_ns = 0
+    for mask in masks:
+        started = perf_counter_ns()
+        scan(mask)
+        decode_ns += perf_counter_ns() - started
+        reports.append(tuple(report for _, report in device.reports))
+        device.reports.clear()
+    return Run(reports, decode_ns)
+
+
+def run_candidate(candidate, firmware, masks):
+    """Step a candidate engine through the debounced masks code.py saw."""
+    from keyboard_engine import OP_KIND, OP_ARG, OP_PRESS, OP_RELEASE, OP_RELEASE_ALL
+
+    keyboard = open_report(firmware)
+    device = keyboard.device
+    engine = candidate(firmware.keymap, layer=firmware.engine.layer)
+    step = engine.step
+    ops = engine.ops
+    perf_counter_ns = time.perf_counter_ns
+
+    reports = []
+    decode_ns = 0
+    for mask in masks:
+        started = perf_counter_ns()
+        count = step(mask)
+        if count is not None:
+            for i in range(count):
+                op = ops[i]
+                kind = op & OP_KIND
+                if kind == OP_PRESS:
+                    keyboard.press(op)
+                elif kind == OP_RELEASE:
+                    keyboard.release(op & OP_ARG)
+                elif kind == OP_RELEASE_ALL:
+                    keyboard.release_all()
+            keyboard.send()
+        decode_ns += perf_counter_ns() - started
+        reports.append(tuple(report for _, report in device.reports))
+        device.reports.clear()
+    return Run(reports, decode_ns)
+
+
+def compare(timeline, candidate, nkro=False):
+    """Run a timeline everywhere.
+
+    Returns the Runs of the reference, code.py and the candidate, and the
+    first (scan, name) where code.py or the candidate parts from the
+    reference, or None.
+    """
+    firmware_run, firmware, masks = run_firmware(timeline, nkro)
+    reference = run_reference(firmware, masks)
+    result = run_candidate(candidate, firmware, masks)
+    for scan, expected in enumerate(reference.reports):
+        for name, run in (("code.py", firmware_run), ("candidate", result)):
+            if run.reports[scan] != expected:
+                return (reference, firmware_run, result), (scan, name)
+    return (reference, firmware_run, result), None
+
+
+def normalise(timeline):
+    """Merge steps holding the same keys, and drop empty ones."""
+    merged = []
+    for keys, count in timeline:
+        if count <= 0:
+            continue
+        if merged and merged[-1][0] == keys:
+            merged[-1] = (keys, merged[-1][1] + count)
+        else:
+            merged.append((keys, count))
+    return merged
+
+
+def shrinks(timeline):
+    """Smaller timelines to try, biggest cuts first. The last step stays."""
+    body, last = timeline[:-1], timeline[-1:]
+    for size in (len(body) // 2, len(body) // 4, 1):
+        if size < 1:
+            continue
+        for start in range(0, len(body), size):
+            yield body[:start] + body[start + size:] + last
+    for i, (keys, count) in enumerate(body):
+        for idx in sorted(keys):
+            yield body[:i] + [(keys - {idx}, count)] + body[i + 1:] + last
+        for shorter in {1, count // 2, count - 1}:
+            if 0 < shorter < count:
+                yield body[:i] + [(keys, shorter)] + body[i + 1:] + last
+
+
+def minimise(timeline, candidate, nkro=False):
+    """Shrink a failing timeline as far as it keeps failing."""
+    timeline = normalise(timeline)
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for smaller in shrinks(timeline):
+            smaller = normalise(smaller)
+            if smaller != timeline and compare(smaller, candidate, nkro)[1] is not None:
+                timeline = smaller
+                shrunk = True
+                break
+    return timeline
+
+
+def describe_keys(keys):
+    return " + ".join(SPECTRUM_KEY_NAMES[idx] for idx in sorted(keys)) or "(none)"
+
+
+def describe_reports(reports):
+    from keycode_names import keycode_name
+
+    if not reports:
+        return "nothing"
+    return ", ".join("[" + " ".join(keycode_name(keycode) for keycode in sorted(report_keys(report)))
+                     + "]" for report in reports)
+
+
+def print_failure(timeline, candidate, nkro):
+    (reference, firmware_run, result), (scan, name) = compare(timeline, candidate, nkro)
+    print(f"  minimised to {len(timeline)} steps:")
+    for keys, count in timeline:
+        print(f"    {count:3} scans  {describe_keys(keys)}")
+    print(f"  scan {scan}: reference sent {describe_reports(reference.reports[scan])}")
+    for label, run in (("code.py", firmware_run), ("candidate", result)):
+        print(f"  {' ' * len(str(scan))}  {label:>14} sent {describe_reports(run.reports[scan])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="random timelines to run")
+    parser.add_argument("--steps", type=int, default=30, help="steps per timeline")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--candidate", default="keyboard_engine:KeyboardEngine",
+                        help="the decoder to check, as module:Class")
+    parser.add_argument("--nkro", action="store_true",
+                        help="N-key rollover, as with NKRO on in boot.py")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    sim.install()
+    candidate = load_candidate(args.candidate)
+    rng = random.Random(args.seed)
+    scans = reference_ns = candidate_ns = 0
+    failures = []
+    for n in range(args.count):
+        timeline = random_timeline(rng, args.steps)
+        (reference, _, result), difference = compare(timeline, candidate, args.nkro)
+        scans += len(reference.reports)
+        reference_ns += reference.decode_ns
+        candidate_ns += result.decode_ns
+        if difference is not None:
+            failures.append(n)
+            if len(failures) == 1:
+                scan, name = difference
+                print(f"timeline {n}: {name} differs from the reference at scan {scan}")
+                print_failure(minimise(timeline, candidate, args.nkro), candidate, args.nkro)
+
+    from bench.latency import git_revision
+
+    results = {
+        "revision": git_revision(),
+        "candidate": args.candidate,
+        "seed": args.seed,
+        "timelines": args.count,
+        "scans": scans,
+        "failures": failures,
+        "reference_scans_per_second": scans * 1_000_000_000 / reference_ns if reference_ns else 0,
+        "candidate_scans_per_second": scans * 1_000_000_000 / candidate_ns if candidate_ns else 0,
+    }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        reference_rate = results["reference_scans_per_second"]
+        candidate_rate = results["candidate_scans_per_second"]
+        print(f"{args.count} timelines, {scans} scans, "
+              f"{'all the same' if not failures else f'{len(failures)} differ'}")
+        print(f"decoding: reference {reference_rate:.0f} scans/s, {args.candidate} "
+              f"{candidate_rate:.0f} scans/s ({candidate_rate / reference_rate:.2f}x)")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
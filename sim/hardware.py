@@ -0,0 +1,13 @@
+"""Simulated hardware shared by all the stub modules."""
+
+from sim.clock import VirtualClock
+from sim.membrane import Membrane
+
+clock = VirtualClock()
+membrane = Membrane(clock)
+
+
+def reset():
+    """Put the clock and the membrane back to power-on state."""
+    clock.reset()
+    membrane.reset()
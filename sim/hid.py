@@ -0,0 +1,45 @@
+"""Turn recorded HID reports back into key down/up events."""
+
+MODIFIER_BASE = 0xE0
+
+
+def report_keys(report):
+    """The set of keycodes held in a keyboard report.
+
+    Takes the 8-byte boot report, or the NKRO report from hid_output: the
+    boot report followed by one bit per keycode.
+    """
+    keys = {keycode for keycode in report[2:8] if keycode}
+    modifiers = report[0]
+    for bit in range(8):
+        if modifiers & (1 << bit):
+            keys.add(MODIFIER_BASE + bit)
+    for i, byte in enumerate(report[8:]):
+        for bit in range(8):
+            if byte & (1 << bit):
+                keys.add(i * 8 + bit)
+    return keys
+
+
+def key_events(reports):
+    """Diff successive reports into (time_ns, keycode, pressed) events."""
+    events = []
+    held = set()
+    for at_ns, report in reports:
+        keys = report_keys(report)
+        for keycode in sorted(keys - held):
+            events.append((at_ns, keycode, True))
+        for keycode in sorted(held - keys):
+            events.append((at_ns, keycode, False))
+        held = keys
+    return events
+
+
+def distinct_states(reports):
+    """The sequence of key sets the host saw, without repeats."""
+    states = []
+    for _, report in reports:
+        keys = frozenset(report_keys(report))
+        if not states or states[-1] != keys:
+            states.append(keys)
+    return states
@@ -0,0 +1,131 @@
+"""Check that the compiled keymap behaves exactly like lookup_tables.py.
+
+Compiles the tables with tools/compile_keymap.py and reads the result back
+with keymap.parse_keymap(). It compares every keycode, combo action and
+swap mask. Then it types every single key and every ordered pair of keys
+through code.py, once with the keymap built from the tables and once with
+the compiled one, and compares the HID reports sent. Exits non-zero on
+any difference.
+
+    python -m sim.keymap_check
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import sim
+from sim import hardware
+
+# Scans per step of a key sequence, enough for the debouncer to settle
+SCANS_PER_STEP = 6
+
+
+def use_keymap(firmware, keymap):
+    """Point code.py at keymap, as if it had loaded it at boot."""
+    firmware.keymap = keymap
+    firmware.pc_mode = keymap.modes[0]
+    firmware.spectrum_mode = keymap.modes[1]
+    firmware.engine = firmware.KeyboardEngine(keymap, diag=firmware.diag)
+
+
+def sequences(key_count):
+    """Tap each key, then press each ordered pair and let go in reverse."""
+    for idx in range(key_count):
+        yield (idx,), ((idx,), ())
+    for first in range(key_count):
+        for second in range(key_count):
+            if first != second:
+                yield (first, second), ((first,), (first, second), (first,), ())
+
+
+def type_all(keymap, mode):
+    """HID reports sent for every sequence, with keymap and the given mode."""
+    firmware = sim.load_firmware()
+    firmware.LOG_KEYS = False
+    use_keymap(firmware, keymap)
+    firmware.engine.current_mode = keymap.modes[mode]
+    device = firmware.keyboard.device
+
+    sent = {}
+    for keys, steps in sequences(firmware.matrix.key_count):
+        device.clear()
+        for pressed in steps:
+            hardware.membrane.set_pressed(pressed)
+            for _ in range(SCANS_PER_STEP):
+                firmware.scan_once()
+                firmware.wait_for_next_scan()
+        sent[keys] = [report for _, report in device.reports]
+    return sent
+
+
+def compare_tables(tables, keymap):
+    """Differences between lookup_tables and a parsed keymap, as strings."""
+    problems = []
+    for mode, table in enumerate((tables.pc_mode, tables.spectrum_mode)):
+        for idx, keycode in enumerate(table):
+            if keymap.modes[mode][idx] != keycode:
+                problems.append(f"mode {mode} key {idx}: {keymap.modes[mode][idx]} != {keycode}")
+    for pos, action in enumerate(tables.COMBO_ACTIONS):
+        if keymap.combo_actions[pos] != action:
+            problems.append(f"combo action {pos}: {keymap.combo_actions[pos]} != {action}")
+    if keymap.caps_swap_mask != tables.CAPS_SWAP_MASK:
+        problems.append("CAPS SHIFT swap mask differs")
+    if keymap.symbol_swap_mask != tables.SYMBOL_SWAP_MASK:
+        problems.append("SYMBOL SHIFT swap mask differs")
+    return problems
+
+
+def heap_cost(load):
+    """Bytes still allocated after load() (modules it imports included)."""
+    for name in ("lookup_tables", "keymap"):
+        sys.modules.pop(name, None)
+    tracemalloc.start()
+    keymap = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keymap
+    return size
+
+
+def main():
+    from tools.compile_keymap import compile_keymap, load_tables
+
+    tables = load_tables()
+    data = compile_keymap(tables)
+    import keymap as keymap_module
+    compiled = keymap_module.parse_keymap(data)
+    from_tables = keymap_module.keymap_from_tables()
+
+    failed = False
+    problems = compare_tables(tables, compiled)
+    for problem in problems:
+        print(problem)
+    failed |= bool(problems)
+    print(f"tables: {len(data)} bytes compiled, "
+          f"{'ok' if not problems else f'{len(problems)} differences'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "keymap.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+        from_file = heap_cost(lambda: __import__("keymap").load_keymap(path))
+        built = heap_cost(lambda: __import__("keymap").keymap_from_tables())
+    print(f"heap after loading (CPython): {from_file} B from keymap.bin, {built} B from the tables")
+
+    for mode, name in ((0, "pc"), (1, "spectrum")):
+        expected = type_all(from_tables, mode)
+        actual = type_all(compiled, mode)
+        diffs = [keys for keys in expected if expected[keys] != actual[keys]]
+        for keys in diffs[:10]:
+            print(f"{name} keys {keys}: {expected[keys]} != {actual[keys]}")
+        failed |= bool(diffs)
+        singles = sum(1 for keys in expected if len(keys) == 1)
+        print(f"{name:8} mode: {singles} single keys, {len(expected) - singles} pairs, "
+              f"{'ok' if not diffs else f'{len(diffs)} differ'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import bisect
+import random
+
+
+class Membrane:
+    """The Spectrum+ keyboard membrane: 8 row lines, 5 column lines, no diodes.
+
+    Lines are identified by GPIO number, wired as on the real board (rows
+    on GP2-GP9, columns on GP10-GP14). Key n sits on row n // 5, column
+    n % 5, matching the firmware's matrix indices.
+
+    The model covers the things that make the real membrane awkward:
+
+    * bounce_ns - after a key changes, its contact chatters open/closed
+      at random for this long before settling
+    * settle_ns - a line driven low only pulls the lines connected to it
+      low once it has been driven this long, and keeps pulling them low
+      for this long after it is released; line_settle_ns overrides it for
+      particular lines (a column with a longer trace, say)
+    * glitch - chance that any one read of a line returns the wrong level,
+      as electrical noise would
+    * ghosting - with no diodes, current flows through any chain of closed
+      contacts, so three corners of a rectangle make the fourth read low
+    """
+
+    def __init__(self, clock, row_gpios=range(2, 10), col_gpios=range(10, 15),
+                 bounce_ns=0, settle_ns=0, ghosting=True, seed=0):
+        self.line_settle_ns = {}
+        self.glitch = 0.0
+        self.clock = clock
+        self.row_of = {gpio: r for r, gpio in enumerate(row_gpios)}
+        self.col_of = {gpio: c for c, gpio in enumerate(col_gpios)}
+        self.row_gpios = tuple(row_gpios)
+        self.col_gpios = tuple(col_gpios)
+        self.row_count = len(self.row_of)
+        self.col_count = len(self.col_of)
+        self.key_count = self.row_count * self.col_count
+        self.configure(bounce_ns=bounce_ns, settle_ns=settle_ns,
+                       ghosting=ghosting, seed=seed)
+        self.reset()
+
+    def configure(self, bounce_ns=None, settle_ns=None, ghosting=None, seed=None,
+                  line_settle_ns=None, glitch=None):
+        if bounce_ns is not None:
+            self.bounce_ns = bounce_ns
+        if settle_ns is not None:
+            self.settle_ns = settle_ns
+        if line_settle_ns is not None:
+            self.line_settle_ns = dict(line_settle_ns)
+            self._version += 1
+        if glitch is not None:
+            self.glitch = glitch
+        if ghosting is not None:
+            self.ghosting = ghosting
+        if seed is not None:
+            self.rng = random.Random(seed)
+
+    def reset(self):
+        # Per key: sorted contact transition times and the state after each
+        self.edge_times = [[] for _ in range(self.key_count)]
+        self.edge_states = [[] for _ in range(self.key_count)]
+        self.driven_since = {}     # gpio -> time it was driven low
+        self.released_at = {}      # gpio -> time it stopped being driven low
+        self._version = 0          # Bumped on every change, for the cache
+        self._cached = (None, None, set())
+
+    # Keys
+
+    def schedule(self, idx, at_ns, pressed):
+        """Make key idx change state at at_ns, bouncing if configured."""
+        self._add_edge(idx, at_ns, pressed)
+        if not self.bounce_ns:
+            return
+        end = at_ns + self.bounce_ns
+        t = at_ns
+        state = pressed
+        while True:
+            t += self.rng.randint(self.bounce_ns // 20 + 1, self.bounce_ns // 4 + 1)
+            if t >= end:
+                break
+            state = not state
+            self._add_edge(idx, t, state)
+        if state != pressed:
+            self._add_edge(idx, end, pressed)
+
+    def _add_edge(self, idx, at_ns, pressed):
+        times = self.edge_times[idx]
+        pos = bisect.bisect_right(times, at_ns)
+        times.insert(pos, at_ns)
+        self.edge_states[idx].insert(pos, pressed)
+        self._version += 1
+
+    def press(self, idx):
+        self.schedule(idx, self.clock.monotonic_ns(), True)
+
+    def release(self, idx):
+        self.schedule(idx, self.clock.monotonic_ns(), False)
+
+    def set_pressed(self, indices):
+        """Change the pressed set right now, with no bounce.
+
+        Anything scheduled is dropped, so repeated calls don't build up
+        contact history.
+        """
+        for idx in range(self.key_count):
+            self.edge_times[idx].clear()
+            self.edge_states[idx].clear()
+        for idx in indices:
+            self._add_edge(idx, self.clock.monotonic_ns(), True)
+        self._version += 1
+
+    def contact(self, idx, now_ns):
+        """Whether key idx's contact is closed at now_ns."""
+        times = self.edge_times[idx]
+        pos = bisect.bisect_right(times, now_ns)
+        if not pos:
+            return False
+        return self.edge_states[idx][pos - 1]
+
+    def closed_keys(self, now_ns):
+        return [idx for idx in range(self.key_count) if self.contact(idx, now_ns)]
+
+    # Lines, as seen by the digitalio stand-in
+
+    def drive(self, gpio, value):
+        """A pin configured as an output was set to value."""
+        if value:
+            self.float(gpio)
+        elif gpio not in self.driven_since:
+            self.driven_since[gpio] = self.clock.monotonic_ns()
+            self.released_at.pop(gpio, None)
+            self._version += 1
+
+    def float(self, gpio):
+        """A pin went back to being an input."""
+        if gpio in self.driven_since:
+            del self.driven_since[gpio]
+            self.released_at[gpio] = self.clock.monotonic_ns()
+            self._version += 1
+
+    def low_lines(self, now_ns):
+        """All lines currently pulled low, following closed contacts."""
+        cached_at, cached_version, low = self._cached
+        if cached_at == now_ns and cached_version == self._version:
+            return low
+        low = self._trace(now_ns)
+        self._cached = (now_ns, self._version, low)
+        return low
+
+    def _trace(self, now_ns):
+        settle = self.line_settle_ns
+        sources = [gpio for gpio, since in self.driven_since.items()
+                   if now_ns - since >= settle.get(gpio, self.settle_ns)]
+        sources += [gpio for gpio, at in self.released_at.items()
+                    if now_ns - at < settle.get(gpio, self.settle_ns)]
+        if not sources:
+            return set()
+        return self.reachable(sources, now_ns)
+
+    def reachable(self, sources, now_ns):
+        """Lines pulled low at now_ns by the (settled) lines in sources."""
+        # Closed contacts as row <-> column links
+        links = {}
+        for idx in self.closed_keys(now_ns):
+            row_gpio = self.row_gpios[idx // self.col_count]
+            col_gpio = self.col_gpios[idx % self.col_count]
+            links.setdefault(row_gpio, []).append(col_gpio)
+            links.setdefault(col_gpio, []).append(row_gpio)
+
+        low = set(sources)
+        frontier = list(sources)
+        while frontier:
+            gpio = frontier.pop()
+            for other in links.get(gpio, ()):
+                if other not in low:
+                    low.add(other)
+                    # Without ghosting only direct neighbours of a source count
+                    if self.ghosting:
+                        frontier.append(other)
+        return low
+
+    def read(self, gpio):
+        """Level of an input line with its pull-up enabled."""
+        level = gpio not in self.low_lines(self.clock.monotonic_ns())
+        if self.glitch and self.rng.random() < self.glitch:
+            return not level
+        return level
@@ -0,0 +1,244 @@
+"""The original code.py decoding, kept as it was, as sim.equivalence's oracle.
+
+The main loop body of code.py from before any of the speed work, from
+the merged scan on: key names from get_spectrum_key_name(), special keys
+through SPECIAL_KEY_HID_MAP and modifier swaps through SWAP_MODIFIERS,
+all looked up by name and tuple in lookup_tables.py every time. Nothing
+here uses keymap.py or the compiled tables (COMBO_ACTIONS, the swap
+masks), so a mistake in compiling them, or in the engine, shows up as a
+difference.
+
+The loop's globals are attributes, its prints are left out, and it takes
+a debounced 40-bit mask in place of the list matrix.scan() returned.
+Layers, keywords and the profiler came later and aren't here. Leave it
+as it is: a change to what the keyboard sends belongs in
+keyboard_engine.py, and sim.equivalence will then show where the two
+part.
+"""
+
+from lookup_tables import (
+    pc_mode,
+    spectrum_mode,
+    SPECTRUM_KEY_NAMES,
+    CAPS_SHIFT_COMBOS,
+    SYMBOL_SHIFT_COMBOS,
+    SPECIAL_KEY_HID_MAP,
+    SWAP_MODIFIERS
+)
+
+KEY_COUNT = 40
+
+
+def get_spectrum_key_name(pressed_indices):
+    """Get the Spectrum key name for a combination of pressed keys."""
+    if len(pressed_indices) == 0:
+        return None
+
+    if len(pressed_indices) == 1:
+        idx = pressed_indices[0]
+        if idx < len(SPECTRUM_KEY_NAMES):
+            return SPECTRUM_KEY_NAMES[idx]
+        return None
+
+    # Check for CAPS SHIFT combinations
+    caps_shift_idx = 25  # CAPS SHIFT is at index 25
+    if caps_shift_idx in pressed_indices:
+        for other_idx in pressed_indices:
+            if other_idx != caps_shift_idx:
+                # Dictionary keys are (25, other_idx) format
+                combo_key = (caps_shift_idx, other_idx)
+                if combo_key in CAPS_SHIFT_COMBOS:
+                    return CAPS_SHIFT_COMBOS[combo_key]
+                # If not in combo map, show as CAPS SHIFT + key
+                other_name = SPECTRUM_KEY_NAMES[other_idx] if other_idx < len(SPECTRUM_KEY_NAMES) else f"KEY_{other_idx}"
+                return f"CAPS SHIFT + {other_name}"
+
+    # Check for SYMBOL SHIFT combinations
+    symbol_shift_idx = 36  # SYMBOL SHIFT is at index 36
+    if symbol_shift_idx in pressed_indices:
+        for other_idx in pressed_indices:
+            if other_idx != symbol_shift_idx:
+                # Dictionary keys are (36, other_idx) format
+                combo_key = (symbol_shift_idx, other_idx)
+                if combo_key in SYMBOL_SHIFT_COMBOS:
+                    return SYMBOL_SHIFT_COMBOS[combo_key]
+                # If not in combo map, show as SYMBOL SHIFT + key
+                other_name = SPECTRUM_KEY_NAMES[other_idx] if other_idx < len(SPECTRUM_KEY_NAMES) else f"KEY_{other_idx}"
+                return f"SYMBOL SHIFT + {other_name}"
+
+    # Multiple keys pressed but no known combination
+    names = []
+    for idx in sorted(pressed_indices):
+        if idx < len(SPECTRUM_KEY_NAMES):
+            names.append(SPECTRUM_KEY_NAMES[idx])
+        else:
+            names.append(f"KEY_{idx}")
+    return " + ".join(names)
+
+
+class ReferenceDecoder:
+    """The original loop's decoding, pressing and releasing on keyboard.
+
+    keyboard is a hid_output report; send() is called after every scan
+    that changed something, the one report the loop's presses and releases
+    add up to. layer 1 starts in spectrum_mode instead of pc_mode.
+    """
+
+    def __init__(self, keyboard, layer=0):
+        self.keyboard = keyboard
+        self.current_mode = (pc_mode, spectrum_mode)[layer]
+        self.prev = [0] * KEY_COUNT
+        self.sent_keycodes = {}  # Track which keycodes we've sent (by matrix index) to allow releasing if needed
+
+    def scan(self, mask):
+        """Send the changes from the last scan's debounced mask to this one's."""
+        pressed = [(mask >> idx) & 1 for idx in range(KEY_COUNT)]
+        if pressed != self.prev:
+            self.decode(pressed)
+            self.keyboard.send()
+        self.prev = pressed
+
+    def decode(self, pressed):
+        keyboard = self.keyboard
+        prev = self.prev
+        sent_keycodes = self.sent_keycodes
+        current_mode = self.current_mode
+
+        # Track currently pressed keys
+        currently_pressed = []
+        for idx in range(KEY_COUNT):
+            if pressed[idx]:
+                currently_pressed.append(idx)
+
+        # Detect key press events (transitions from not pressed to pressed)
+        # First, collect all newly pressed keys
+        newly_pressed = []
+        for idx in range(KEY_COUNT):
+            if pressed[idx] and not prev[idx]:
+                newly_pressed.append(idx)
+
+        # Check if the newly pressed keys form a special key combination
+        # Do this BEFORE sending individual keys to avoid sending modifiers
+        if newly_pressed:
+            combo_indices = currently_pressed[:]
+            spectrum_name = get_spectrum_key_name(combo_indices)
+
+            # Check if this is a special key that has a direct HID mapping
+            if spectrum_name and spectrum_name in SPECIAL_KEY_HID_MAP:
+                special_keycode = SPECIAL_KEY_HID_MAP[spectrum_name]
+                if special_keycode is not None:
+                    # Release any modifiers that were already sent (they're part of this special key)
+                    caps_shift_idx = 25
+                    symbol_shift_idx = 36
+                    if caps_shift_idx in sent_keycodes:
+                        keyboard.release(sent_keycodes[caps_shift_idx])
+                        del sent_keycodes[caps_shift_idx]
+                    if symbol_shift_idx in sent_keycodes:
+                        keyboard.release(sent_keycodes[symbol_shift_idx])
+                        del sent_keycodes[symbol_shift_idx]
+                    # Also release the other key if it was already sent
+                    for idx in combo_indices:
+                        if idx != caps_shift_idx and idx != symbol_shift_idx and idx in sent_keycodes:
+                            keyboard.release(sent_keycodes[idx])
+                            del sent_keycodes[idx]
+
+                    # Send the special HID keycode directly - don't send modifiers
+                    keyboard.press(special_keycode)
+                    # Skip sending individual keys for this iteration
+                    newly_pressed = []
+
+        # Now send individual keys (if not part of a special key combo)
+        for idx in newly_pressed:
+            # Normal keycode handling with modifier swapping
+            keycode = current_mode[idx]
+            caps_shift_idx = 25
+            symbol_shift_idx = 36
+
+            # Check if we have a modifier combination that needs swapping
+            if idx == caps_shift_idx:
+                # CAPS SHIFT pressed - check if combo needs swap
+                for other_idx in currently_pressed:
+                    if other_idx != idx:
+                        combo_key = (idx, other_idx)
+                        if combo_key in SWAP_MODIFIERS:
+                            # Swap: send SYMBOL SHIFT keycode instead
+                            keycode = current_mode[symbol_shift_idx]
+                            break
+            elif idx == symbol_shift_idx:
+                # SYMBOL SHIFT pressed - check if combo needs swap
+                for other_idx in currently_pressed:
+                    if other_idx != idx:
+                        combo_key = (idx, other_idx)
+                        if combo_key in SWAP_MODIFIERS:
+                            # Swap: send CAPS SHIFT keycode instead
+                            keycode = current_mode[caps_shift_idx]
+                            break
+            else:
+                # Regular key pressed - check if modifier combo needs swap
+                if caps_shift_idx in currently_pressed:
+                    combo_key = (caps_shift_idx, idx)
+                    if combo_key in SWAP_MODIFIERS:
+                        # Send SYMBOL SHIFT keycode instead of CAPS SHIFT
+                        keyboard.press(current_mode[symbol_shift_idx])
+                        keycode = current_mode[idx]
+                elif symbol_shift_idx in currently_pressed:
+                    combo_key = (symbol_shift_idx, idx)
+                    if combo_key in SWAP_MODIFIERS:
+                        # Send CAPS SHIFT keycode instead of SYMBOL SHIFT
+                        keyboard.press(current_mode[caps_shift_idx])
+                        keycode = current_mode[idx]
+
+            keyboard.press(keycode)
+            # Track that we sent this keycode
+            sent_keycodes[idx] = keycode
+
+        # Handle key releases - need to check for special keys and swapped modifiers
+        for idx in range(KEY_COUNT):
+            if prev[idx] and not pressed[idx]:
+                # Check if this was a special key combination
+                prev_pressed = []
+                for i in range(KEY_COUNT):
+                    if prev[i]:
+                        prev_pressed.append(i)
+
+                prev_spectrum_name = get_spectrum_key_name(prev_pressed)
+                if prev_spectrum_name and prev_spectrum_name in SPECIAL_KEY_HID_MAP:
+                    special_keycode = SPECIAL_KEY_HID_MAP[prev_spectrum_name]
+                    if special_keycode is not None:
+                        # Release the special HID keycode
+                        keyboard.release(special_keycode)
+                        continue  # Skip normal keycode handling
+
+                # Normal keycode release handling with modifier swapping
+                keycode = current_mode[idx]
+                caps_shift_idx = 25
+                symbol_shift_idx = 36
+
+                # Check if this was part of a swapped modifier combination
+                if idx == caps_shift_idx:
+                    # Check if we need to release swapped modifier
+                    for other_idx in range(KEY_COUNT):
+                        if prev[other_idx] and other_idx != idx:
+                            combo_key = (idx, other_idx)
+                            if combo_key in SWAP_MODIFIERS:
+                                keyboard.release(current_mode[symbol_shift_idx])
+                                keycode = None  # Don't release the original
+                                break
+                elif idx == symbol_shift_idx:
+                    # Check if we need to release swapped modifier
+                    for other_idx in range(KEY_COUNT):
+                        if prev[other_idx] and other_idx != idx:
+                            combo_key = (idx, other_idx)
+                            if combo_key in SWAP_MODIFIERS:
+                                keyboard.release(current_mode[caps_shift_idx])
+                                keycode = None  # Don't release the original
+                                break
+
+                if keycode is not None:
+                    keyboard.release(keycode)
+                    # Remove from tracking
+                    if idx in sent_keycodes:
+                        del sent_keycodes[idx]
+                # Reset reported key when all keys are released
+                if len([i for i in range(KEY_COUNT) if pressed[i]]) == 0:
+                    sent_keycodes.clear()
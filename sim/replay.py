@@ -0,0 +1,172 @@
+"""Replay raw matrix scans recorded with CAPTURE through code.py.
+
+A capture (see scan_capture.py) holds every raw mask the matrix read, so
+feeding it back through the ghost filter, the debouncer and code.py's
+decoding gives the same HID reports the keyboard sent. The scans run back
+to back, as fast as the host goes, with the simulated clock set to each
+scan's recorded time.
+
+    python -m sim.replay trace.scan [--log] [--nkro]
+
+--capture records a trace on the simulator instead, from a timeline
+script through the simulated membrane:
+
+    python -m sim.replay --capture sim/examples/typing.txt trace.scan
+"""
+
+import argparse
+import io
+import time
+
+import sim
+from sim import hardware, runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+
+def read_trace(data):
+    """The records of a capture, as (time_ns, mask, scans), times from 0."""
+    sim.install()
+    from scan_capture import MAGIC, RECORD_SIZE
+    from supervisor import TICKS_PERIOD
+
+    if not data.startswith(MAGIC):
+        raise ValueError("not a scan capture")
+    records = []
+    previous = None
+    elapsed = 0
+    for offset in range(len(MAGIC), len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        ticks = int.from_bytes(data[offset:offset + 4], "little")
+        mask = int.from_bytes(data[offset + 4:offset + 9], "little")
+        scans = data[offset + 9]
+        if previous is not None:
+            # ticks_ms() wraps around
+            elapsed += (ticks - previous) % TICKS_PERIOD
+        previous = ticks
+        records.append((elapsed * 1_000_000, mask, scans))
+    return records
+
+
+def scan_times(records, period_ns):
+    """Yield (time_ns, mask) for every scan, spreading each run's scans evenly.
+
+    The last run's scans are period_ns apart.
+    """
+    for i, (time_ns, mask, scans) in enumerate(records):
+        if i + 1 < len(records):
+            spacing = (records[i + 1][0] - time_ns) / scans
+        else:
+            spacing = period_ns
+        for scan in range(scans):
+            yield time_ns + int(scan * spacing), mask
+
+
+def capture(timeline, firmware=None, **options):
+    """Run a timeline through the simulator, recording its scans. Returns the capture."""
+    if firmware is None:
+        firmware = sim.load_firmware()
+    stream = io.BytesIO()
+    firmware.start_capture(stream)
+    result = runner.run(timeline, firmware=firmware, **options)
+    firmware.recorder.close()
+    return stream.getvalue(), result
+
+
+def feed(firmware, scans, after_scan=None):
+    """Run code.py's scan_once() for each (time_ns, mask) of raw scans.
+
+    The matrix reads each mask in turn, at the simulated time given (from
+    the clock's time now), back to back. after_scan, if given, is called
+    after every scan. Returns the host nanoseconds it took.
+    """
+    matrix = firmware.matrix
+    col_count = matrix.col_count
+    col_rows = matrix.col_rows
+
+    # What read_mask() fills in for the ghost filter, worked out up front
+    rows_of = {}
+    for _, mask in scans:
+        if mask not in rows_of:
+            rows = bytearray(col_count)
+            for idx in range(matrix.key_count):
+                if mask >> idx & 1:
+                    rows[idx % col_count] |= 1 << idx // col_count
+            rows_of[mask] = bytes(rows)
+
+    current = [0]
+
+    def read_mask():
+        mask = current[0]
+        col_rows[:] = rows_of[mask]
+        return mask
+
+    matrix.read_mask = read_mask
+    clock = hardware.clock
+    scan_once = firmware.scan_once
+    start_ns = clock.monotonic_ns()
+    host_start = time.perf_counter_ns()
+    for time_ns, mask in scans:
+        clock.now_ns = start_ns + time_ns
+        current[0] = mask
+        scan_once()
+        if after_scan is not None:
+            after_scan()
+    return time.perf_counter_ns() - host_start
+
+
+def replay(data, firmware=None, log_keys=False, nkro=False):
+    """Feed a capture through code.py, returning a runner.RunResult.
+
+    Only code.py's plain loop is run, without its waits between scans.
+    """
+    if firmware is None:
+        firmware = sim.load_firmware(nkro=nkro)
+    runner.use_key_log(firmware, log_keys)
+    matrix = firmware.matrix
+    device = firmware.keyboard.device
+    device.clear()
+    scans = list(scan_times(read_trace(data), firmware.SCAN_PERIOD_MS * 1_000_000))
+
+    after_scan = None
+    if log_keys:
+        def after_scan():
+            if not (firmware.engine.held_mask or matrix.mask):
+                firmware.write_idle()
+
+    host_ns = feed(firmware, scans, after_scan)
+    return runner.RunResult(firmware, list(device.reports), len(scans), host_ns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="capture file to replay, or to write with --capture")
+    parser.add_argument("--capture", metavar="TIMELINE",
+                        help="record the scans of this timeline script to trace")
+    parser.add_argument("--log", action="store_true", help="show the firmware key log")
+    parser.add_argument("--nkro", action="store_true",
+                        help="N-key rollover, as with NKRO on in boot.py")
+    args = parser.parse_args(argv)
+
+    if args.capture:
+        with open(args.capture) as f:
+            timeline = Timeline.parse(f.read())
+        data, result = capture(timeline, sim.load_firmware(nkro=args.nkro))
+        with open(args.trace, "wb") as f:
+            f.write(data)
+        print(f"{result.scans} scans, {len(read_trace(data))} records, {len(data)} bytes")
+        return
+
+    with open(args.trace, "rb") as f:
+        data = f.read()
+    result = replay(data, log_keys=args.log, nkro=args.nkro)
+
+    from keycode_names import keycode_name
+    for at_ns, keycode, pressed in key_events(result.reports):
+        print(f"{at_ns / 1_000_000:10.3f} ms  {'down' if pressed else 'up  '}  "
+              f"{keycode_name(keycode)}")
+    print(f"{result.scans} scans, {len(result.reports)} reports, "
+          f"{result.host_scans_per_second:.0f} scans/s on this host")
+
+
+if __name__ == "__main__":
+    main()
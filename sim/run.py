@@ -0,0 +1,50 @@
+"""Run a keystroke timeline file through the firmware and print the HID output.
+
+    python -m sim.run sim/examples/typing.txt [--bounce-ms 5] [--settle-us 300]
+                      [--no-ghosting] [--log] [--background] [--nkro]
+"""
+
+import argparse
+
+import sim
+from sim import runner
+from sim.hid import key_events
+from sim.timeline import Timeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("timeline", help="timeline script")
+    parser.add_argument("--bounce-ms", type=float, default=runner.BOUNCE_MS)
+    parser.add_argument("--settle-us", type=float, default=runner.SETTLE_US)
+    parser.add_argument("--no-ghosting", action="store_true")
+    parser.add_argument("--cpu-scale", type=float, default=0,
+                        help="add host CPU time x this to simulated time")
+    parser.add_argument("--seed", type=int, default=0, help="bounce pattern seed")
+    parser.add_argument("--log", action="store_true", help="show the firmware key log")
+    parser.add_argument("--background", action="store_true",
+                        help="scan with keypad.KeyMatrix (needs --settle-us 1)")
+    parser.add_argument("--nkro", action="store_true",
+                        help="N-key rollover, as with NKRO on in boot.py")
+    args = parser.parse_args(argv)
+
+    with open(args.timeline) as f:
+        timeline = Timeline.parse(f.read())
+
+    result = runner.run(timeline, bounce_ms=args.bounce_ms, settle_us=args.settle_us,
+                        ghosting=not args.no_ghosting, cpu_scale=args.cpu_scale,
+                        seed=args.seed, log_keys=args.log, background=args.background,
+                        nkro=args.nkro)
+
+    sim.install()
+    from keycode_names import keycode_name
+    for at_ns, keycode, pressed in key_events(result.reports):
+        print(f"{at_ns / 1_000_000:10.3f} ms  {'down' if pressed else 'up  '}  "
+              f"{keycode_name(keycode)}")
+    print(f"{result.scans} scans, {len(result.reports)} reports, "
+          f"{result.sim_scans_per_second:.0f} scans/s simulated, "
+          f"{result.host_scans_per_second:.0f} scans/s on this host")
+
+
+if __name__ == "__main__":
+    main()
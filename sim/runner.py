@@ -0,0 +1,138 @@
+"""Drive the real firmware through a keystroke timeline on the simulator."""
+
+import sys
+import time
+
+import sim
+from sim import aio, hardware
+
+# Realistic membrane defaults, see sim.membrane.Membrane
+BOUNCE_MS = 5
+SETTLE_US = 300
+TAIL_MS = 100
+
+
+class RunResult:
+    def __init__(self, firmware, reports, scans, host_ns):
+        self.firmware = firmware
+        self.reports = reports      # (time_ns, report bytes) as sent
+        self.scans = scans
+        self.host_ns = host_ns
+        self.sim_ns = hardware.clock.now_ns
+
+    @property
+    def host_scans_per_second(self):
+        return self.scans * 1_000_000_000 / self.host_ns if self.host_ns else 0
+
+    @property
+    def sim_scans_per_second(self):
+        return self.scans * 1_000_000_000 / self.sim_ns if self.sim_ns else 0
+
+
+def use_background_scan(firmware):
+    """Swap the firmware's matrix for the keypad background scanner.
+
+    The same as setting BACKGROUND_SCAN in code.py. Remember the simulated
+    keypad only reads a membrane with settle_us of 1 or less.
+    """
+    firmware.matrix = firmware.KeypadMatrix(
+        firmware.ROW_PINS,
+        firmware.COL_PINS,
+        interval=firmware.BACKGROUND_SCAN_INTERVAL,
+        debounce_scans=firmware.DEBOUNCE_PRESS_SCANS,
+    )
+    return firmware
+
+
+def use_profiler(firmware):
+    """Time the firmware's stages, the same as setting PROFILE in code.py.
+
+    Returns the profiler.StageProfiler, which reads the simulated clock:
+    the board's sleeps, and host CPU time too with cpu_scale. Call after
+    any use_background_scan().
+    """
+    firmware.PROFILE = 1
+    firmware.start_profiler()
+    sim.use_clock(sys.modules["profiler"])
+    return firmware.profiler
+
+
+def use_key_log(firmware, log_keys=True):
+    """Log every key combination pressed, the same as LOG_LEVEL 3 in code.py.
+
+    With log_keys False nothing is logged at all, warnings included. Does
+    nothing with LOG_LEVEL 0, which leaves the log out.
+    """
+    if firmware.diag is None:
+        return
+    from diag_log import LEVEL_KEYS
+
+    firmware.LOG_KEYS = log_keys
+    firmware.diag.level = LEVEL_KEYS if log_keys else 0
+    if log_keys:
+        firmware.load_key_names()
+
+
+def run(timeline, bounce_ms=BOUNCE_MS, settle_us=SETTLE_US, ghosting=True,
+        tail_ms=TAIL_MS, cpu_scale=0, seed=0, log_keys=False, path=None,
+        firmware=None, on_scan=None, background=False, pause_every_ms=0,
+        pause_ms=0, nkro=False, tasks=False, print_ms=0, host_poll_ms=0):
+    """Run code.py's main loop until tail_ms after the last timeline step.
+
+    Pass firmware to keep using an already loaded (and configured) module;
+    otherwise code.py is loaded fresh. on_scan, if given, is called after
+    every scan with the firmware module. background scans with keypad
+    instead of from the loop. pause_ms stalls the loop that long every
+    pause_every_ms, like a GC pause or a slow print() would. nkro turns
+    on N-key rollover, as boot.py does with NKRO on.
+
+    tasks runs code.py's asyncio tasks (main()) instead of the plain loop;
+    on_scan and pause_ms can't be used with it. print_ms makes every
+    print() from code.py take that long, like a slow serial console, and
+    host_poll_ms makes the host take a report only that often.
+    """
+    if tasks and (on_scan is not None or pause_every_ms):
+        raise ValueError("on_scan and pause_every_ms only work with the plain loop")
+    if firmware is None:
+        firmware = sim.load_firmware(path, nkro=nkro)
+        if background:
+            use_background_scan(firmware)
+    use_key_log(firmware, log_keys)
+    if print_ms:
+        firmware.print = lambda *args, **kwargs: hardware.clock.sleep(print_ms / 1000)
+
+    hardware.clock.cpu_scale = cpu_scale
+    hardware.membrane.configure(bounce_ns=int(bounce_ms * 1_000_000),
+                                settle_ns=int(settle_us * 1_000),
+                                ghosting=ghosting, seed=seed)
+    device = firmware.keyboard.device
+    device.clear()
+    device.poll_interval_ns = int(host_poll_ms * 1_000_000)
+
+    start_ns = hardware.clock.monotonic_ns()
+    for at_ns, idx, pressed in timeline.sorted_events():
+        hardware.membrane.schedule(idx, start_ns + at_ns, pressed)
+    end_ns = start_ns + timeline.end_ns + int(tail_ms * 1_000_000)
+
+    pause_every_ns = int(pause_every_ms * 1_000_000)
+    next_pause_ns = start_ns + pause_every_ns
+
+    scans = 0
+    host_start = time.perf_counter_ns()
+    if tasks:
+        ticks = firmware.cadence.ticks
+        aio.run_tasks(firmware, end_ns)
+        scans = firmware.cadence.ticks - ticks
+    else:
+        while hardware.clock.monotonic_ns() < end_ns:
+            firmware.scan_once()
+            if on_scan is not None:
+                on_scan(firmware)
+            firmware.wait_for_next_scan()
+            if pause_every_ns and hardware.clock.monotonic_ns() >= next_pause_ns:
+                hardware.clock.sleep(pause_ms / 1000)
+                next_pause_ns += pause_every_ns
+            scans += 1
+    host_ns = time.perf_counter_ns() - host_start
+
+    return RunResult(firmware, list(device.reports), scans, host_ns)
@@ -0,0 +1,13 @@
+"""Stand-in for the `adafruit_hid` library, enough for the firmware."""
+
+
+def find_device(devices, *, usage_page, usage, timeout=None):
+    """Search through the provided sequence of devices to find the one with
+    the matching usage_page and usage."""
+    if hasattr(devices, "send_report"):
+        devices = [devices]
+    for device in devices:
+        if (device.usage_page == usage_page and device.usage == usage
+                and hasattr(device, "send_report")):
+            return device
+    raise ValueError("Could not find matching HID device.")
@@ -0,0 +1,15 @@
+"""Stand-in for the CircuitPython `board` module of a Raspberry Pi Pico."""
+
+
+class Pin:
+    def __init__(self, gpio):
+        self.id = gpio
+
+    def __repr__(self):
+        return f"board.GP{self.id}"
+
+
+for _gpio in range(29):
+    globals()[f"GP{_gpio}"] = Pin(_gpio)
+
+LED = GP25
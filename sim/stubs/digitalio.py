@@ -0,0 +1,69 @@
+"""Stand-in for the CircuitPython `digitalio` module, wired to sim.hardware."""
+
+from sim import hardware
+
+
+class Direction:
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+
+class Pull:
+    UP = "UP"
+    DOWN = "DOWN"
+
+
+class DriveMode:
+    PUSH_PULL = "PUSH_PULL"
+    OPEN_DRAIN = "OPEN_DRAIN"
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.gpio = pin.id
+        self._direction = Direction.INPUT
+        self._value = False
+        self.pull = None
+        self.drive_mode = DriveMode.PUSH_PULL
+
+    def deinit(self):
+        hardware.membrane.float(self.gpio)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @direction.setter
+    def direction(self, direction):
+        self._direction = direction
+        if direction == Direction.OUTPUT:
+            hardware.membrane.drive(self.gpio, self._value)
+        else:
+            hardware.membrane.float(self.gpio)
+
+    @property
+    def value(self):
+        if self._direction == Direction.OUTPUT:
+            return self._value
+        return hardware.membrane.read(self.gpio)
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self._direction == Direction.OUTPUT:
+            hardware.membrane.drive(self.gpio, value)
+
+    def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        self._value = value
+        self.drive_mode = drive_mode
+        self.direction = Direction.OUTPUT
+
+    def switch_to_input(self, pull=None):
+        self.pull = pull
+        self.direction = Direction.INPUT
@@ -0,0 +1,142 @@
+"""Stand-in for the CircuitPython `keypad` module, wired to sim.hardware.
+
+KeyMatrix scans the simulated membrane on its own, every `interval`
+seconds of simulated time, as the real one does from a background tick.
+Since the clock only moves when the firmware sleeps, the scans due so
+far are run whenever the event queue is looked at.
+
+Like the real module it drives each row low in turn and reads the
+columns about a microsecond later, so it only sees keys on a membrane
+whose settle_ns is no more than SETTLE_NS.
+"""
+
+from collections import deque
+
+from sim import hardware
+
+# How long KeyMatrix waits after driving a row before reading the columns
+SETTLE_NS = 1_000
+
+# supervisor.ticks_ms() wraps at 2**29
+TICKS_PERIOD = 1 << 29
+
+
+class Event:
+    def __init__(self, key_number=0, pressed=True):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.timestamp = 0
+
+    @property
+    def released(self):
+        return not self.pressed
+
+    def __eq__(self, other):
+        return (isinstance(other, Event) and self.key_number == other.key_number
+                and self.pressed == other.pressed)
+
+    def __hash__(self):
+        return hash((self.key_number, self.pressed))
+
+    def __repr__(self):
+        state = "pressed" if self.pressed else "released"
+        return f"<Event: key_number {self.key_number} {state}>"
+
+
+class EventQueue:
+    def __init__(self, max_events, scanner=None):
+        self.max_events = max_events
+        self.scanner = scanner
+        self.overflowed = False
+        self._queue = deque()
+
+    def _catch_up(self):
+        if self.scanner is not None:
+            self.scanner._catch_up()
+
+    def put(self, key_number, pressed, timestamp):
+        """Queue an event, as the background scan does. Host only."""
+        if len(self._queue) >= self.max_events:
+            self.overflowed = True
+            return
+        self._queue.append((key_number, pressed, timestamp))
+
+    def get(self):
+        self._catch_up()
+        if not self._queue:
+            return None
+        event = Event()
+        self.get_into(event)
+        return event
+
+    def get_into(self, event):
+        self._catch_up()
+        if not self._queue:
+            return False
+        event.key_number, event.pressed, event.timestamp = self._queue.popleft()
+        return True
+
+    def clear(self):
+        self._queue.clear()
+        self.overflowed = False
+
+    def __len__(self):
+        self._catch_up()
+        return len(self._queue)
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+class KeyMatrix:
+    def __init__(self, row_pins, column_pins, columns_to_anodes=True,
+                 interval=0.020, max_events=64, debounce_threshold=1):
+        self.row_gpios = tuple(pin.id for pin in row_pins)
+        self.col_gpios = tuple(pin.id for pin in column_pins)
+        self.columns_to_anodes = columns_to_anodes
+        self.interval_ns = int(interval * 1_000_000_000)
+        self.debounce_threshold = debounce_threshold
+        self.key_count = len(self.row_gpios) * len(self.col_gpios)
+        self.events = EventQueue(max_events, self)
+        self.scans = 0
+        self.reset()
+
+    def reset(self):
+        self.state = [False] * self.key_count
+        self.counts = [0] * self.key_count
+        self.next_scan_ns = hardware.clock.monotonic_ns()
+
+    def deinit(self):
+        self.events.scanner = None
+
+    def key_number_to_row_column(self, key_number):
+        return divmod(key_number, len(self.col_gpios))
+
+    def row_column_to_key_number(self, row, column):
+        return row * len(self.col_gpios) + column
+
+    def _catch_up(self):
+        now = hardware.clock.monotonic_ns()
+        while self.next_scan_ns <= now:
+            self._scan(self.next_scan_ns)
+            self.next_scan_ns += self.interval_ns
+
+    def _scan(self, at_ns):
+        self.scans += 1
+        membrane = hardware.membrane
+        settled = membrane.settle_ns <= SETTLE_NS
+        timestamp = (at_ns // 1_000_000) % TICKS_PERIOD
+        col_count = len(self.col_gpios)
+        for row, row_gpio in enumerate(self.row_gpios):
+            low = membrane.reachable([row_gpio], at_ns) if settled else ()
+            for col, col_gpio in enumerate(self.col_gpios):
+                key_number = row * col_count + col
+                pressed = col_gpio in low
+                if pressed == self.state[key_number]:
+                    self.counts[key_number] = 0
+                    continue
+                self.counts[key_number] += 1
+                if self.counts[key_number] >= self.debounce_threshold:
+                    self.state[key_number] = pressed
+                    self.counts[key_number] = 0
+                    self.events.put(key_number, pressed, timestamp)
@@ -0,0 +1,32 @@
+"""Stand-in for the CircuitPython `memorymap` module.
+
+Only the RP2040 SIO GPIO_IN register is simulated: reading it returns the
+level of every GPIO, taken from sim.hardware (unconnected pins read high,
+as if pulled up).
+"""
+
+from sim import hardware
+
+GPIO_IN = 0xD0000004
+GPIO_COUNT = 30
+
+
+class AddressRange:
+    def __init__(self, *, start, length):
+        if start != GPIO_IN or length != 4:
+            raise ValueError("Address range not allowed")
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        value = 0
+        for gpio in range(GPIO_COUNT):
+            if hardware.membrane.read(gpio):
+                value |= 1 << gpio
+        data = value.to_bytes(4, "little")
+        if isinstance(index, slice):
+            return data[index]
+        return data[index]
@@ -0,0 +1,7 @@
+"""Stand-in for the MicroPython `micropython` module."""
+
+
+def const(value):
+    # On the board the compiler substitutes the value, and drops code
+    # behind `if NAME:` when it's 0
+    return value
@@ -0,0 +1,18 @@
+"""Stand-in for the CircuitPython `supervisor` module, on the simulated clock."""
+
+from sim import hardware
+
+# ticks_ms() wraps at 2**29
+TICKS_PERIOD = 1 << 29
+
+
+def ticks_ms():
+    return (hardware.clock.monotonic_ns() // 1_000_000) % TICKS_PERIOD
+
+
+class _Runtime:
+    # Nothing is ever typed on the simulated serial console
+    serial_bytes_available = 0
+
+
+runtime = _Runtime()
@@ -0,0 +1,101 @@
+"""Stand-in for the CircuitPython `usb_hid` module.
+
+Every report sent is recorded on the device with the simulated time. Set
+poll_interval_ns on a device to act like a host that only takes a report
+that often: send_report() then waits, as on the board, until the host has
+taken the one before.
+"""
+
+from sim import hardware
+
+
+class Device:
+    def __init__(self, *, report_descriptor=b"", usage_page, usage,
+                 report_ids=(0,), in_report_lengths=(8,), out_report_lengths=(0,)):
+        self.report_descriptor = report_descriptor
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_ids = tuple(report_ids)
+        self.in_report_lengths = tuple(in_report_lengths)
+        self.out_report_lengths = tuple(out_report_lengths)
+        self.reports = []
+        self.recording = True
+        self.sent = 0
+        self.poll_interval_ns = 0
+        self.taken_at_ns = None
+        self.wait_ns = 0
+
+    def send_report(self, report, report_id=None):
+        if len(report) != self.in_report_lengths[0]:
+            raise ValueError(f"Buffer incorrect size. Should be {self.in_report_lengths[0]} bytes.")
+        if self.poll_interval_ns and self.taken_at_ns is not None:
+            wait_ns = self.taken_at_ns + self.poll_interval_ns - hardware.clock.monotonic_ns()
+            if wait_ns > 0:
+                hardware.clock.advance_ns(wait_ns)
+                self.wait_ns += wait_ns
+        self.taken_at_ns = hardware.clock.monotonic_ns()
+        self.sent += 1
+        if self.recording:
+            self.reports.append((hardware.clock.monotonic_ns(), bytes(report)))
+
+    def get_last_received_report(self, report_id=None):
+        return None
+
+    def clear(self):
+        self.reports.clear()
+        self.recording = True
+        self.sent = 0
+        self.taken_at_ns = None
+        self.wait_ns = 0
+
+
+Device.KEYBOARD = Device(usage_page=0x01, usage=0x06, report_ids=(1,),
+                         in_report_lengths=(8,), out_report_lengths=(1,))
+Device.MOUSE = Device(usage_page=0x01, usage=0x02, report_ids=(2,),
+                      in_report_lengths=(4,))
+Device.CONSUMER_CONTROL = Device(usage_page=0x0C, usage=0x01, report_ids=(3,),
+                                 in_report_lengths=(2,))
+
+DEFAULT_DEVICES = (Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL)
+devices = list(DEFAULT_DEVICES)
+
+# The boot device enabled by boot.py, and whether the host asked for it
+# (set host_boot_protocol to act like a BIOS)
+_boot_device = 0
+host_boot_protocol = False
+
+
+def enable(new_devices, boot_device=0):
+    global _boot_device
+    # A boot device has to be USB interface 0. The serial console and
+    # CIRCUITPY are always on here, so they come first, and CircuitPython
+    # would start in safe mode.
+    if boot_device:
+        raise ValueError("Boot device must be first (interface #0).")
+    # The devices share one report descriptor: report ID 0 (none) only
+    # works for a device on its own, and no two may share an ID
+    report_ids = [report_id for device in new_devices for report_id in device.report_ids]
+    if 0 in report_ids and len(report_ids) > 1:
+        raise ValueError("Report ID 0 can only be used by a single device")
+    if len(set(report_ids)) != len(report_ids):
+        raise ValueError("Duplicate report ID")
+    _boot_device = boot_device
+    devices[:] = new_devices
+
+
+def disable():
+    enable(())
+
+
+def get_boot_device():
+    return _boot_device if host_boot_protocol else 0
+
+
+def reset():
+    """Back to the devices CircuitPython enables without a boot.py."""
+    global host_boot_protocol
+    enable(DEFAULT_DEVICES)
+    host_boot_protocol = False
+    for device in DEFAULT_DEVICES:
+        device.clear()
+        device.poll_interval_ns = 0
@@ -0,0 +1,113 @@
+"""Scripted keystroke timelines for the simulated membrane.
+
+Keys can be given as matrix indices or Spectrum key names ("CAPS SHIFT",
+"Q", "ENTER", ...). A timeline can be built in Python:
+
+    timeline = Timeline()
+    timeline.tap(0, "H")
+    timeline.chord(100, "CAPS SHIFT", "5", hold_ms=80)
+
+or parsed from text, one step per line ("#" starts a comment). Keys in a
+chord are joined with "+", a trailing number is the hold time in ms, and
+numbers of two or more digits are matrix indices ("05" is index 5, "5"
+is the 5 key):
+
+    0    tap     H
+    100  chord   CAPS SHIFT + 5   80
+    300  press   SYMBOL SHIFT
+    320  release SYMBOL SHIFT
+"""
+
+SPECTRUM_KEY_NAMES = (
+    "1", "2", "3", "4", "5",
+    "Q", "W", "E", "R", "T",
+    "A", "S", "D", "F", "G",
+    "0", "9", "8", "7", "6",
+    "P", "O", "I", "U", "Y",
+    "CAPS SHIFT", "Z", "X", "C", "V",
+    "ENTER", "L", "K", "J", "H",
+    "SPACE", "SYMBOL SHIFT", "M", "N", "B",
+)
+
+DEFAULT_HOLD_MS = 60
+
+
+def key_index(key):
+    """Matrix index for a key given as an index or a Spectrum key name."""
+    if isinstance(key, int):
+        return key
+    return SPECTRUM_KEY_NAMES.index(key.strip().upper())
+
+
+class Timeline:
+    def __init__(self):
+        self.events = []    # (time_ns, key index, pressed)
+
+    def press(self, at_ms, *keys):
+        for key in keys:
+            self.events.append((int(at_ms * 1_000_000), key_index(key), True))
+        return self
+
+    def release(self, at_ms, *keys):
+        for key in keys:
+            self.events.append((int(at_ms * 1_000_000), key_index(key), False))
+        return self
+
+    def tap(self, at_ms, key, hold_ms=DEFAULT_HOLD_MS):
+        return self.press(at_ms, key).release(at_ms + hold_ms, key)
+
+    def chord(self, at_ms, *keys, hold_ms=DEFAULT_HOLD_MS):
+        """Press keys together, held for hold_ms."""
+        return self.press(at_ms, *keys).release(at_ms + hold_ms, *keys)
+
+    def type(self, at_ms, keys, gap_ms=120, hold_ms=DEFAULT_HOLD_MS):
+        """Tap a sequence of keys, one every gap_ms."""
+        for n, key in enumerate(keys):
+            self.tap(at_ms + n * gap_ms, key, hold_ms)
+        return self
+
+    @property
+    def end_ns(self):
+        return max((event[0] for event in self.events), default=0)
+
+    def sorted_events(self):
+        return sorted(self.events)
+
+    def apply(self, membrane):
+        """Schedule every step on a membrane."""
+        for at_ns, idx, pressed in self.sorted_events():
+            membrane.schedule(idx, at_ns, pressed)
+
+    @classmethod
+    def parse(cls, text):
+        timeline = cls()
+        for line_no, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 2)
+            if len(parts) < 3:
+                raise ValueError(f"line {line_no}: expected '<ms> <action> <keys>'")
+            at_ms, action, rest = float(parts[0]), parts[1].lower(), parts[2]
+
+            # A trailing number after the keys is the hold time
+            hold_ms = DEFAULT_HOLD_MS
+            words = rest.rsplit(None, 1)
+            if (len(words) == 2 and words[1].replace(".", "", 1).isdigit()
+                    and not words[0].endswith("+")):
+                rest, hold_ms = words[0], float(words[1])
+            keys = [key_index(int(k) if k.strip().isdigit() and len(k.strip()) > 1
+                              else k) for k in rest.split("+")]
+
+            if action == "press":
+                timeline.press(at_ms, *keys)
+            elif action == "release":
+                timeline.release(at_ms, *keys)
+            elif action == "tap":
+                for key in keys:
+                    timeline.tap(at_ms, key, hold_ms)
+            elif action == "chord":
+                timeline.chord(at_ms, *keys, hold_ms=hold_ms)
+            else:
+                raise ValueError(f"line {line_no}: unknown action {action!r}")
+        return timeline
@@ -0,0 +1,20 @@
+# supervisor.ticks_ms() wraps around at this value
+TICKS_PERIOD = 1 << 29
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+def ticks_diff(end, start):
+    """Milliseconds from ticks_ms() value start to end, negative if end is earlier.
+
+    Right as long as the two are less than half TICKS_PERIOD (about three
+    days) apart, however often ticks_ms() wrapped around in between.
+    """
+    diff = (end - start) % TICKS_PERIOD
+    if diff >= TICKS_HALF:
+        return diff - TICKS_PERIOD
+    return diff
+
+
+def ticks_add(ticks, delta):
+    """The ticks_ms() value delta milliseconds after ticks."""
+    return (ticks + delta) % TICKS_PERIOD
@@ -0,0 +1 @@
+"""Host-side tools that prepare files for CIRCUITPY."""
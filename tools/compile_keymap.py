@@ -0,0 +1,73 @@
+"""Compile lookup_tables.py into keymap.bin for the board.
+
+Runs on a PC (adafruit_hid comes from the sim stubs, which have the same
+keycodes). Copy keymap.bin to CIRCUITPY next to code.py, and recompile
+whenever lookup_tables.py changes; --check says whether it needs to be.
+
+    python -m tools.compile_keymap [-o keymap.bin] [--check]
+"""
+
+import argparse
+import os
+import sys
+
+import sim
+from sim import ROOT
+
+
+def compile_keymap(tables):
+    """Return the keymap file contents for a loaded lookup_tables module."""
+    from keymap import FORMAT_VERSION, MAGIC, MOD_STATES, mask_size
+
+    key_count = tables.KEY_COUNT
+    modes = (tables.pc_mode, tables.spectrum_mode)
+    data = bytearray(MAGIC)
+    data += bytes((FORMAT_VERSION, key_count, len(modes),
+                   tables.CAPS_SHIFT_IDX, tables.SYMBOL_SHIFT_IDX))
+    for mode in modes:
+        if len(mode) != key_count:
+            raise ValueError("a mode has %d keycodes, expected %d" % (len(mode), key_count))
+        data += bytes(mode)
+    if len(tables.COMBO_ACTIONS) != MOD_STATES * key_count:
+        raise ValueError("COMBO_ACTIONS is the wrong size")
+    data += tables.COMBO_ACTIONS
+    size = mask_size(key_count)
+    data += tables.CAPS_SWAP_MASK.to_bytes(size, "little")
+    data += tables.SYMBOL_SWAP_MASK.to_bytes(size, "little")
+    return bytes(data)
+
+
+def load_tables():
+    sim.install()
+    import lookup_tables
+    return lookup_tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", default=os.path.join(ROOT, "keymap.bin"))
+    parser.add_argument("--check", action="store_true",
+                        help="only check the output file is up to date")
+    args = parser.parse_args(argv)
+
+    data = compile_keymap(load_tables())
+    if args.check:
+        try:
+            with open(args.output, "rb") as f:
+                current = f.read()
+        except OSError:
+            current = None
+        if current != data:
+            print(f"{args.output} is out of date, run python -m tools.compile_keymap")
+            return 1
+        print(f"{args.output} is up to date")
+        return 0
+
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"wrote {len(data)} bytes to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())